@@ -0,0 +1,6 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: benchmarks/__init__.py
+"""
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: benchmarks/fixtures.py
+"""
+
+import random  # Random
+import socket  # socket, SOMAXCONN
+
+from core.tools.results import PORT_OPEN, PORT_CLOSED, PORT_FILTERED
+
+FIXTURE_HOST = "127.0.0.1"  # Loopback address the stand-in listeners are bound to.
+FIXTURE_BASE = 20000  # First port of the fixture range (below the ephemeral ports, so
+# the scanner can't accidentally connect one of its own sockets to itself).
+
+
+def ephemeral_range() -> tuple:
+    """Returns the local (ephemeral) port range of the system."""
+
+    try:
+        with open("/proc/sys/net/ipv4/ip_local_port_range") as file_obj:
+            low, high = map(int, file_obj.read().split())
+            return low, high
+    except (OSError, ValueError):
+        # Linux default.
+        return 32768, 60999
+
+
+class ListenerFixture:
+    """Stand-in TCP services for benchmarking the Scanner without any firewall rules.
+
+    The fixture covers a contiguous range of ports on a loopback address:
+        open: A listening socket completes the handshake straight away.
+        closed: Nothing is bound, so the kernel refuses the connection (RST).
+        blackholed: A listener with a full accept queue, so the kernel silently
+                    drops new SYNs and the connection times out (like a firewall).
+
+    Attributes:
+        host: The loopback address the listeners are bound to.
+        start: The first port of the fixture range.
+        end: The last port of the fixture range.
+        expected: The status each port should be scanned as.
+        sockets: Every socket kept open by the fixture.
+    """
+
+    def __init__(
+        self,
+        ports: int = 2000,
+        open_ports: int = 100,
+        blackholed_ports: int = 20,
+        host: str = FIXTURE_HOST,
+        start: int = FIXTURE_BASE,
+        seed: int = 0
+    ):
+        # Validate that the range stays clear of the ephemeral ports.
+        low, _ = ephemeral_range()
+        if start + ports - 1 >= low:
+            raise ValueError(f"fixture range must end below the ephemeral ports ({low})")
+
+        if open_ports + blackholed_ports > ports:
+            raise ValueError("more open and blackholed ports than ports in the range")
+
+        self.host = host
+        self.start = start
+        self.end = start + ports - 1
+
+        # Randomly (but repeatably) pick which ports are open and blackholed.
+        chosen = random.Random(seed).sample(range(self.start, self.end + 1),
+                                            open_ports + blackholed_ports)
+
+        self.expected = dict.fromkeys(range(self.start, self.end + 1), PORT_CLOSED)
+        self.expected.update(dict.fromkeys(chosen[:open_ports], PORT_OPEN))
+        self.expected.update(dict.fromkeys(chosen[open_ports:], PORT_FILTERED))
+
+        self.sockets = []
+
+    def listen(self, port: int, backlog: int) -> socket.socket:
+        """Binds and starts a listener on the passed port."""
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, port))
+        listener.listen(backlog)
+
+        self.sockets.append(listener)
+        return listener
+
+    def fill_backlog(self, port: int):
+        """
+        Fills the accept queue of a backlog 0 listener (which holds a single
+        connection), so that every later SYN to it is dropped.
+        """
+
+        for _ in range(2):
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.setblocking(False)
+            client.connect_ex((self.host, port))
+            self.sockets.append(client)
+
+    def start_listeners(self):
+        """
+        Starts the open and blackholed listeners of the fixture.
+        """
+
+        for port, status in self.expected.items():
+            if status == PORT_OPEN:
+                self.listen(port, socket.SOMAXCONN)
+            elif status == PORT_FILTERED:
+                self.listen(port, 0)
+                self.fill_backlog(port)
+
+    def stop_listeners(self):
+        """
+        Closes every socket of the fixture.
+        """
+
+        for sock in self.sockets:
+            sock.close()
+
+        self.sockets.clear()
+
+    def __enter__(self):
+        self.start_listeners()
+        return self
+
+    def __exit__(self, *_):
+        self.stop_listeners()
+
+    def accuracy(self, results) -> dict:
+        """Compares scan results with the expected status of every port.
+
+        Args:
+            results: The HostResults of the fixture host (see core/tools/results.py).
+
+        Returns:
+            dict: The overall accuracy, and the ports scanned wrongly for each status.
+        """
+
+        wrong = {"open": 0, "closed": 0, "filtered": 0}
+        names = {PORT_OPEN: "open", PORT_CLOSED: "closed", PORT_FILTERED: "filtered"}
+
+        for port, status in self.expected.items():
+            if results.get(port) != status:
+                wrong[names[status]] += 1
+
+        return {
+            "accuracy": 1 - sum(wrong.values()) / len(self.expected),
+            "wrong": wrong
+        }
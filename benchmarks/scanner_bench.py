@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: benchmarks/scanner_bench.py
+
+    Benchmarks the Scanner engines against local stand-in listeners.
+
+    Usage (from the repository root):
+        python -m benchmarks.scanner_bench
+        python -m benchmarks.scanner_bench --ports 5000 --save-baseline laptop
+        python -m benchmarks.scanner_bench --compare laptop
+"""
+
+import os  # devnull, path, makedirs
+import sys  # stdout, exit
+import json  # dump, load
+import time  # perf_counter
+import argparse  # ArgumentParser
+import resource  # getrusage, RUSAGE_SELF
+import multiprocessing  # get_context
+
+from benchmarks.fixtures import ListenerFixture
+from core.tools.scanner import Scanner, ENGINES, ASYNC_CONCURRENCY
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+REGRESSION_THRESHOLD = 0.10  # Allowed relative slowdown before a run counts as a regression.
+# Engines benchmarked by default, the fixture only has TCP listeners (its closed ports would be
+# open|filtered to the udp engine, which would be counted as wrong).
+BENCH_ENGINES = tuple(engine for engine in ENGINES if engine != "udp")
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Returns the value at the passed fraction (0-1) of the sorted values."""
+
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def skip_reason(engine: str) -> str:
+    """Returns why the passed engine can't be benchmarked against the fixture (blank if it can)."""
+
+    if engine not in ENGINES:
+        return "unknown engine"
+
+    if engine not in BENCH_ENGINES:
+        return "the fixture only has TCP listeners"
+
+    # The syn engine sends from raw sockets.
+    if engine == "syn" and os.geteuid() != 0:
+        return "the syn engine must be run as root"
+
+    return ""
+
+
+def run_engine(engine: str, fixture: ListenerFixture, concurrency: int, conn):
+    """Scans the fixture in a child process (so its peak memory is measured alone),
+       sending the measurements back through the passed pipe.
+
+    Args:
+        engine: The scanning engine to benchmark.
+        fixture: The running listener fixture.
+        concurrency: The asyncio engines concurrency.
+        conn: The pipe to send the measurements through.
+    """
+
+    # Hide the live scan table, as printing isn't what is being measured.
+    sys.stdout = open(os.devnull, "w")
+
+    try:
+        scanner = Scanner(fixture.host, "", engine=engine, concurrency=concurrency)
+
+        started = time.perf_counter()
+        scanner.scan_in_range(fixture.start, fixture.end)
+        elapsed = time.perf_counter() - started
+    except Exception as error:
+        # Report the failure of this engine instead of the measurements.
+        conn.send({"engine": engine, "error": f"{type(error).__name__}: {error}"})
+        conn.close()
+        return
+
+    results = scanner.results.hosts[fixture.host]
+    latencies = [latency / 10 for latency in results.latencies]  # Tenths of a ms to ms.
+
+    conn.send({
+        "engine": engine,
+        "ports": len(fixture.expected),
+        "seconds": round(elapsed, 3),
+        "ports_per_second": round(len(fixture.expected) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        **fixture.accuracy(results)
+    })
+    conn.close()
+
+
+def benchmark_engine(engine: str, fixture: ListenerFixture, concurrency: int) -> dict:
+    """Runs a single engine benchmark in a forked child process.
+
+    Returns:
+        dict: The measurements of the run (or its "error" if the engine failed).
+    """
+
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+
+    process = context.Process(target=run_engine, args=(engine, fixture, concurrency, sender))
+    process.start()
+    sender.close()
+
+    try:
+        measurements = receiver.recv()
+    except EOFError:
+        # The child died without sending anything (e.g., killed by a signal).
+        measurements = None
+
+    process.join()
+
+    return measurements or {"engine": engine, "error": f"exited with code {process.exitcode}"}
+
+
+def baseline_path(name: str) -> str:
+    """Returns where the baseline with the passed name is stored."""
+
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name: str, runs: list):
+    """
+    Saves the measurements of a benchmark as a named baseline.
+    """
+
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+
+    with open(baseline_path(name), "w") as file_obj:
+        json.dump({run["engine"]: run for run in runs if "error" not in run}, file_obj, indent=4)
+
+
+def compare(runs: list, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """Compares benchmark measurements against a saved baseline.
+
+    Args:
+        runs: The measurements of the current benchmark.
+        baseline: The saved baseline measurements (by engine).
+        threshold: The allowed relative slowdown.
+
+    Returns:
+        list: A description of every regression found.
+    """
+
+    regressions = []
+
+    for run in runs:
+        if not (previous := baseline.get(run["engine"])):
+            continue
+
+        # An engine that worked when the baseline was saved must still work.
+        if "error" in run:
+            regressions.append(f"{run['engine']} failed: {run['error']}")
+            continue
+
+        # Throughput going down, or latency/memory going up, are regressions.
+        for key, higher_is_better in (("ports_per_second", True), ("p99_ms", False),
+                                      ("peak_rss_mb", False)):
+            old, new = previous[key], run[key]
+            change = (new - old) / old if old else 0
+
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{run['engine']} {key}: {old} -> {new} ({change:+.0%})")
+
+        if run["accuracy"] < previous["accuracy"]:
+            regressions.append(
+                f"{run['engine']} accuracy: {previous['accuracy']:.4f} -> {run['accuracy']:.4f}")
+
+    return regressions
+
+
+def display(runs: list):
+    """
+    Prints the measurements of every engine as a table.
+    """
+
+    print("Engine\tPorts/s\t\tp50 (ms)\tp99 (ms)\tPeak RSS (MB)\tAccuracy")
+
+    for run in runs:
+        if "error" in run:
+            print(f"{run['engine']}\tfailed ({run['error']})")
+            continue
+
+        print(f"{run['engine']}\t{run['ports_per_second']}\t\t{run['p50_ms']}\t\t"
+              f"{run['p99_ms']}\t\t{run['peak_rss_mb']}\t\t{run['accuracy']:.2%}"
+              + (f" (wrong: {run['wrong']})" if run["accuracy"] < 1 else ""))
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Scanner engines.")
+    parser.add_argument("--ports", type=int, default=2000, help="ports in the fixture range")
+    parser.add_argument("--open", type=int, default=100, help="open ports in the range")
+    parser.add_argument("--blackholed", type=int, default=20, help="blackholed ports in the range")
+    parser.add_argument("--engines", default=",".join(BENCH_ENGINES), help="engines to benchmark")
+    parser.add_argument("--concurrency", type=int, default=ASYNC_CONCURRENCY,
+                        help="asyncio engine concurrency")
+    parser.add_argument("--seed", type=int, default=0, help="seed choosing the port layout")
+    parser.add_argument("--save-baseline", metavar="NAME", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare the results to a baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="allowed relative slowdown against the baseline")
+    parser.add_argument("--json", metavar="FILE", help="also write the results to a JSON file")
+    args = parser.parse_args(argv)
+
+    runs = []
+
+    with ListenerFixture(args.ports, args.open, args.blackholed, seed=args.seed) as fixture:
+        for engine in args.engines.split(","):
+            if reason := skip_reason(engine):
+                print(f"Skipping {engine}: {reason}")
+                continue
+
+            runs.append(benchmark_engine(engine, fixture, args.concurrency))
+
+    display(runs)
+
+    if args.json:
+        with open(args.json, "w") as file_obj:
+            json.dump(runs, file_obj, indent=4)
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, runs)
+        print(f"Baseline saved to {baseline_path(args.save_baseline)}")
+
+    if args.compare:
+        with open(baseline_path(args.compare)) as file_obj:
+            regressions = compare(runs, json.load(file_obj), args.threshold)
+
+        for regression in regressions:
+            print(f"Regression: {regression}")
+
+        # Fail (for scripts/CI) when the benchmark regressed.
+        if regressions:
+            return 1
+
+    # Fail when an engine couldn't be benchmarked.
+    return 1 if any("error" in run for run in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,62 +5,213 @@
     @package: core/handler.py
 """
 
+import os  # path, geteuid
+
 from core.tools import *
 
 
+def get_journal_inputs() -> tuple:
+    """
+    Gets the checkpoint journal file from the user, and whether to resume
+    the scan recorded in it if it already exists.
+    """
+
+    journal_file = std_input(
+        "Checkpoint journal file (ex. scan.journal) (leave blank for none)")
+
+    resume = bool(journal_file) and os.path.exists(journal_file) and std_input(
+        f"Resume the scan in {journal_file}? (y/n)") == "y"
+
+    return journal_file, resume
+
+
+def get_port_inputs() -> tuple:
+    """
+    Gets the ports to scan (as a port expression) from the user, and the order to probe them in.
+    """
+
+    expression = std_input("Ports to scan (ex. 1-9000, 1-1024,3306,!25 or top100)")
+    order = std_input(
+        f"Port order ({'/'.join(PORT_ORDERS)}) (leave blank for top)") or "top"
+
+    return expression, order
+
+
+def display_timing(scanner: Scanner):
+    """
+    Displays the connect timeout, round trip time and retry counts the
+    passed scanner used for each of its hosts.
+    """
+
+    std_info("Host timing", end=":")
+    print("Host\tTimeout (ms)\tSRTT (ms)\tTimeouts\tRetries")
+
+    for host, timing in scanner.timing.report().items():
+        srtt = f"{timing['srtt'] * 1000:.2f}" if timing["srtt"] is not None else "-"
+        print(f"{host}\t{timing['timeout'] * 1000:.2f}\t\t{srtt}\t\t"
+              f"{timing['timeouts']}\t\t{timing['retries']}")
+
+    # Display the send rates congestion control settled on.
+    std_info("Send rates", end=":")
+    print("Host\tRate (probes/s)\tSlowdowns\tSpeedups")
+
+    for host, rate in scanner.scheduler.report().items():
+        print(f"{'all' if host == '*' else host}\t{rate['rate']:.0f}\t\t"
+              f"{rate['decreases']}\t\t{rate['increases']}")
+
+
+def sort_stream(stream_file: str):
+    """
+    Offers a final pass turning the streamed results file (appended to by every
+    resumed run) into a sorted host, port and status CSV.
+    """
+
+    sorted_file = std_input(
+        "Sorted CSV of the streamed results (ex. scan.sorted.csv) (leave blank for none)", start="\n")
+
+    if not sorted_file:
+        return
+
+    write_sorted_csv(stream_file, sorted_file)
+    std_info(f"Sorted results written to {sorted_file}")
+
+
+def display_changes(scanner: Scanner):
+    """
+    Displays the ports that opened and closed since the previous scan of the
+    same hosts in the passed scanners history.
+    """
+
+    with ScanHistory(scanner.history_file) as history:
+        previous = history.previous(scanner.history_scan)
+
+        if previous is None:
+            std_info("First scan of these hosts in the history, nothing to compare")
+            return
+
+        changes = history.diff(previous, scanner.history_scan)
+
+    std_info(f"Changes since scan {previous}", end=":")
+    print("Host\tPort\tChange\tService")
+
+    for host, port, service in changes["opened"]:
+        print(f"{host}\t{port}\tOpened\t{service}")
+
+    for host, port, status in changes["closed"]:
+        print(f"{host}\t{port}\tClosed ({STATUS_NAMES[status]})")
+
+
+def display_flows(sniffer: PacketSniffer):
+    """
+    Displays the busiest flows, talkers and SYN targets of the sniffers capture.
+    """
+
+    snapshot = sniffer.flow_table.snapshot()
+
+    std_info("Flows at the end of the capture", end=":")
+
+    for line in format_flows(snapshot):
+        print(line)
+
+
 def handle_pinger():
     """
-    Handle inputs required for calling the ping_host function.
+    Handle inputs required for calling the ping_host function, or the
+    ping_sweep function when more than one host is passed.
     """
 
     # Get required host input from the user.
     host = std_input(
-        "Host to ping (ex. 1.1.1.1 or www.google.com)", start="\n")
+        "Host(s) to ping (ex. 1.1.1.1, www.google.com or 10.0.0.0/24)", start="\n")
 
     # Validate host address.
     if not host:
         std_error("Invalid host", error="blank input", start="\n")
         return
 
-    std_info(f"Pinging {host}", start="\n")
+    # Parse the hosts in case a list, range or network was passed.
+    try:
+        hosts = parse_targets(host)
+    except ValueError as error:
+        std_error("Invalid host", error=error, start="\n")
+        return
+
+    if len(hosts) == 1:
+        # Ping the parsed host (the input may be a one host range or network).
+        host = hosts[0]
+
+        std_info(f"Pinging {host}", start="\n")
+
+        # Ping the host and print its status.
+        host_status = ping_host(host)
+        std_success("Host is " +
+                    ("online" if host_status else "offline"))
+        return
+
+    std_info(f"Pinging {len(hosts)} hosts", start="\n")
 
-    # Ping the host and print its status.
-    host_status = ping_host(host)
-    std_success("Host is " +
-                ("online" if host_status else "offline"))
+    # Ping every host at once and display the ones that replied.
+    results = ping_sweep(hosts)
+    online = {host: rtt for host, rtt in results.items() if rtt is not None}
 
+    std_success(f"{len(online)}/{len(hosts)} hosts are online", end=":")
+    print("Host\tRTT (ms)")
 
-def handle_scanner():
+    for host, rtt in online.items():
+        print(f"{host}\t{rtt * 1000:.2f}")
+
+
+def handle_scanner(executor: ScanExecutor = None):
     """
     Handle inputs required for initializing a new Scanner object and
-    calling its scan_in_range function.
+    calling its scan_ports function (on the sessions executor if passed).
     """
 
     # Get required scanner inputs from the user.
     host = std_input(
         "Host to scan (ex. 1.1.1.1 or www.google.com)", start="\n")
-    range_start = std_input("Port range start (ex. 80)")
-    range_end = std_input("Port range end (ex. 9000)")
+    expression, order = get_port_inputs()
     output_file = std_input(
         "CSV output file (ex. scan.csv) (leave blank for none)")
+    stream_file = std_input(
+        "Live stream file (ex. scan.ndjson, scan.csv or scan.bin) (leave blank for none)")
+    journal_file, resume = get_journal_inputs()
+    metrics_file = std_input(
+        "Metrics file (ex. metrics.json or metrics.prom) (leave blank for none)")
+    history_file = std_input(
+        "Scan history database (ex. history.db) (leave blank for none)")
+    engine = std_input(
+        "Scan engine (async/thread/udp/syn) (leave blank for async)") or ENGINES[0]
+    fingerprint = std_input("Identify the services of open ports? (y/n)") == "y"
+    quiet = std_input("Quiet mode, only display a summary? (y/n)") == "y"
+
+    # Validate the requested scanning engine.
+    if engine not in ENGINES:
+        std_error("Invalid engine", error=f"only {'/'.join(ENGINES)} accepted", start="\n")
+        return
 
-    # Validate the supplied start and end port range.
-    try:
-        # Attempt to convert the port range strings to integers.
-        start = int(range_start)
-        end = int(range_end)
-    except:
-        std_error("Invalid range", error="only int accepted", start="\n")
+    # Validate that the syn engine can open raw sockets.
+    if engine == "syn" and os.geteuid() != 0:
+        std_error("Invalid engine", error="the syn engine must be run as root", start="\n")
         return
 
-    # Validate that the port ranges are valid.
+    # Validate the requested port order.
+    if order not in PORT_ORDERS:
+        std_error("Invalid order", error=f"only {'/'.join(PORT_ORDERS)} accepted", start="\n")
+        return
+
+    # Validate the supplied port expression.
     # (Scannable ports are in the range of 1-65535).
-    if 1 > start < 65534 or 2 > end < 65535:
-        std_error("Invalid range", error="only 1-65545 accepted", start="\n")
+    try:
+        ports = parse_ports(expression)
+    except ValueError as error:
+        std_error("Invalid ports", error=error, start="\n")
         return
 
-    # Validate that the supplied host is up.
-    if not ping_host(host):
+    # Validate that the supplied host is up, keeping its round trip time.
+    rtts = ping_sweep([host])
+
+    if rtts[host] is None:
         std_warning("Host is down! Cannot scan", start="\n", end="...")
         return
 
@@ -69,35 +220,183 @@ def handle_scanner():
     try:
         # Create a new Scanner object with the host the user wants to scan and the
         # output file the scan results should be written to (default=scan.csv).
-        scanner = Scanner(host, output_file)
+        scanner = Scanner(host, output_file, engine=engine, stream_file=stream_file,
+                          journal_file=journal_file, resume=resume,
+                          metrics=open_metrics(metrics_file), quiet=quiet,
+                          order=order, executor=executor,
+                          fingerprint=fingerprint, history_file=history_file)
+
+        # Start the hosts timeout estimate from its ping round trip time.
+        scanner.seed_timing(rtts)
 
-        # Use the scan_in_range function with the passed user inputs to scan the range.
-        scanner.scan_in_range(start, end)
+        # Use the scan_ports function with the passed user inputs to scan the ports.
+        scanner.scan_ports(ports)
 
-        # Display the range of ports scanned.
-        std_success(f"Finished scanning {end-start} ports", start="\n\n")
+        # Display the amount of ports scanned.
+        std_success(f"Finished scanning {len(ports)} ports", start="\n")
+
+        # Display the timeout the scanner settled on.
+        display_timing(scanner)
 
         # Display where the scan was saved if configured to.
         if output_file:
             std_info(f"Host scan written to {output_file}")
 
+        if stream_file:
+            std_info(f"Live results streamed to {stream_file}")
+
+        if metrics_file:
+            std_info(f"Scan metrics written to {metrics_file}")
+
+        # Display what changed since the previous scan of the same hosts.
+        if history_file:
+            display_changes(scanner)
+
+        # Sort the streamed results (covering every run of a resumed scan) if asked.
+        if stream_file:
+            sort_stream(stream_file)
+
         # Give the user the option to display all open ports from the previous host scan.
         if std_input("Display open ports? (y/n)", start="\n") == "y":
             # Print the open port table header.
             std_info("Open ports table", end=":")
-            print("ID\tPort\tStatus")
+            print("ID\tPort\tStatus\tService\tBanner")
 
-            # Enumerate through the scanned ports and display the ones
-            # with an open status (Port.status).
-            for i, port in enumerate(scanner.ports):
-                if port.status:
-                    print(f"{i+1}\t{port.port}\tOpen")
+            # Enumerate through Port views of the open ports only.
+            for i, port in enumerate(scanner.results.views(status=PORT_OPEN)):
+                service, banner = scanner.services.get((port.host, port.port), ("", ""))
+                print(f"{i+1}\t{port.port}\tOpen\t{service}\t{banner}")
 
     except Exception as error:
         # Unknown error encountered.
         print(f"[!] Failed to scan host... (error: {error})")
 
 
+def handle_sweeper(executor: ScanExecutor = None):
+    """
+    Handle inputs required for initializing a new MultiScanner object and
+    calling its scan_ports function over many hosts at once (on the sessions executor if passed).
+    """
+
+    # Get required sweep inputs from the user.
+    targets = std_input(
+        "Hosts to scan (ex. 10.0.0.0/24, 10.0.1.1-20, www.google.com)", start="\n")
+    expression, order = get_port_inputs()
+    output_file = std_input(
+        "CSV output file (ex. sweep.csv) (leave blank for none)")
+    stream_file = std_input(
+        "Live stream file (ex. sweep.ndjson, sweep.csv or sweep.bin) (leave blank for none)")
+    journal_file, resume = get_journal_inputs()
+    metrics_file = std_input(
+        "Metrics file (ex. metrics.json or metrics.prom) (leave blank for none)")
+    history_file = std_input(
+        "Scan history database (ex. history.db) (leave blank for none)")
+    rate_str = std_input(
+        "Maximum probes per second (leave blank for unlimited)")
+    host_rate_str = std_input(
+        "Maximum probes per second per host (leave blank for unlimited)")
+    workers_str = std_input(
+        "Worker processes to shard the sweep across (leave blank for none)")
+    listen = std_input(
+        "Address remote workers connect to (ex. 0.0.0.0:47000) (leave blank for local only)")
+    ping_first = std_input("Skip hosts that don't reply to ping? (y/n)") == "y"
+    fingerprint = std_input("Identify the services of open ports? (y/n)") == "y"
+    quiet = std_input("Quiet mode, only display a summary? (y/n)") == "y"
+
+    # Validate the supplied rate.
+    try:
+        # Attempt to convert the rate strings to numbers.
+        rate = float(rate_str or 0)
+        host_rate = float(host_rate_str or 0)
+    except ValueError:
+        std_error("Invalid rate", error="only numbers accepted", start="\n")
+        return
+
+    # Validate the supplied amount of workers.
+    if not (workers_str or "0").isdigit():
+        std_error("Invalid workers", error="only whole numbers accepted", start="\n")
+        return
+
+    workers = int(workers_str or 0)
+
+    # Validate the requested port order.
+    if order not in PORT_ORDERS:
+        std_error("Invalid order", error=f"only {'/'.join(PORT_ORDERS)} accepted", start="\n")
+        return
+
+    # Validate the supplied port expression.
+    try:
+        ports = parse_ports(expression)
+    except ValueError as error:
+        std_error("Invalid ports", error=error, start="\n")
+        return
+
+    try:
+        options = dict(rate=rate, host_rate=host_rate, stream_file=stream_file,
+                       journal_file=journal_file, resume=resume,
+                       metrics=open_metrics(metrics_file), quiet=quiet,
+                       order=order, fingerprint=fingerprint, history_file=history_file)
+
+        # Create a new MultiScanner object, parsing the target expression (sharded
+        # across worker processes, started here or on other nodes, if requested).
+        if workers or listen:
+            scanner = DistributedScanner(targets, output_file, workers=workers,
+                                         listen=listen or "127.0.0.1:0", **options)
+        else:
+            scanner = MultiScanner(targets, output_file, executor=executor, **options)
+    except ValueError as error:
+        std_error("Invalid hosts", error=error, start="\n")
+        return
+
+    # Remove the hosts that are down, pinging all of them at once (a resumed sweep
+    # keeps every host, only skipping the ports replayed from the journal).
+    if ping_first:
+        results = ping_sweep(scanner.hosts)
+        if not resume:
+            scanner.hosts = [host for host in scanner.hosts if results[host] is not None]
+
+        # Start each hosts timeout estimate from its ping round trip time.
+        scanner.seed_timing(results)
+
+    std_info(f"Sweeping {len(scanner.hosts)} host(s)", start="\n")
+
+    # Remote workers are started with an address of this machine and the listening port.
+    if listen:
+        std_info(f"Remote workers connect to {listen} (python worker.py ADDRESS:PORT)")
+
+    try:
+        # Scan every host over the ports, with results streamed out per host.
+        scanner.scan_ports(ports)
+
+        std_success(
+            f"Finished scanning {len(ports)} ports on {len(scanner.hosts)} host(s)", start="\n")
+
+        # Display where the sweep was saved if configured to.
+        if output_file:
+            std_info(f"Sweep written to {output_file}")
+
+        if stream_file:
+            std_info(f"Live results streamed to {stream_file}")
+
+        if metrics_file:
+            std_info(f"Scan metrics written to {metrics_file}")
+
+        # Display what changed since the previous scan of the same hosts.
+        if history_file:
+            display_changes(scanner)
+
+        # Display the timeouts the scanner settled on.
+        display_timing(scanner)
+
+        # Sort the streamed results (covering every run of a resumed sweep) if asked.
+        if stream_file:
+            sort_stream(stream_file)
+
+    except Exception as error:
+        # Unknown error encountered.
+        std_error("Failed to sweep hosts", error=error)
+
+
 def handle_sniffer():
     """
     Handle inputs required for initializing a new PacketSniffer object and
@@ -109,18 +408,83 @@ def handle_sniffer():
         "Interface to capture (ex. wlan0) (leave blank for all)", start="\n")
     output_file = std_input(
         "PCAP output file (ex. output.pcap) (leave blank for none)")
+    segment_size = std_input(
+        "Rotate the output every N megabytes (ex. 100) (leave blank for never)") or "0"
+    segment_time = std_input(
+        "Rotate the output every N seconds (ex. 300) (leave blank for never)") or "0"
+    segment_count = std_input(
+        "Output segments to keep (ex. 10) (leave blank for all)") or "0"
+    compress = std_input("Compress the closed output segments? (y/n)") == "y"
+    engine = std_input(
+        "Capture engine (tcpdump/pipe/ring) (leave blank for tcpdump)") or SNIFFER_ENGINES[0]
+    expression = std_input(
+        "Capture filter (ex. tcp port 443 and host 10.0.0.1) (leave blank for none)")
+    snaplen = std_input(
+        f"Bytes kept of each packet (ex. 96) (leave blank for {CAPTURE_SNAPLEN})") or str(CAPTURE_SNAPLEN)
+    flows = std_input("Display flows instead of packets? (pipe/ring engines) (y/n)") == "y"
+    quiet = std_input("Quiet mode, only display a summary? (y/n)") == "y"
+
+    # Validate the requested capture engine.
+    if engine not in SNIFFER_ENGINES:
+        std_error("Invalid engine", error=f"only {'/'.join(SNIFFER_ENGINES)} accepted", start="\n")
+        return
+
+    # Validate that the ring engine can open packet sockets.
+    if engine == "ring" and os.geteuid() != 0:
+        std_error("Invalid engine", error="the ring engine must be run as root", start="\n")
+        return
+
+    # Validate the capture filter before it reaches tcpdump or the kernel.
+    try:
+        validate_filter(expression, engine, interface)
+    except ValueError as error:
+        std_error("Invalid filter", error=error, start="\n")
+        return
+
+    # Validate the snapshot length.
+    if not snaplen.isdigit() or not 1 <= int(snaplen) <= CAPTURE_SNAPLEN:
+        std_error("Invalid snapshot length", error=f"must be within 1-{CAPTURE_SNAPLEN}", start="\n")
+        return
+
+    # Validate that the engine decodes the packets it captures.
+    if flows and engine == "tcpdump":
+        std_error("Invalid engine", error="flows need the pipe or ring engine", start="\n")
+        return
+
+    # Validate the output rotation.
+    if not (segment_size.isdigit() and segment_time.isdigit() and segment_count.isdigit()):
+        std_error("Invalid rotation", error="sizes, times and counts must be whole numbers", start="\n")
+        return
+
+    rotated = segment_size != "0" or segment_time != "0"
+
+    if rotated and engine == "tcpdump":
+        std_error("Invalid engine", error="rotated output needs the pipe or ring engine", start="\n")
+        return
+
+    if rotated and not output_file:
+        std_error("Invalid rotation", error="rotating the output needs an output file", start="\n")
+        return
 
     try:
         std_info("Attempting to capture packets", start="\n")
         std_info("Press CTRL-C to stop listening")
 
         # Create a new PacketSniffer object.
-        sniffer = PacketSniffer(output_file)
+        sniffer = PacketSniffer(output_file, quiet=quiet, engine=engine, flows=flows,
+                                expression=expression, snaplen=int(snaplen),
+                                segment_size=int(segment_size) * 1000000,
+                                segment_time=int(segment_time), segment_count=int(segment_count),
+                                compress=compress)
 
         # Use the capture_packets_by_interface function with the passed user input
         # of the interface to scan.
         sniffer.capture_packets_by_interface(interface, display=True)
 
+        # Display the flows the capture ended with.
+        if flows:
+            display_flows(sniffer)
+
     # KeyboardInterrupt Exception is handled when capturing the packets.
     except Exception as error:
         # Unknown error encountered.
@@ -5,18 +5,31 @@
     @package: core/interface.py
 """
 
+from functools import partial
+
 from core.handler import *
 from core.terminal import *
 from core.tools.util import clear_screen
+from core.tools.executor import ScanExecutor
 
 
 class Interface:
+    """The programs menu, owning the state shared by every tool run in the session.
+
+    Attributes:
+        executor: The ScanExecutor whose threads are reused by every scan of the session.
+        options: The display name and handle function of each menu option.
+    """
+
     def __init__(self):
+        self.executor = ScanExecutor()
+
         self.options = {
             "1": ("Host Pinger", handle_pinger),
-            "2": ("Host Scanner", handle_scanner),
+            "2": ("Host Scanner", partial(handle_scanner, executor=self.executor)),
             "3": ("Packet Sniffer", handle_sniffer),
-            "4": ("Integrity Check", handle_file_checker)
+            "4": ("Integrity Check", handle_file_checker),
+            "5": ("Host Sweep", partial(handle_sweeper, executor=self.executor))
         }
 
     def display_menu(self):
@@ -51,3 +64,10 @@ class Interface:
             option_handler()
 
             std_input("Press any key to continue", start="\n", end="...")
+
+    def shutdown(self):
+        """
+        Stops the sessions shared worker threads.
+        """
+
+        self.executor.shutdown()
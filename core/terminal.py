@@ -5,6 +5,14 @@
     @package: core/terminal.py
 """
 
+import sys  # stdout
+
+from collections import deque
+from threading import Thread, Event, Lock
+
+RENDER_FPS = 10  # How many times per second the Renderer redraws.
+RENDER_MAX_LINES = 100  # Most log lines the Renderer prints per frame (the rest are skipped).
+
 
 class Term:
     """
@@ -43,21 +51,24 @@ def std_input(text: str, start: str = "", end: str = " -> ") -> str:
     )
 
 
+def success_text(text: str, end: str = "!") -> str:
+    return f"[{Term.OKGREEN}+{Term.ENDC}] {text}{end}"
+
+
+def info_text(text: str, end: str = "...") -> str:
+    return f"[{Term.OKCYAN}*{Term.ENDC}] {text}{end}"
+
+
 def std_success(text: str, start: str = "", end: str = "!") -> None:
     print_start(start)
 
-    print(
-        f"[{Term.OKGREEN}+{Term.ENDC}] {text}",
-        end=end+'\n'
-    )
+    print(success_text(text, end))
 
 
 def std_info(text: str, start: str = "", end: str = "...") -> None:
     print_start(start)
 
-    print(
-        f"[{Term.OKCYAN}*{Term.ENDC}] {text}", end=end+'\n'
-    )
+    print(info_text(text, end))
 
 
 def std_warning(text: str, start: str = "", end: str = "!") -> None:
@@ -74,3 +85,164 @@ def std_error(text: str, start: str = "", error: Exception = None) -> None:
     print(
         f"[{Term.FAIL}!{Term.ENDC}] {text}! (error: {error})"
     )
+
+
+class Renderer:
+    """Draws the live output of a tool from a background thread at a fixed frame rate,
+       so that the tools threads never wait on the terminal.
+
+    Tools only store their latest status (update) or queue log lines (log), and every
+    frame the queued lines are printed in one write above a status table, which is
+    redrawn in place. Updates between frames are coalesced into the latest one.
+
+    Attributes:
+        columns: The headers of the status table.
+        format_row: Called with a rows values to format them when drawn (optional).
+        fps: How many times per second to redraw.
+        quiet: Only print the summary when stopped.
+        rows: The latest values of each row of the status table.
+        lines: The log lines waiting to be printed.
+        skipped: The amount of log lines skipped to keep up.
+        interactive: Whether the output is a terminal (the table is redrawn in place).
+    """
+
+    def __init__(
+        self,
+        columns: tuple = (),
+        format_row: callable = None,
+        fps: float = RENDER_FPS,
+        quiet: bool = False,
+        max_lines: int = RENDER_MAX_LINES,
+        stream=None
+    ):
+        self.columns = columns
+        self.format_row = format_row
+        self.fps = fps
+        self.quiet = quiet
+        self.max_lines = max_lines
+
+        self.stream = stream or sys.stdout
+        self.interactive = self.stream.isatty()
+
+        self.rows = {}
+        self.lines = deque()
+        self.skipped = 0
+        self.drawn = []  # The table lines currently on the screen.
+
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+
+    def update(self, key: str, *values):
+        """Replaces the values of a row in the status table (drawn on the next frame).
+
+        Args:
+            key: The row to update (rows are drawn in the order they were added).
+            *values: The rows values (formatted by format_row if configured).
+        """
+
+        self.rows[key] = values
+
+    def log(self, line: str):
+        """Queues a line to be printed above the status table on the next frame.
+
+        Args:
+            line: The line to print.
+        """
+
+        if not self.quiet:
+            self.lines.append(line)
+
+    def table(self) -> list:
+        """Formats the status table into its lines."""
+
+        if not self.rows:
+            return []
+
+        lines = ["\t".join(self.columns)] if self.columns else []
+
+        for values in list(self.rows.values()):
+            if self.format_row:
+                values = self.format_row(*values)
+
+            lines.append("\t".join(map(str, values)))
+
+        return lines
+
+    def draw(self, final: bool = False):
+        """Prints the queued log lines and redraws the status table.
+
+        Args:
+            final: Whether this is the last frame (the table is always drawn).
+        """
+
+        with self.lock:
+            output = []
+
+            # Take every queued line, only keeping the newest ones if there are too many.
+            lines = [self.lines.popleft() for _ in range(len(self.lines))]
+            table = self.table() if not self.quiet and (self.interactive or final) else []
+
+            # Leave the screen alone if nothing changed since the last frame.
+            if not lines and table == self.drawn and not final:
+                return
+
+            # Move back up over the previously drawn table and clear it.
+            if self.drawn:
+                output.append(f"\033[{len(self.drawn)}F\033[J")
+                self.drawn = []
+
+            if len(lines) > self.max_lines:
+                self.skipped += len(lines) - self.max_lines
+                output.append(info_text(f"{len(lines) - self.max_lines} lines skipped", "") + "\n")
+                lines = lines[-self.max_lines:]
+
+            output.extend(line + "\n" for line in lines)
+
+            # Redraw the table every frame on a terminal, and only once at the end otherwise.
+            output.extend(line + "\n" for line in table)
+
+            if self.interactive and not final:
+                self.drawn = table
+
+            if output:
+                self.stream.write("".join(output))
+                self.stream.flush()
+
+    def run(self):
+        """
+        Background thread drawing a frame every 1/fps seconds until stopped.
+        """
+
+        while not self.stopped.wait(1 / self.fps):
+            self.draw()
+
+    def start(self):
+        """
+        Starts drawing frames in the background.
+        """
+
+        self.stopped.clear()
+
+        if not self.thread:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self, summary: str = ""):
+        """Stops drawing frames, drawing the final frame and the summary.
+
+        Args:
+            summary: Printed after the final frame (if not blank).
+        """
+
+        self.stopped.set()
+
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+        self.draw(final=True)
+
+        if summary:
+            self.stream.write(success_text(summary) + "\n")
+            self.stream.flush()
@@ -5,7 +5,27 @@
     @package: core/tools/__init__.py
 """
 
-from core.tools.pinger import *  # Pinger
-from core.tools.sniffer import *  # PacketSniffer
-from core.tools.scanner import *  # Scanner
+from core.tools.pinger import *  # ping_host, ping_sweep
+from core.tools.sniffer import *  # PacketSniffer, SNIFFER_ENGINES, validate_filter
+from core.tools.capture import *  # RingCapture, PcapStream, PcapWriter
+from core.tools.packets import *  # decode_packet, format_packet
+from core.tools.flows import *  # FlowTable, flow_key, format_flows
+from core.tools.bpf import *  # parse_filter, compile_filter, attach_filter
+from core.tools.segments import *  # SegmentWriter, CaptureArchive
+from core.tools.scanner import *  # Scanner, MultiScanner
+from core.tools.resolver import *  # Resolver, PinnedResolver, resolve_host
+from core.tools.targets import *  # parse_targets, parse_ports, order_ports, PORT_ORDERS
+from core.tools.ratelimit import *  # TokenBucket
+from core.tools.timing import *  # RttEstimator, TimingTable
+from core.tools.results import *  # Port, ResultStore
+from core.tools.writers import *  # open_writer, read_stream, write_sorted_csv
+from core.tools.journal import *  # ScanJournal
+from core.tools.history import *  # ScanHistory
+from core.tools.metrics import *  # MetricsRegistry, open_metrics
+from core.tools.limits import *  # FdBudget, raise_fd_limit
+from core.tools.executor import *  # ScanExecutor, TaskGroup
+from core.tools.fingerprint import *  # BannerGrabber, identify
+from core.tools.udp import *  # UdpScanEngine, UDP_PAYLOADS
+from core.tools.syn import *  # SynScanEngine, SynStateTable
+from core.tools.distributed import *  # DistributedScanner, Coordinator, ScanWorker
 from core.tools.file_checker import * # FileChecker
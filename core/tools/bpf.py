@@ -0,0 +1,508 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/bpf.py
+"""
+
+import re  # compile
+import ctypes  # create_string_buffer, addressof
+import socket  # SOL_SOCKET
+import struct  # Struct, pack
+import ipaddress  # ip_address, ip_network
+
+SO_ATTACH_FILTER = 26
+SKF_AD_PROTOCOL = 0xfffff000  # SKF_AD_OFF + SKF_AD_PROTOCOL, loads the packets ethertype.
+
+# Classic BPF opcodes (see linux/filter.h).
+BPF_LD, BPF_LDX, BPF_ALU, BPF_JMP, BPF_RET = 0x00, 0x01, 0x04, 0x05, 0x06
+BPF_W, BPF_H, BPF_B = 0x00, 0x08, 0x10
+BPF_ABS, BPF_IND, BPF_LEN, BPF_MSH = 0x20, 0x40, 0x80, 0xa0
+BPF_AND, BPF_K = 0x50, 0x00
+BPF_JA, BPF_JEQ, BPF_JGT, BPF_JGE, BPF_JSET = 0x00, 0x10, 0x20, 0x30, 0x40
+BPF_SIZES = {1: BPF_B, 2: BPF_H, 4: BPF_W}
+BPF_MAX_JUMP = 255  # Conditional jumps are relative 8 bit offsets.
+BPF_MAX_INSTRUCTIONS = 4096  # The kernels limit (BPF_MAXINSNS).
+
+SOCK_FILTER = struct.Struct("HBBI")  # Opcode, jump if true, jump if false and constant.
+SOCK_FPROG = struct.Struct("HL")  # Amount of instructions and their address.
+
+ETHERTYPES = {"ip": 0x0800, "ip6": 0x86dd, "arp": 0x0806}
+IP_PROTOCOLS = {"icmp": (1, "ip"), "icmp6": (58, "ip6"), "tcp": (6, None), "udp": (17, None), "sctp": (132, None)}
+PORT_PROTOCOLS = ("tcp", "udp", "sctp")  # The protocols "port" matches without a qualifier.
+DIRECTIONS = ("src", "dst")
+FILTER_TOKEN = re.compile(r"\s*(\(|\)|&&|\|\||!|[^\s()!]+)")
+
+
+def tokenize_filter(expression: str) -> list:
+    """Splits a capture filter into its words, operators and parentheses."""
+
+    tokens, position = [], 0
+    expression = expression.strip()
+
+    while position < len(expression):
+        match = FILTER_TOKEN.match(expression, position)
+        tokens.append(match[1])
+        position = match.end()
+
+    return tokens
+
+
+class FilterParser:
+    """Parses the common subset of the tcpdump (pcap-filter) capture filter syntax.
+
+    Primitives are protocols (ip, ip6, arp, tcp, udp, sctp, icmp, icmp6),
+    [src|dst] host ADDRESS, [src|dst] net NETWORK, [tcp|udp|sctp] [src|dst]
+    port PORT / portrange FIRST-LAST (the qualifiers in any order, and ip or
+    ip6 in front of host or net), less LENGTH and greater LENGTH, combined
+    with and/&&, or/||, not/! and parentheses. Hosts must be IP addresses, and
+    lengths count from the first captured byte (the network header of cooked
+    captures).
+
+    Every primitive is parsed into a tuple tree (see compile_filter).
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = tokenize_filter(expression)
+        self.position = 0
+
+    def peek(self) -> str:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.peek()
+
+        if token is None:
+            raise ValueError(f"filter '{self.expression}' ends unexpectedly")
+
+        self.position += 1
+        return token
+
+    def parse(self) -> tuple:
+        """Returns the tree of the filter (None if blank)."""
+
+        if not self.tokens:
+            return None
+
+        tree = self.disjunction()
+
+        if self.peek() is not None:
+            raise ValueError(f"unexpected '{self.peek()}' in filter '{self.expression}'")
+
+        return tree
+
+    def disjunction(self) -> tuple:
+        tree = self.conjunction()
+
+        while self.peek() in ("or", "||"):
+            self.take()
+            tree = ("or", tree, self.conjunction())
+
+        return tree
+
+    def conjunction(self) -> tuple:
+        tree = self.negation()
+
+        while self.peek() in ("and", "&&"):
+            self.take()
+            tree = ("and", tree, self.negation())
+
+        return tree
+
+    def negation(self) -> tuple:
+        token = self.peek()
+
+        if token in ("not", "!"):
+            self.take()
+            return ("not", self.negation())
+
+        if token == "(":
+            self.take()
+            tree = self.disjunction()
+
+            if self.take() != ")":
+                raise ValueError(f"unbalanced parentheses in filter '{self.expression}'")
+
+            return tree
+
+        return self.primitive()
+
+    def primitive(self) -> tuple:
+        """Parses a primitive with its (optional) protocol and direction qualifiers."""
+
+        protocol = direction = None
+
+        while True:
+            token = self.take()
+
+            if token in ETHERTYPES or token in IP_PROTOCOLS:
+                if protocol:
+                    raise ValueError(f"'{protocol} {token}' in filter '{self.expression}'")
+
+                protocol = token
+
+                # A protocol alone is a primitive of its own.
+                if self.peek() not in DIRECTIONS + ("host", "net", "port", "portrange"):
+                    if direction:
+                        raise ValueError(f"'{direction}' without host, net or port in filter '{self.expression}'")
+
+                    return ("protocol", protocol)
+
+            elif token in DIRECTIONS:
+                if direction:
+                    raise ValueError(f"'{direction} {token}' in filter '{self.expression}'")
+
+                direction = token
+
+            elif token in ("host", "net"):
+                if protocol not in (None, "ip", "ip6"):
+                    raise ValueError(f"'{protocol} {token}' in filter '{self.expression}'")
+
+                return self.address(token, direction, protocol)
+
+            elif token in ("port", "portrange"):
+                if protocol not in (None,) + PORT_PROTOCOLS:
+                    raise ValueError(f"'{protocol} {token}' in filter '{self.expression}'")
+
+                return ("port", direction, protocol) + self.port_range(token)
+
+            elif token in ("less", "greater") and not (protocol or direction):
+                length = self.take()
+
+                if not length.isdigit():
+                    raise ValueError(f"invalid length '{length}' in filter '{self.expression}'")
+
+                return ("length", token, int(length))
+
+            else:
+                raise ValueError(f"unknown primitive '{token}' in filter '{self.expression}'")
+
+    def address(self, kind: str, direction: str, protocol: str) -> tuple:
+        """Parses the address (or network) of a host (or net) primitive."""
+
+        text = self.take()
+
+        try:
+            network = ipaddress.ip_network(text, strict=False) if kind == "net" else \
+                ipaddress.ip_network(ipaddress.ip_address(text))
+        except ValueError:
+            raise ValueError(f"invalid {kind} '{text}' in filter '{self.expression}'") from None
+
+        family = "ip" if network.version == 4 else "ip6"
+
+        if protocol and protocol != family:
+            raise ValueError(f"'{protocol} {kind} {text}' in filter '{self.expression}'")
+
+        return ("net", direction, network)
+
+    def port_range(self, kind: str) -> tuple:
+        """Parses the port (or first-last range) of a port (or portrange) primitive."""
+
+        text = self.take()
+        first, _, last = text.partition("-") if kind == "portrange" else (text, "", text)
+
+        if not first.isdigit() or not last.isdigit() or not int(first) <= int(last) <= 65535:
+            raise ValueError(f"invalid {kind} '{text}' in filter '{self.expression}'")
+
+        return int(first), int(last)
+
+
+def parse_filter(expression: str) -> tuple:
+    """Parses and validates a capture filter (see FilterParser).
+
+    Raises:
+        ValueError: If the filter isn't valid.
+
+    Returns:
+        tuple: The tree of the filter (None if blank).
+    """
+
+    return FilterParser(expression).parse()
+
+
+class FilterCompiler:
+    """Compiles a parsed capture filter into a classic BPF program.
+
+    Jumps are emitted to labels (the accepting and rejecting returns, or
+    the next operand of an and/or), and resolved into relative offsets
+    once every instruction is placed.
+
+    Attributes:
+        cooked: Whether packets start at their network header (SOCK_DGRAM sockets),
+                otherwise they start with an ethernet header.
+        network: Offset of the network header.
+        code: The instructions as [opcode, true label, false label, constant].
+        labels: The instruction index of each placed label.
+    """
+
+    def __init__(self, cooked: bool = False):
+        self.cooked = cooked
+        self.network = 0 if cooked else 14
+
+        self.code = []
+        self.labels = {}
+        self.count = 0
+
+    def label(self) -> int:
+        self.count += 1
+        return self.count
+
+    def place(self, label: int):
+        self.labels[label] = len(self.code)
+
+    def emit(self, opcode: int, constant: int = 0, true: int = None, false: int = None):
+        self.code.append([opcode, true, false, constant & 0xffffffff])
+
+    def compare(self, opcode: int, value: int, true: int, false: int):
+        self.emit(BPF_JMP | opcode | BPF_K, value, true, false)
+
+    def ethertype(self, ethertype: int, true: int, false: int):
+        """Jumps to true if the packet is of the passed ethertype."""
+
+        if self.cooked:
+            self.emit(BPF_LD | BPF_H | BPF_ABS, SKF_AD_PROTOCOL)
+        else:
+            self.emit(BPF_LD | BPF_H | BPF_ABS, 12)
+
+        self.compare(BPF_JEQ, ethertype, true, false)
+
+    def load(self, offset: int, size: int, transport: bool = False):
+        """Loads a field of the network header (or of an IPv4 transport header)."""
+
+        if transport:
+            # X = the IPv4 header length, read from its IHL.
+            self.emit(BPF_LDX | BPF_B | BPF_MSH, self.network)
+            self.emit(BPF_LD | BPF_SIZES[size] | BPF_IND, self.network + offset)
+        else:
+            self.emit(BPF_LD | BPF_SIZES[size] | BPF_ABS, self.network + offset)
+
+    def generate(self, tree: tuple, true: int, false: int):
+        """Emits the instructions jumping to true if the tree matches, else to false."""
+
+        kind = tree[0]
+
+        if kind == "and":
+            middle = self.label()
+            self.generate(tree[1], middle, false)
+            self.place(middle)
+            self.generate(tree[2], true, false)
+
+        elif kind == "or":
+            middle = self.label()
+            self.generate(tree[1], true, middle)
+            self.place(middle)
+            self.generate(tree[2], true, false)
+
+        elif kind == "not":
+            self.generate(tree[1], false, true)
+
+        elif kind == "protocol":
+            self.protocol(tree[1], true, false)
+
+        elif kind == "net":
+            self.net(tree[1], tree[2], true, false)
+
+        elif kind == "port":
+            self.port(*tree[1:], true, false)
+
+        elif kind == "length":
+            self.emit(BPF_LD | BPF_W | BPF_LEN)
+
+            if tree[1] == "less":
+                self.compare(BPF_JGT, tree[2], false, true)
+            else:
+                self.compare(BPF_JGE, tree[2], true, false)
+
+    def ip_protocol(self, family: str, number: int, true: int, false: int):
+        """Jumps to true if the packet is IPv4 (or IPv6) carrying the protocol number."""
+
+        middle = self.label()
+        self.ethertype(ETHERTYPES[family], middle, false)
+        self.place(middle)
+
+        # The IPv4 protocol, or the IPv6 next header.
+        self.load(9 if family == "ip" else 6, 1)
+        self.compare(BPF_JEQ, number, true, false)
+
+    def protocol(self, name: str, true: int, false: int):
+        if name in ETHERTYPES:
+            self.ethertype(ETHERTYPES[name], true, false)
+            return
+
+        number, family = IP_PROTOCOLS[name]
+
+        if family:
+            self.ip_protocol(family, number, true, false)
+            return
+
+        middle = self.label()
+        self.ip_protocol("ip", number, true, middle)
+        self.place(middle)
+        self.ip_protocol("ip6", number, true, false)
+
+    def net(self, direction: str, network, true: int, false: int):
+        """Jumps to true if the source (or destination, or either) address is in the network."""
+
+        # The offset of the source and destination addresses, and the word size.
+        if network.version == 4:
+            family, offsets = "ip", {"src": 12, "dst": 16}
+        else:
+            family, offsets = "ip6", {"src": 8, "dst": 24}
+
+        middle = self.label()
+        self.ethertype(ETHERTYPES[family], middle, false)
+        self.place(middle)
+
+        address = network.network_address.packed
+        mask = network.netmask.packed
+        directions = [direction] if direction else list(DIRECTIONS)
+
+        for index, side in enumerate(directions):
+            # On a mismatch, try the other direction (if any is left).
+            miss = self.label() if index < len(directions) - 1 else false
+
+            for word in range(0, len(address), 4):
+                word_mask = int.from_bytes(mask[word:word + 4], "big")
+
+                if not word_mask:
+                    break
+
+                self.load(offsets[side] + word, 4)
+
+                if word_mask != 0xffffffff:
+                    self.emit(BPF_ALU | BPF_AND | BPF_K, word_mask)
+
+                matched = self.label()
+                self.compare(BPF_JEQ, int.from_bytes(address[word:word + 4], "big"), matched, miss)
+                self.place(matched)
+
+            self.emit(BPF_JMP | BPF_JA, true)
+
+            if miss != false:
+                self.place(miss)
+
+    def port(self, direction: str, protocol: str, first: int, last: int, true: int, false: int):
+        """Jumps to true if the source (or destination, or either) port is in the range."""
+
+        protocols = [protocol] if protocol else list(PORT_PROTOCOLS)
+        ipv6 = self.label()
+
+        for family, next_family in (("ip", ipv6), ("ip6", false)):
+            # Check the protocol first, then the ports at the start of the transport header.
+            ports = self.label()
+
+            for index, name in enumerate(protocols):
+                other = self.label() if index < len(protocols) - 1 else next_family
+                self.ip_protocol(family, IP_PROTOCOLS[name][0], ports, other)
+
+                if other != next_family:
+                    self.place(other)
+
+            self.place(ports)
+
+            if family == "ip":
+                # Later fragments carry no transport header.
+                unfragmented = self.label()
+                self.load(6, 2)
+                self.emit(BPF_JMP | BPF_JSET | BPF_K, 0x1fff, next_family, unfragmented)
+                self.place(unfragmented)
+
+            directions = [direction] if direction else list(DIRECTIONS)
+
+            for index, side in enumerate(directions):
+                miss = self.label() if index < len(directions) - 1 else next_family
+                offset = 0 if side == "src" else 2
+
+                if family == "ip":
+                    self.load(offset, 2, transport=True)
+                else:
+                    self.load(40 + offset, 2)
+
+                if first == last:
+                    self.compare(BPF_JEQ, first, true, miss)
+                else:
+                    above = self.label()
+                    self.compare(BPF_JGE, first, above, miss)
+                    self.place(above)
+                    self.compare(BPF_JGT, last, miss, true)
+
+                if miss != next_family:
+                    self.place(miss)
+
+            if next_family == ipv6:
+                self.place(ipv6)
+
+    def compile(self, tree: tuple, snaplen: int) -> list:
+        """Compiles the tree into the program's instructions.
+
+        Returns:
+            list: The (opcode, jump if true, jump if false, constant) of each instruction.
+        """
+
+        accept, reject = self.label(), self.label()
+
+        if tree is not None:
+            self.generate(tree, accept, reject)
+
+        # Accepted packets are truncated to the snapshot length by the kernel.
+        self.place(accept)
+        self.emit(BPF_RET | BPF_K, snaplen)
+        self.place(reject)
+        self.emit(BPF_RET | BPF_K, 0)
+
+        program = []
+
+        for index, (opcode, true, false, constant) in enumerate(self.code):
+            if opcode == BPF_JMP | BPF_JA:
+                # Unconditional jumps hold their (32 bit) offset in the constant.
+                program.append((opcode, 0, 0, self.labels[constant] - index - 1))
+                continue
+
+            if true is None:
+                program.append((opcode, 0, 0, constant))
+                continue
+
+            jumps = (self.labels[true] - index - 1, self.labels[false] - index - 1)
+
+            if max(jumps) > BPF_MAX_JUMP:
+                raise ValueError("capture filter is too long")
+
+            program.append((opcode, *jumps, constant))
+
+        if len(program) > BPF_MAX_INSTRUCTIONS:
+            raise ValueError("capture filter is too long")
+
+        return program
+
+
+def compile_filter(expression: str, cooked: bool = False, snaplen: int = 0xffff) -> list:
+    """Compiles a capture filter (see FilterParser) into a classic BPF program.
+
+    Args:
+        expression: The capture filter (blank to accept every packet).
+        cooked: Whether the packets start at their network header (see FilterCompiler).
+        snaplen: Most bytes kept of each accepted packet.
+
+    Raises:
+        ValueError: If the filter isn't valid.
+
+    Returns:
+        list: The (opcode, jump if true, jump if false, constant) of each instruction.
+    """
+
+    return FilterCompiler(cooked).compile(parse_filter(expression), snaplen)
+
+
+def attach_filter(sock: socket.socket, program: list):
+    """
+    Attaches a BPF program (see compile_filter) to a socket, so that the kernel drops
+    the packets it rejects before they are copied to the socket.
+    """
+
+    instructions = ctypes.create_string_buffer(
+        b"".join(SOCK_FILTER.pack(*instruction) for instruction in program))
+
+    # The kernel copies the instructions from their address during the call.
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER,
+                    SOCK_FPROG.pack(len(program), ctypes.addressof(instructions)))
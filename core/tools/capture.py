@@ -0,0 +1,528 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/capture.py
+"""
+
+import mmap  # mmap, MAP_SHARED, PROT_READ, PROT_WRITE
+import select  # poll, POLLIN
+import socket  # socket, AF_PACKET, if_nametoindex, ntohs
+import struct  # Struct
+
+from threading import Event
+
+from core.tools.packets import LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL
+from core.tools.bpf import compile_filter, attach_filter
+
+ETH_P_ALL = 0x0003  # Every protocol.
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+
+TP_STATUS_KERNEL = 0  # The block belongs to the kernel (it is filling it).
+TP_STATUS_USER = 1  # The block was retired and belongs to us until handed back.
+
+ARPHRD_ETHER = 1
+ARPHRD_LOOPBACK = 772  # Loopback devices also carry (blank) ethernet headers.
+PACKET_OUTGOING = 4  # Packet type of the packets sent by this machine.
+
+CAPTURE_SNAPLEN = 262144  # Most bytes kept of each packet (tcpdump's default).
+RING_BLOCK_SIZE = 1 << 20  # Size of each ring block (a multiple of the page size, in bytes).
+RING_BLOCKS = 64  # Amount of blocks in the ring (64MiB by default).
+RING_FRAME_SIZE = 2048  # Nominal frame size (TPACKET_V3 packs packets of any size into the blocks).
+RING_TIMEOUT = 64  # Longest time the kernel fills a block before retiring it (in milliseconds).
+POLL_TIMEOUT = 100  # Longest time to wait for a block before checking whether to stop (in milliseconds).
+PCAP_BUFFER = 1 << 20  # Write buffer of pcap files (in bytes).
+PCAP_READ = 1 << 20  # Most bytes read from a pcap stream at once.
+
+# Block size, block count, frame size, frame count, retire timeout, private area size and features.
+TPACKET_REQ3 = struct.Struct("IIIIIII")
+PACKET_MREQ = struct.Struct("iHH8s")  # Interface index, membership type, address length and address.
+TPACKET_STATS_V3 = struct.Struct("III")  # Packets, drops and times the ring was full.
+
+# The block descriptor: version, offset to the private area, then the block header's
+# status, packet count and offset to the first packet.
+BLOCK_HEADER = struct.Struct("IIIII")
+BLOCK_STATUS = struct.Struct("I")
+BLOCK_STATUS_OFFSET = 8
+
+# Offset to the next packet, seconds, nanoseconds, captured length, wire length, status,
+# offset to the link layer and offset to the network layer of a packet in a block.
+TPACKET3_HEADER = struct.Struct("IIIIIIHH")
+SOCKADDR_LL_OFFSET = 48  # TPACKET_ALIGN(sizeof(struct tpacket3_hdr)).
+# Family, protocol, interface index, hardware type, packet type, address length and address.
+SOCKADDR_LL = struct.Struct("HHiHBB8s")
+SOCKADDR_LL_TYPE = struct.Struct("HB")  # Only the hardware and packet type (at offset 8).
+SLL_HEADER = struct.Struct("!HHH8sH")  # The cooked header built from the sockaddr_ll.
+
+# Magic, version, time zone, timestamp accuracy, snapshot length and link type.
+PCAP_HEADER = struct.Struct("<IHHiIII")
+PCAP_RECORD = struct.Struct("<IIII")  # Seconds, microseconds, captured length and wire length.
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NANO = 0xa1b23c4d  # Files with nanosecond timestamps.
+
+
+def link_type(interface: str) -> int:
+    """Returns the pcap link type a capture of the interface produces (see RingCapture).
+
+    Ethernet (and loopback) interfaces are captured with their own headers, every
+    other interface (and every interface at once) with Linux cooked headers.
+    """
+
+    if not interface:
+        return LINKTYPE_LINUX_SLL
+
+    return (LINKTYPE_ETHERNET if hardware_type(interface) in (ARPHRD_ETHER, ARPHRD_LOOPBACK)
+            else LINKTYPE_LINUX_SLL)
+
+
+def hardware_type(interface: str) -> int:
+    """Returns the ARPHRD hardware type of an interface (None if it can't be read)."""
+
+    try:
+        with open(f"/sys/class/net/{interface}/type") as file_obj:
+            return int(file_obj.read())
+    except (OSError, ValueError):
+        return None
+
+
+class PcapWriter:
+    """Writes captured packets straight into a pcap file (readable by tcpdump and wireshark).
+
+    Attributes:
+        path: The pcap file.
+        link_type: The link layer of the packets (LINKTYPE_ETHERNET or LINKTYPE_LINUX_SLL).
+        snaplen: Most bytes kept of each packet.
+        packets: The amount of packets written.
+        size: The amount of bytes written (headers included).
+    """
+
+    def __init__(self, path: str, link_type: int = LINKTYPE_ETHERNET,
+                 snaplen: int = CAPTURE_SNAPLEN, buffering: int = PCAP_BUFFER):
+        self.path = path
+        self.link_type = link_type
+        self.snaplen = snaplen
+
+        self.file = open(path, "wb", buffering=buffering)
+        self.file.write(PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, snaplen, link_type))
+
+        self.packets = 0
+        self.size = PCAP_HEADER.size
+
+    def write(self, seconds: int, microseconds: int, length: int, header: bytes, data):
+        """Writes a packet, truncated to the snapshot length.
+
+        Args:
+            seconds: When the packet was captured (seconds since the epoch).
+            microseconds: The microseconds of the capture time.
+            length: The length of the packet on the wire (header included).
+            header: The link layer header built for the packet (blank if part of data).
+            data: The captured bytes of the packet (bytes or memoryview).
+        """
+
+        captured = len(header) + len(data)
+
+        if captured > self.snaplen:
+            data = data[:self.snaplen - len(header)]
+            captured = self.snaplen
+
+        self.file.write(PCAP_RECORD.pack(seconds, microseconds, captured, length))
+
+        if header:
+            self.file.write(header)
+
+        self.file.write(data)
+
+        self.packets += 1
+        self.size += PCAP_RECORD.size + captured
+
+    def write_block(self, packets: list):
+        """
+        Writes every packet of a block handed out by RingCapture.
+        """
+
+        for seconds, nanoseconds, length, header, data in packets:
+            self.write(seconds, nanoseconds // 1000, length, header, data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class PcapStream:
+    """Reads the packets of a pcap stream (like tcpdump -w -) in large buffered reads.
+
+    Each read is handed out as a block of packets in the same (seconds,
+    nanoseconds, length, header, data) form as RingCapture, where data is
+    a memoryview slice of the read (valid until the next block is read).
+    The raw bytes read can be copied as they are into a tee file, which is
+    then a valid pcap file of its own.
+
+    Attributes:
+        stream: The binary stream to read (a pipe or file opened without buffering).
+        tee: File the raw stream is copied to (None for no copy).
+        read_size: Most bytes read at once.
+        link_type: The link type from the streams header (None until read).
+        snaplen: The snapshot length from the streams header (None until read).
+        packets: The amount of packets read.
+        size: The amount of bytes on the wire of the packets read.
+    """
+
+    def __init__(self, stream, tee=None, read_size: int = PCAP_READ):
+        self.stream = stream
+        self.tee = tee
+        self.read_size = read_size
+
+        self.link_type = self.snaplen = None
+        self.record = None  # The record header format (in the streams byte order).
+        self.scale = 1000  # Multiplier from the streams timestamp fractions to nanoseconds.
+        self.pending = b""  # The start of a record split between reads.
+
+        self.packets = self.size = 0
+
+    def read_header(self, view) -> bool:
+        """Parses the streams global header, returning whether it was valid."""
+
+        for order in "<>":
+            magic, _, _, _, _, snaplen, link_type = struct.unpack_from(order + "IHHiIII", view)
+
+            if magic in (PCAP_MAGIC, PCAP_MAGIC_NANO):
+                self.record = struct.Struct(order + "IIII")
+                self.scale = 1 if magic == PCAP_MAGIC_NANO else 1000
+                self.snaplen, self.link_type = snaplen, link_type
+                return True
+
+        return False
+
+    def blocks(self):
+        """Reads the stream until its end (continuing where the last call stopped).
+
+        Yields:
+            list: The packets completed by each read (see PcapStream).
+        """
+
+        while chunk := self.stream.read(self.read_size):
+            if self.tee:
+                self.tee.write(chunk)
+
+            # A record split between reads is completed by the next one.
+            data = self.pending + chunk if self.pending else chunk
+            view = memoryview(data)
+            offset = 0
+
+            if self.record is None:
+                if len(data) < PCAP_HEADER.size:
+                    self.pending = data
+                    continue
+
+                if not self.read_header(view):
+                    raise ValueError("not a pcap stream")
+
+                offset = PCAP_HEADER.size
+
+            packets = []
+            record, scale, end = self.record, self.scale, len(data)
+
+            while offset + PCAP_RECORD.size <= end:
+                seconds, fraction, captured, length = record.unpack_from(view, offset)
+                start = offset + PCAP_RECORD.size
+
+                if start + captured > end:
+                    break
+
+                packets.append((seconds, fraction * scale, length, b"", view[start:start + captured]))
+                offset = start + captured
+
+            self.pending = data[offset:]
+
+            self.packets += len(packets)
+            self.size += sum(packet[2] for packet in packets)
+
+            yield packets
+
+            # The consumer is done with the reads memory.
+            for packet in packets:
+                packet[4].release()
+
+            view.release()
+
+
+class RingCapture:
+    """Captures packets in-process through an AF_PACKET socket and a memory-mapped
+       TPACKET_V3 ring, without tcpdump.
+
+    The kernel copies packets straight into blocks of a ring shared with this
+    process and retires a block once it is full (or RING_TIMEOUT passed), so a
+    whole block of packets is read without a single system call, and poll is
+    only called when the ring is empty. Each block is handed to the consumer as
+    a list of (seconds, nanoseconds, length, header, data) tuples, where data
+    is a memoryview into the ring (valid until the consumer returns, copy it
+    with bytes to keep it) and header the cooked header to prepend (blank when
+    data starts with the ethernet header).
+
+    A capture filter (see parse_filter) is compiled to BPF and attached to
+    the socket, so the kernel drops unwanted packets, and truncates wanted
+    ones to the snapshot length, before they are copied into the ring.
+
+    The kernel hands a capture of a loopback interface every packet twice (as
+    sent and as received), so the sent copies are dropped like libpcap does.
+
+    Attributes:
+        interface: The interface to capture on (blank for every interface).
+        promiscuous: Whether to capture packets addressed to other machines too.
+        expression: The capture filter (blank to capture every packet).
+        snaplen: Most bytes kept of each packet.
+        program: The BPF program attached to the socket (None if every packet is kept whole).
+        link_type: The link layer of the packets handed out (see link_type).
+        loopback: Whether the capture sees a loopback interface (and drops its sent copies).
+        received: The amount of packets the kernel saw (dropped ones included).
+        dropped: The amount of packets dropped because the ring was full.
+        freezes: The amount of times the ring filled up.
+        packets: The amount of packets handed to the consumer.
+        size: The amount of bytes on the wire of the packets handed to the consumer.
+    """
+
+    def __init__(
+        self,
+        interface: str = "",
+        promiscuous: bool = False,
+        block_size: int = RING_BLOCK_SIZE,
+        blocks: int = RING_BLOCKS,
+        timeout: int = RING_TIMEOUT,
+        expression: str = "",
+        snaplen: int = CAPTURE_SNAPLEN
+    ):
+        self.interface = interface
+        self.promiscuous = promiscuous
+        self.expression = expression
+        self.snaplen = snaplen
+        self.block_size = block_size
+        self.blocks = blocks
+        self.timeout = timeout
+
+        self.link_type = link_type(interface)
+        # Cooked captures read from the network header and build the link header themselves.
+        self.cooked = self.link_type == LINKTYPE_LINUX_SLL
+        self.loopback = not interface or hardware_type(interface) == ARPHRD_LOOPBACK
+
+        # Compiled up front, so an invalid filter fails before the capture starts.
+        self.program = None
+
+        if expression or snaplen < CAPTURE_SNAPLEN:
+            self.program = compile_filter(expression, self.cooked, snaplen)
+
+        self.sock = None
+        self.poller = None
+        self.ring = None
+        self.view = None
+        self.block = 0  # The next block to read.
+
+        self.received = self.dropped = self.freezes = 0
+        self.packets = self.size = 0
+
+        self.stopped = Event()
+
+    def open(self):
+        """
+        Opens the packet socket and maps its ring into memory.
+        """
+
+        kind = socket.SOCK_DGRAM if self.cooked else socket.SOCK_RAW
+
+        # A socket for a single interface is opened without a protocol, so it receives
+        # nothing (from any interface) until it is bound. An unbound packet socket
+        # captures every interface.
+        protocol = 0 if self.interface else socket.htons(ETH_P_ALL)
+        self.sock = socket.socket(socket.AF_PACKET, kind, protocol)
+
+        try:
+            # Filter before the socket receives anything, so no unfiltered packet reaches the ring.
+            if self.program:
+                attach_filter(self.sock, self.program)
+
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+
+            # Bind (starting the capture) before the ring exists, like libpcap.
+            if self.interface:
+                self.sock.bind((self.interface, ETH_P_ALL))
+
+                if self.promiscuous:
+                    index = socket.if_nametoindex(self.interface)
+                    self.sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP,
+                                         PACKET_MREQ.pack(index, PACKET_MR_PROMISC, 0, b""))
+
+            frames = self.block_size // RING_FRAME_SIZE * self.blocks
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, TPACKET_REQ3.pack(
+                self.block_size, self.blocks, RING_FRAME_SIZE, frames, self.timeout, 0, 0))
+
+            self.ring = mmap.mmap(self.sock.fileno(), self.block_size * self.blocks,
+                                  mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            self.view = memoryview(self.ring)
+        except OSError:
+            self.close()
+            raise
+
+        self.poller = select.poll()
+        self.poller.register(self.sock, select.POLLIN)
+        self.block = 0
+
+    def close(self):
+        """
+        Unmaps the ring and closes the packet socket.
+        """
+
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+
+        if self.ring is not None:
+            try:
+                self.ring.close()
+            except BufferError:
+                # A consumer kept a view of a packet, the ring is unmapped once it is freed.
+                pass
+
+            self.ring = None
+
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def statistics(self) -> tuple:
+        """Adds the kernels counters (reset on every read) to the capture totals.
+
+        Returns:
+            tuple: The total (received, dropped, freezes) so far.
+        """
+
+        if self.sock is not None:
+            received, dropped, freezes = TPACKET_STATS_V3.unpack(
+                self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS_V3.size))
+
+            self.received += received
+            self.dropped += dropped
+            self.freezes += freezes
+
+        return self.received, self.dropped, self.freezes
+
+    def read_block(self, offset: int) -> list:
+        """Returns the packets of the retired block at the passed offset of the ring."""
+
+        view, loopback = self.view, self.loopback
+        packets = []
+
+        _, _, _, count, position = BLOCK_HEADER.unpack_from(view, offset)
+        position += offset
+
+        for _ in range(count):
+            (next_offset, seconds, nanoseconds, captured,
+             length, _, mac, net) = TPACKET3_HEADER.unpack_from(view, position)
+
+            if loopback:
+                hardware, kind = SOCKADDR_LL_TYPE.unpack_from(view, position + SOCKADDR_LL_OFFSET + 8)
+
+                # Skip the sent copy of a loopback packet (its received copy is kept).
+                if kind == PACKET_OUTGOING and hardware == ARPHRD_LOOPBACK:
+                    position += next_offset
+                    continue
+
+            if self.cooked:
+                _, protocol, _, hardware, kind, address_length, address = SOCKADDR_LL.unpack_from(
+                    view, position + SOCKADDR_LL_OFFSET)
+                header = SLL_HEADER.pack(kind, hardware, address_length, address, socket.ntohs(protocol))
+
+                start = position + net
+                packets.append((seconds, nanoseconds, length + len(header), header,
+                                view[start:start + captured]))
+            else:
+                start = position + mac
+                packets.append((seconds, nanoseconds, length, b"", view[start:start + captured]))
+
+            position += next_offset
+
+        return packets
+
+    def next_block(self, timeout: int = POLL_TIMEOUT) -> int:
+        """Waits for the next block to be retired by the kernel.
+
+        Returns:
+            int: The blocks offset in the ring (None if none was retired before the timeout).
+        """
+
+        offset = self.block * self.block_size
+
+        if not BLOCK_STATUS.unpack_from(self.view, offset + BLOCK_STATUS_OFFSET)[0] & TP_STATUS_USER:
+            # The ring is empty, sleep until the kernel retires the block.
+            self.poller.poll(timeout)
+
+            if not BLOCK_STATUS.unpack_from(self.view, offset + BLOCK_STATUS_OFFSET)[0] & TP_STATUS_USER:
+                return None
+
+        return offset
+
+    def release_block(self, offset: int):
+        """
+        Hands a read block back to the kernel and moves on to the next one.
+        """
+
+        BLOCK_STATUS.pack_into(self.view, offset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+        self.block = (self.block + 1) % self.blocks
+
+    def run(self, on_block: callable, count: int = 0):
+        """Captures packets until stopped (see stop), handing each block to a consumer.
+
+        Args:
+            on_block: Called with the packets of each block (see RingCapture).
+            count: Stop after this many packets (0 to capture until stopped).
+        """
+
+        self.stopped.clear()
+        self.open()
+
+        try:
+            while not self.stopped.is_set():
+                offset = self.next_block()
+
+                if offset is None:
+                    continue
+
+                packets = self.read_block(offset)
+
+                try:
+                    on_block(packets)
+                finally:
+                    # The consumer is done with the blocks memory.
+                    for packet in packets:
+                        packet[4].release()
+
+                    self.release_block(offset)
+
+                self.packets += len(packets)
+                self.size += sum(packet[2] for packet in packets)
+
+                if count and self.packets >= count:
+                    break
+
+        finally:
+            self.statistics()
+            self.close()
+
+    def stop(self):
+        """
+        Stops the capture after the block being read (the next poll timeout at the latest).
+        """
+
+        self.stopped.set()
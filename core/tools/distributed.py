@@ -0,0 +1,799 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/distributed.py
+"""
+
+import os  # path, getpid, cpu_count
+import sys  # executable
+import json  # dumps, loads
+import time  # monotonic
+import socket  # create_connection, gethostname
+import asyncio  # run, start_server, wait_for, Event
+import subprocess  # Popen, DEVNULL, TimeoutExpired
+
+from collections import deque
+from threading import Thread, Event, Lock
+
+from core.terminal import info_text
+from core.tools.scanner import MultiScanner
+from core.tools.targets import parse_ports, compress_ports
+from core.tools.results import PORT_UNSCANNED
+from core.tools.executor import SHUTDOWN_TIMEOUT
+
+PROTOCOL_VERSION = 1  # Version of the coordinator/worker protocol.
+SHARD_SIZE = 4096  # Most (host, port) probes handed to a worker at once.
+STEAL_MIN = 256  # Fewest probes a shard must have left for half of them to be stolen.
+SHARD_ATTEMPTS = 3  # How many times a shard may fail before its probes are given up.
+RESULT_BATCH = 512  # How many results a worker buffers before sending them.
+RESULT_INTERVAL = 0.5  # Longest time a worker keeps results buffered (in seconds).
+HEARTBEAT_INTERVAL = 1.0  # How often workers tell the coordinator they are alive (in seconds).
+WORKER_TIMEOUT = 10.0  # How long a silent worker is given before it is considered lost (in seconds).
+CONNECT_TIMEOUT = 30.0  # How long to wait for a worker to connect (or to connect to the coordinator).
+MESSAGE_LIMIT = 16 << 20  # Longest protocol message (in bytes).
+
+# The Scanner options passed on to the workers.
+WORKER_OPTIONS = ("engine", "concurrency", "rate", "host_rate", "congestion", "adaptive", "fingerprint")
+
+# The script local worker processes are started from (next to main.py).
+WORKER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "worker.py")
+
+
+def encode_message(message: dict) -> bytes:
+    """Encodes a protocol message (one JSON object per line, like the ndjson stream format)."""
+
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+
+def parse_address(text: str, default_port: int = 0) -> tuple:
+    """Parses a host:port address ([::1]:47000 for IPv6 addresses).
+
+    Args:
+        text: The address to parse.
+        default_port: The port of addresses without one.
+
+    Returns:
+        tuple: The (host, port) of the address.
+
+    Raises:
+        ValueError: The port isn't a valid port number.
+    """
+
+    if text.startswith("["):
+        host, _, port = text[1:].partition("]")
+        port = port.lstrip(":")
+    elif text.count(":") == 1:
+        host, port = text.split(":")
+    else:
+        host, port = text, ""
+
+    # Validate the port.
+    if port and (not port.isdigit() or int(port) > 65535):
+        raise ValueError(f"invalid port in address '{text}'")
+
+    return host or "127.0.0.1", int(port or default_port)
+
+
+def format_address(host: str, port: int) -> str:
+    """Formats a (host, port) as an address accepted by parse_address."""
+
+    return f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+
+
+class Shard:
+    """A block of (host, port) probes handed to a single worker.
+
+    Attributes:
+        id: Identifies the shard in the messages about it.
+        hosts: The hosts of the shard.
+        ports: The ports of the shard (workers probe them in ascending order).
+        remaining: The (host, port) probes that haven't been reported yet.
+        attempts: How many times the shard has failed.
+        owner: The WorkerLink scanning the shard (None while queued).
+    """
+
+    __slots__ = ("id", "hosts", "ports", "remaining", "attempts", "owner")
+
+    def __init__(self, id: int, hosts: list, ports: list, remaining: set, attempts: int = 0):
+        self.id = id
+        self.hosts = hosts
+        self.ports = ports
+        self.remaining = remaining
+        self.attempts = attempts
+        self.owner = None
+
+
+class WorkerLink:
+    """The coordinators end of a connected worker.
+
+    Attributes:
+        name: The name the worker introduced itself with.
+        writer: The asyncio StreamWriter of the connection.
+        shard: The shard the worker is scanning (None while idle).
+        seen: When the worker last sent anything (time.monotonic).
+    """
+
+    __slots__ = ("name", "writer", "shard", "seen")
+
+    def __init__(self, name: str, writer: asyncio.StreamWriter):
+        self.name = name
+        self.writer = writer
+        self.shard = None
+        self.seen = time.monotonic()
+
+
+class Coordinator:
+    """Hands out shards of a scan to worker processes (local or on other nodes)
+       over a line based JSON protocol, merging the results they stream back.
+
+    Workers connect and introduce themselves (hello), are sent a shard, stream
+    its results back in batches, and are sent the next shard once they report
+    it done. Once every shard has been handed out, an idle worker steals the
+    upper half of the ports left in the largest running shard (the victim is
+    told to skip them). A worker that disconnects, errors or stops sending
+    heartbeats is lost, and the probes it hadn't reported are queued again (up
+    to SHARD_ATTEMPTS times).
+
+    Messages (one JSON object per line):
+        worker: hello, results, done, error, heartbeat.
+        coordinator: shard, steal, exit.
+
+    Attributes:
+        listen: The address workers connect to.
+        port: The port workers connect to (any free port if 0, see address).
+        workers: How many local worker processes to start (worker.py).
+        options: The Scanner options sent to the workers with each shard.
+        on_result: Called with (host, port, status, latency, service) for each reported port.
+        on_event: Called with a description of each worker event (joined, lost, steals).
+        connect_timeout: Longest time to wait without any worker while work remains.
+        address: The (host, port) the coordinator is listening on (once running).
+        links: The connected workers.
+        active: The shards being scanned, by their id.
+        queue: The shards queued again after a failure (handed out first).
+        steals: How many times work was stolen.
+        failures: How many shards failed.
+        abandoned: How many probes were given up after SHARD_ATTEMPTS failures.
+    """
+
+    def __init__(
+        self,
+        listen: str = "127.0.0.1",
+        port: int = 0,
+        workers: int = 0,
+        options: dict = None,
+        on_result: callable = None,
+        on_event: callable = None,
+        connect_timeout: float = CONNECT_TIMEOUT
+    ):
+        self.listen = listen
+        self.port = port
+        self.workers = workers
+        self.options = options or {}
+        self.on_result = on_result
+        self.on_event = on_event
+        self.connect_timeout = connect_timeout
+
+        self.address = None
+        self.links = set()
+        self.handlers = set()
+        self.active = {}
+        self.queue = deque()
+        self.processes = []
+
+        self.shards = iter(())
+        self.exhausted = False
+        self.next_id = 0
+        self.finished = None
+        self.alone_since = time.monotonic()
+
+        self.steals = 0
+        self.failures = 0
+        self.abandoned = 0
+
+    def event(self, text: str):
+        if self.on_event:
+            self.on_event(text)
+
+    def new_shard(self, hosts: list, ports: list, remaining: set, attempts: int = 0) -> Shard:
+        self.next_id += 1
+        return Shard(self.next_id, hosts, ports, remaining, attempts)
+
+    def spawn(self):
+        """
+        Starts the local worker processes, connecting them to the coordinator over loopback.
+        """
+
+        host, port = self.address[:2]
+
+        # Local workers reach a wildcard address over loopback.
+        if host in ("0.0.0.0", "::"):
+            host = "127.0.0.1" if host == "0.0.0.0" else "::1"
+
+        for _ in range(self.workers):
+            self.processes.append(subprocess.Popen(
+                [sys.executable, WORKER_SCRIPT, format_address(host, port)],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            ))
+
+    def stop_processes(self):
+        """
+        Waits for the local worker processes to exit, killing the ones that don't.
+        """
+
+        for process in self.processes:
+            try:
+                process.wait(SHUTDOWN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+        self.processes.clear()
+
+    def send(self, link: WorkerLink, message: dict):
+        if not link.writer.is_closing():
+            link.writer.write(encode_message(message))
+
+    def next_shard(self) -> Shard:
+        """Returns the next shard to hand out (None once there is nothing left to steal)."""
+
+        if self.queue:
+            return self.queue.popleft()
+
+        if not self.exhausted:
+            try:
+                return self.new_shard(*next(self.shards))
+            except StopIteration:
+                self.exhausted = True
+
+        return self.steal()
+
+    def steal(self) -> Shard:
+        """Takes the upper half of the ports left in the largest running shard.
+
+        Returns:
+            Shard: The stolen probes (None if no shard has enough left to split).
+        """
+
+        candidates = [shard for shard in self.active.values() if len(shard.remaining) >= STEAL_MIN]
+
+        if not candidates:
+            return None
+
+        victim = max(candidates, key=lambda shard: len(shard.remaining))
+        ports = sorted({port for _, port in victim.remaining})
+
+        # Workers probe their ports in ascending order, so the upper half is scanned last.
+        if len(ports) < 2:
+            return None
+
+        stolen_ports = ports[len(ports) // 2:]
+        stolen = {(host, port) for host, port in victim.remaining if port >= stolen_ports[0]}
+        victim.remaining -= stolen
+
+        # Tell the victim to skip the stolen ports (ones already in flight are reported twice,
+        # and merged by on_result).
+        self.send(victim.owner, {"type": "steal", "shard": victim.id,
+                                 "ports": compress_ports(stolen_ports)})
+
+        self.steals += 1
+        self.event(f"Stole {len(stolen)} probe(s) from worker {victim.owner.name}")
+
+        hosts = {host for host, _ in stolen}
+        return self.new_shard([host for host in victim.hosts if host in hosts], stolen_ports, stolen)
+
+    def dispatch(self, link: WorkerLink):
+        """
+        Hands the next shard to an idle worker (or checks whether the scan has finished).
+        """
+
+        if not (shard := self.next_shard()):
+            self.check_finished()
+            return
+
+        link.shard, shard.owner = shard, link
+        self.active[shard.id] = shard
+
+        self.send(link, {
+            "type": "shard",
+            "id": shard.id,
+            "hosts": shard.hosts,
+            "ports": compress_ports(shard.ports),
+            "options": self.options
+        })
+
+    def dispatch_idle(self):
+        """
+        Hands out shards to every idle worker.
+        """
+
+        for link in list(self.links):
+            if link.shard is None:
+                self.dispatch(link)
+
+    def fail(self, shard: Shard, reason: str):
+        """Queues the unreported probes of a failed shard again (or gives them up).
+
+        Args:
+            shard: The shard that failed.
+            reason: Why the shard failed.
+        """
+
+        self.active.pop(shard.id, None)
+        self.failures += 1
+
+        if not shard.remaining:
+            return
+
+        if shard.attempts + 1 < SHARD_ATTEMPTS:
+            ports = sorted({port for _, port in shard.remaining})
+            hosts = {host for host, _ in shard.remaining}
+
+            self.queue.append(self.new_shard([host for host in shard.hosts if host in hosts],
+                                             ports, shard.remaining, shard.attempts + 1))
+            self.event(f"Requeued {len(shard.remaining)} probe(s) ({reason})")
+        else:
+            self.abandoned += len(shard.remaining)
+            self.event(f"Gave up on {len(shard.remaining)} probe(s) ({reason})")
+
+    def check_finished(self):
+        """
+        Finishes the scan once every shard has been handed out and completed.
+        """
+
+        if self.exhausted and not self.queue and not self.active:
+            self.finished.set()
+
+    def handle_message(self, link: WorkerLink, message: dict):
+        """
+        Handles a message sent by a worker.
+        """
+
+        kind = message.get("type")
+        shard = link.shard
+
+        if kind == "results":
+            reporting = self.active.get(message.get("shard"))
+
+            for host, port, status, latency, service, banner in message["rows"]:
+                if reporting:
+                    reporting.remaining.discard((host, port))
+
+                if self.on_result:
+                    self.on_result(host, port, status, latency, (service, banner) if service else None)
+
+        elif kind in ("done", "error") and shard and message.get("shard") == shard.id:
+            link.shard = None
+
+            if kind == "error":
+                self.fail(shard, f"worker {link.name} failed: {message.get('error')}")
+            elif shard.remaining:
+                # Every result is sent before done, so anything left was skipped.
+                self.fail(shard, f"worker {link.name} skipped them")
+            else:
+                self.active.pop(shard.id, None)
+
+            self.dispatch_idle()
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves a connected worker until it disconnects (or is lost).
+        """
+
+        self.handlers.add(asyncio.current_task())
+
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), WORKER_TIMEOUT))
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            writer.close()
+            return
+
+        # Validate the workers introduction.
+        if hello.get("type") != "hello" or hello.get("version") != PROTOCOL_VERSION:
+            writer.close()
+            return
+
+        link = WorkerLink(hello.get("worker") or format_address(*writer.get_extra_info("peername")[:2]),
+                          writer)
+        self.links.add(link)
+        self.event(f"Worker {link.name} joined")
+
+        self.dispatch(link)
+
+        try:
+            while line := await reader.readline():
+                link.seen = time.monotonic()
+                self.handle_message(link, json.loads(line))
+        except (ConnectionError, ValueError, KeyError):
+            pass
+        finally:
+            self.links.discard(link)
+            writer.close()
+
+            if not self.links:
+                self.alone_since = time.monotonic()
+
+            # Hand the probes of the lost worker to the others.
+            if link.shard and not self.finished.is_set():
+                self.event(f"Worker {link.name} lost")
+                self.fail(link.shard, f"worker {link.name} lost")
+                self.dispatch_idle()
+
+            self.check_finished()
+            self.handlers.discard(asyncio.current_task())
+
+    def check_workers(self):
+        """Disconnects the workers that stopped sending heartbeats.
+
+        Raises:
+            RuntimeError: No worker has been connected for connect_timeout while work remains.
+        """
+
+        now = time.monotonic()
+
+        for link in list(self.links):
+            if now - link.seen > WORKER_TIMEOUT:
+                # Closing the connection ends its handle_worker, which requeues its shard.
+                link.writer.close()
+
+        if self.links:
+            return
+
+        if self.processes and all(process.poll() is not None for process in self.processes) \
+                and self.listen in ("127.0.0.1", "::1", "localhost"):
+            raise RuntimeError("every worker process exited")
+
+        if now - self.alone_since > self.connect_timeout:
+            raise RuntimeError(f"no workers connected for {self.connect_timeout:.0f} seconds")
+
+    async def run(self, shards):
+        """Scans the passed shards on the workers until every probe has been reported.
+
+        Args:
+            shards: The (hosts, ports, remaining probes) of each shard.
+
+        Raises:
+            RuntimeError: The workers exited (or never connected) while work remained.
+        """
+
+        self.shards = iter(shards)
+        self.exhausted = False
+        self.finished = asyncio.Event()
+
+        server = await asyncio.start_server(self.handle_worker, self.listen, self.port,
+                                            limit=MESSAGE_LIMIT)
+        self.address = server.sockets[0].getsockname()[:2]
+        self.alone_since = time.monotonic()
+
+        self.event(f"Listening for workers on {format_address(*self.address)}")
+        self.spawn()
+
+        try:
+            # Check on the workers until every shard has completed.
+            while not self.finished.is_set():
+                try:
+                    await asyncio.wait_for(self.finished.wait(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    self.check_workers()
+        finally:
+            # Tell every worker to exit, closing their connections.
+            for link in list(self.links):
+                self.send(link, {"type": "exit"})
+                link.writer.close()
+
+            # Let every connection finish reading before the loop closes.
+            await asyncio.gather(*self.handlers, return_exceptions=True)
+
+            server.close()
+            await server.wait_closed()
+
+            self.stop_processes()
+
+
+class DistributedScanner(MultiScanner):
+    """Scans many hosts at once by sharding their (host, port) probes across worker
+       processes (see Coordinator), so that the scan isn't limited to a single core.
+
+    Results are merged into the DistributedScanner as they are streamed back, so
+    the stream file, journal, metrics and live scan table work like a MultiScanner.
+
+    Attributes:
+        worker_options: The Scanner options passed on to the workers (with the
+                        rate limits shared between them).
+        shard_size: Most (host, port) probes in each shard.
+        coordinator: The Coordinator handing out the shards.
+    """
+
+    def __init__(
+        self,
+        targets: str,
+        output_file: str,
+        workers: int = os.cpu_count() or 1,
+        listen: str = "127.0.0.1:0",
+        shard_size: int = SHARD_SIZE,
+        **options
+    ):
+        """Initializes a DistributedScanner object.
+
+        Args:
+            targets: Hosts, CIDR blocks and/or ranges to scan (see parse_targets).
+            output_file: Where to write the scanned ports (if not blank).
+            workers: How many local worker processes to start.
+            listen: The address workers connect to (ex. 0.0.0.0:47000 for remote workers).
+            shard_size: Most (host, port) probes in each shard.
+            **options: Passed on to MultiScanner (and to the workers, see WORKER_OPTIONS).
+        """
+
+        super().__init__(targets, output_file, **options)
+
+        self.shard_size = max(1, shard_size)
+
+        # Every worker gets an equal share of the rate limits.
+        self.worker_options = {name: options[name] for name in WORKER_OPTIONS if name in options}
+
+        for name in ("rate", "host_rate"):
+            if self.worker_options.get(name):
+                self.worker_options[name] /= max(1, workers)
+
+        host, port = parse_address(listen)
+        self.coordinator = Coordinator(host, port, workers, self.worker_options,
+                                       on_result=self.record_result, on_event=self.log_event)
+
+        self.metrics.gauge("distributed_workers", "Connected workers",
+                           func=lambda: len(self.coordinator.links))
+        self.metrics.gauge("distributed_steals_total", "Shards split by work stealing",
+                           func=lambda: self.coordinator.steals)
+        self.metrics.gauge("distributed_failures_total", "Shards that failed on a worker",
+                           func=lambda: self.coordinator.failures)
+
+    def shards(self, ports: list):
+        """Splits the unscanned probes into shards, taking the ports in their order.
+
+        Args:
+            ports (list): The ports to scan, in the order to probe them.
+
+        Yields:
+            tuple: The (hosts, ascending ports, remaining probes) of each shard.
+        """
+
+        # Shards cover a block of ports across a block of hosts.
+        port_block = max(1, self.shard_size // len(self.hosts))
+        host_block = max(1, self.shard_size // port_block)
+
+        for i in range(0, len(ports), port_block):
+            block = ports[i:i + port_block]
+
+            for j in range(0, len(self.hosts), host_block):
+                # Skip the probes that were completed by a resumed scan.
+                remaining = {
+                    (host, port) for host in self.hosts[j:j + host_block] for port in block
+                    if self.results.get(host, port) == PORT_UNSCANNED
+                }
+
+                if remaining:
+                    hosts = {host for host, _ in remaining}
+                    yield ([host for host in self.hosts[j:j + host_block] if host in hosts],
+                           sorted({port for _, port in remaining}), remaining)
+
+    def run_engine(self, ports: list):
+        """Scans the ports on the workers.
+
+        Args:
+            ports (list): The ports to scan, in the order to probe them.
+        """
+
+        if not self.hosts:
+            return
+
+        self.workers_gauge.set(self.coordinator.workers)
+        asyncio.run(self.coordinator.run(self.shards(ports)))
+
+        if self.coordinator.abandoned:
+            self.log_event(f"{self.coordinator.abandoned} probe(s) were given up")
+
+    def record_result(self, host: str, port: int, status: int, latency: float, service: tuple):
+        """
+        Records a port reported by a worker (only its first report, as stolen probes
+        may be reported twice).
+        """
+
+        if self.results.get(host, port) == PORT_UNSCANNED:
+            self.record_port(host, port, status, latency, service)
+
+    def log_event(self, text: str):
+        self.renderer.log(info_text(text, end=""))
+
+
+class ShardScanner(MultiScanner):
+    """Scans a single shard for a ScanWorker, sending every result to the coordinator.
+
+    Attributes:
+        worker: The ScanWorker the shard belongs to.
+        shard_id: The id of the shard.
+        stolen: The ports stolen by another worker (skipped).
+        cancelled: Whether to stop probing (the coordinator told the worker to exit).
+    """
+
+    def __init__(self, worker, shard_id: int, hosts: list, **options):
+        super().__init__(" ".join(hosts), "", quiet=True,
+                         on_host_complete=lambda *_: None, **options)
+
+        self.worker = worker
+        self.shard_id = shard_id
+        self.stolen = set()
+        self.cancelled = False
+
+    def probes(self, ports: list):
+        for host, port in super().probes(ports):
+            if self.cancelled:
+                return
+
+            if port not in self.stolen:
+                yield host, port
+
+    def record_port(self, host: str, port: int, status: int, latency: float, service: tuple = None) -> bool:
+        finished = super().record_port(host, port, status, latency, service)
+        self.worker.add_result(self.shard_id, host, port, status, latency, service)
+
+        return finished
+
+
+class ScanWorker:
+    """Worker process scanning the shards handed out by a Coordinator (see worker.py).
+
+    Attributes:
+        host: The host of the coordinator.
+        port: The port of the coordinator.
+        name: The name the worker introduces itself with (host name and pid by default).
+        scanner: The ShardScanner of the running shard (None while idle).
+        shards: How many shards the worker has scanned.
+    """
+
+    def __init__(self, address: str, name: str = ""):
+        self.host, self.port = parse_address(address)
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+
+        self.sock = None
+        self.scanner = None
+        self.scan_thread = None
+        self.shards = 0
+
+        # Results are buffered from every scanning thread.
+        self.lock = Lock()
+        self.rows = []
+        self.rows_shard = None
+        self.flushed = time.monotonic()
+        self.stopping = Event()
+
+    def connect(self):
+        """
+        Connects to the coordinator, retrying until CONNECT_TIMEOUT in case it isn't listening yet.
+        """
+
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+
+        while True:
+            try:
+                self.sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+                self.sock.settimeout(None)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+
+                time.sleep(HEARTBEAT_INTERVAL)
+
+    def send(self, message: dict):
+        with self.lock:
+            self.sock.sendall(encode_message(message))
+
+    def add_result(self, shard_id: int, host: str, port: int, status: int, latency: float, service: tuple):
+        """
+        Buffers the result of a scanned port, sending the buffer once it is full or old enough.
+        """
+
+        with self.lock:
+            self.rows_shard = shard_id
+            self.rows.append([host, port, status, round(latency, 6), *(service or ("", ""))])
+
+            if len(self.rows) >= RESULT_BATCH or time.monotonic() - self.flushed >= RESULT_INTERVAL:
+                self.flush_locked()
+
+    def flush(self):
+        """
+        Sends every buffered result to the coordinator.
+        """
+
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        if self.rows:
+            self.sock.sendall(encode_message(
+                {"type": "results", "shard": self.rows_shard, "rows": self.rows}))
+            self.rows = []
+
+        self.flushed = time.monotonic()
+
+    def heartbeat(self):
+        """
+        Thread sending heartbeats (and the results buffered for too long) until the worker stops.
+        """
+
+        while not self.stopping.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.flush()
+                self.send({"type": "heartbeat"})
+            except OSError:
+                break
+
+    def scan(self, message: dict):
+        """
+        Thread scanning a shard, then reporting it done (or failed).
+        """
+
+        try:
+            self.scanner = ShardScanner(self, message["id"], message["hosts"], **message["options"])
+            self.scanner.scan_ports(message["ports"])
+
+            self.flush()
+            self.send({"type": "done", "shard": message["id"]})
+            self.shards += 1
+        except Exception as error:
+            try:
+                self.flush()
+                self.send({"type": "error", "shard": message["id"], "error": str(error)})
+            except OSError:
+                # The coordinator is gone, run will notice it.
+                pass
+        finally:
+            self.scanner = None
+
+    def run(self) -> int:
+        """Scans the shards handed out by the coordinator until it tells the worker to exit.
+
+        Returns:
+            int: How many shards were scanned.
+        """
+
+        self.connect()
+        self.send({"type": "hello", "version": PROTOCOL_VERSION, "worker": self.name})
+
+        Thread(target=self.heartbeat, daemon=True).start()
+
+        try:
+            for line in self.sock.makefile("rb"):
+                message = json.loads(line)
+                kind = message.get("type")
+
+                if kind == "shard":
+                    # Only one shard is handed out at a time.
+                    if self.scan_thread:
+                        self.scan_thread.join()
+
+                    self.scan_thread = Thread(target=self.scan, args=(message,), daemon=True)
+                    self.scan_thread.start()
+
+                elif kind == "steal":
+                    if (scanner := self.scanner) and scanner.shard_id == message["shard"]:
+                        scanner.stolen.update(parse_ports(message["ports"]))
+
+                elif kind == "exit":
+                    break
+        except (OSError, ValueError):
+            # The coordinator is gone (or sent something unreadable).
+            pass
+        finally:
+            self.stopping.set()
+
+            # Stop probing the running shard.
+            if scanner := self.scanner:
+                scanner.cancelled = True
+
+            if self.scan_thread:
+                self.scan_thread.join(SHUTDOWN_TIMEOUT)
+
+            self.sock.close()
+
+        return self.shards
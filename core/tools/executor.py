@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/executor.py
+"""
+
+from queue import Queue, Empty
+from threading import Thread, Event, Lock
+
+EXECUTOR_THREADS = 20  # Default number of worker threads in a ScanExecutor.
+EXECUTOR_BACKLOG = 4096  # Most tasks waiting in the queue before submit blocks.
+SHUTDOWN_TIMEOUT = 5.0  # Longest time to wait for each worker to exit (in seconds).
+
+
+class TaskGroup:
+    """Tracks the tasks a single scan submitted to a ScanExecutor, so that the
+       scan can wait for (or cancel) its own tasks without touching the others.
+
+    Attributes:
+        pending: The amount of submitted tasks that haven't finished yet.
+        cancelled: Whether the remaining tasks should be skipped.
+        errors: The exceptions raised by the groups tasks.
+    """
+
+    def __init__(self):
+        self.pending = 0
+        self.cancelled = False
+        self.errors = []
+
+        self.lock = Lock()
+        self.finished = Event()
+        self.finished.set()
+
+    def add(self, amount: int = 1):
+        with self.lock:
+            self.pending += amount
+            self.finished.clear()
+
+    def done(self):
+        with self.lock:
+            self.pending -= 1
+
+            if not self.pending:
+                self.finished.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Waits until every task of the group has finished (or was skipped).
+
+        Args:
+            timeout: Longest time to wait (in seconds, forever if None).
+
+        Returns:
+            bool: Whether every task has finished.
+        """
+
+        return self.finished.wait(timeout)
+
+    def cancel(self):
+        """
+        Skips every task of the group that hasn't started yet.
+        """
+
+        self.cancelled = True
+
+
+class ScanExecutor:
+    """Long-lived pool of worker threads shared by every scan of a session.
+
+    The threads are started once and reused, instead of every scan starting
+    (and leaking) its own. Tasks are run in the order they were submitted, so a
+    second scan can be queued while the first one is still finishing.
+
+    Attributes:
+        threads: The amount of worker threads.
+        queue: The (group, func, args) tasks waiting for a worker.
+        workers: The running worker threads.
+        closed: Whether the executor has been shut down.
+    """
+
+    def __init__(self, threads: int = EXECUTOR_THREADS, backlog: int = EXECUTOR_BACKLOG):
+        self.threads = threads
+        self.queue = Queue(maxsize=backlog)
+        self.workers = []
+        self.closed = False
+
+        self.lock = Lock()
+
+    def start(self):
+        """
+        Starts the worker threads (only the first time it is called).
+        """
+
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("executor has been shut down")
+
+            while len(self.workers) < self.threads:
+                worker = Thread(target=self.work, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def submit(self, func: callable, *args, group: TaskGroup = None) -> TaskGroup:
+        """Queues a task, blocking while the queue is full.
+
+        Args:
+            func: The function to call.
+            *args: Passed on to the function.
+            group: The TaskGroup to track the task in (a new one if None).
+
+        Returns:
+            TaskGroup: The group tracking the task.
+        """
+
+        if not self.workers:
+            self.start()
+
+        group = group or TaskGroup()
+        group.add()
+
+        self.queue.put((group, func, args))
+        return group
+
+    def work(self):
+        """
+        Worker thread, running tasks from the queue until it takes the shutdown sentinel.
+        """
+
+        while (task := self.queue.get()) is not None:
+            group, func, args = task
+
+            try:
+                # Skip the tasks of cancelled groups (ex. an interrupted scan).
+                if not group.cancelled:
+                    func(*args)
+            except Exception as error:
+                # Keep the worker alive, and let the group's owner raise the error.
+                group.errors.append(error)
+            finally:
+                group.done()
+
+    def qsize(self) -> int:
+        """Returns the amount of tasks waiting for a worker."""
+
+        return self.queue.qsize()
+
+    def shutdown(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """Stops the worker threads, skipping the tasks that haven't started yet.
+
+        Args:
+            timeout: Longest time to wait for each worker to exit (in seconds).
+        """
+
+        with self.lock:
+            if self.closed:
+                return
+
+            self.closed = True
+            workers, self.workers = self.workers, []
+
+        # Drop the waiting tasks, marking them done so that nothing waits on them.
+        while True:
+            try:
+                task = self.queue.get_nowait()
+            except Empty:
+                break
+
+            if task is not None:
+                task[0].cancel()
+                task[0].done()
+
+        # Tell every worker to exit once its current task has finished.
+        for _ in workers:
+            self.queue.put(None)
+
+        for worker in workers:
+            worker.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
@@ -7,7 +7,7 @@
 
 import subprocess # Popen, PIPE, STDOUT, CalledProcessError
 
-from core.util import defer
+from core.tools.util import defer
 from core.terminal import *
 
 
@@ -16,11 +16,18 @@ class FileChecker:
 
     Attributes:
         process: The debsums process running the integrity checking (subprocess).
+        renderer: Renderer drawing the checked files (only the summary when not displayed).
+        checked: The amount of files checked by the current check.
+        failed: The amount of files that failed the current check.
     """
 
     def __init__(self):
         self.process = None
 
+        self.renderer = None
+        self.checked = 0
+        self.failed = 0
+
     @defer(
         # Execute the stop_integrity_check command after the execution
         # of perform_integrity_check has concluded.
@@ -41,6 +48,11 @@ class FileChecker:
             # Add the silent flag to the debsums command.
             command.append("-s")
 
+        # The checked files are printed in batches by the renderer, so that
+        # debsums is never held up by the terminal.
+        self.renderer = Renderer(("Files Checked", "Failed"), quiet=not display)
+        self.checked = self.failed = 0
+
         try:
             # Execute the constructed debsums command.
             self.process = subprocess.Popen(command,
@@ -48,8 +60,10 @@ class FileChecker:
                                     stderr=subprocess.STDOUT,
                                     universal_newlines=True)
 
+            self.renderer.start()
+
             # Iterate through the live processes output.
-            for i, line in enumerate(iter(self.process.stdout.readline, b'')):
+            for i, line in enumerate(iter(self.process.stdout.readline, '')):
                 try:
                     # Split the raw line output so that parsing its attributes is possible.
                     columns = line.strip().split() # Format: columns[0] (filepath)... columns[-1] (status)
@@ -58,21 +72,32 @@ class FileChecker:
                     # Encountered an error when parsing or formatting the current raw line output.
                     continue
 
-                # Print every OK file written to the processes STDOUT.
+                self.checked += 1
+
+                # Display every OK file written to the processes STDOUT.
                 # This will result in all checked files being displayed.
                 if status == "OK":
-                    std_info(
+                    self.renderer.log(info_text(
                         # Display the index and filepath of the checked file.
-                        f"File #{i+1}: {filepath}"
-                    )
+                        f"File #{i+1}: {filepath}", end=""
+                    ))
+                else:
+                    self.failed += 1
 
-            std_success("Finished checking files", start="\n")
+                self.renderer.update("files", self.checked, self.failed)
 
         except KeyboardInterrupt:
             # Stop checking files as CTRL-C was pressed.
             std_success("Stopped checking files", start="\n")
             return
 
+        finally:
+            # Stop the renderer (drawing the final frame) whatever ended the check,
+            # including debsums failing to start.
+            self.renderer.stop()
+
+        std_success("Finished checking files", start="\n")
+
     def stop_integrity_check(self):
         """
         Stops the debsums file checker process.
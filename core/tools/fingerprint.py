@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/fingerprint.py
+"""
+
+import ssl  # SSLContext, MemoryBIO, SSLError, SSLWantReadError
+import time  # monotonic
+import socket  # timeout
+import asyncio  # wait_for, get_running_loop, TimeoutError
+
+from core.tools.targets import _is_address
+
+BANNER_TIMEOUT = 2.0  # How long to wait for each reply of a service (in seconds).
+BANNER_WAIT = 0.5  # How long to wait for a greeting before probing the service (in seconds).
+BANNER_CONCURRENCY = 64  # Most open ports fingerprinted at once (asyncio engine).
+BANNER_READ = 2048  # Most bytes read from a service per reply.
+BANNER_LENGTH = 120  # Longest banner kept (in characters).
+TLS_ROUNDS = 4  # A TLS handshake must complete within this many reply timeouts.
+
+# Ports whose services only speak after the client (no greeting is waited for).
+HTTP_PORTS = {80, 81, 591, 3000, 5000, 8000, 8008, 8080, 8081, 8888, 9000}
+TLS_PORTS = {443, 465, 563, 636, 853, 989, 990, 992, 993, 994, 995, 5061, 8443, 9443}
+
+
+def http_request(host: str) -> bytes:
+    """Returns the HTTP HEAD request sent to identify web servers."""
+
+    return (f"HEAD / HTTP/1.0\r\nHost: {host}\r\n"
+            f"User-Agent: security-assessment\r\nAccept: */*\r\n\r\n").encode()
+
+
+def clean_banner(data: bytes) -> str:
+    """Returns the first line of a reply as printable text (at most BANNER_LENGTH characters)."""
+
+    line = data.split(b"\n", 1)[0].decode("latin-1")
+    return "".join(char for char in line if char.isprintable()).strip()[:BANNER_LENGTH]
+
+
+def identify(data: bytes) -> tuple:
+    """Identifies a service from the first bytes it replied with.
+
+    Args:
+        data: The services reply (greeting or answer to a probe).
+
+    Returns:
+        tuple: The (service, banner) of the reply ("unknown" if not recognized).
+    """
+
+    if not data:
+        return "unknown", ""
+
+    if data.startswith(b"SSH-"):
+        return "ssh", clean_banner(data)
+
+    if data.startswith(b"HTTP/"):
+        # Keep the status line along with the Server header (if any).
+        banner = clean_banner(data)
+
+        for line in data.split(b"\r\n")[1:]:
+            if line.lower().startswith(b"server:"):
+                banner += f" ({clean_banner(line[7:])})"
+                break
+
+        return "http", banner[:BANNER_LENGTH]
+
+    # A TLS record (handshake or alert) of any TLS/SSLv3 version.
+    if data[0] in (0x15, 0x16) and data[1:2] == b"\x03":
+        return "tls", ""
+
+    if data.startswith(b"220"):
+        service = "smtp" if b"SMTP" in data.upper() else "ftp"
+        return service, clean_banner(data)
+
+    if data.startswith(b"+OK"):
+        return "pop3", clean_banner(data)
+
+    if data.startswith(b"* OK"):
+        return "imap", clean_banner(data)
+
+    if data.startswith(b"RFB "):
+        return "vnc", clean_banner(data)
+
+    # MySQL greets with a packet header followed by protocol version 10.
+    if len(data) > 5 and data[4] == 10 and data[3] == 0:
+        return "mysql", clean_banner(data[5:].split(b"\0", 1)[0])
+
+    return "unknown", clean_banner(data)
+
+
+class BannerGrabber:
+    """Identifies the services of open ports over the connection that proved them open.
+
+    Each service is identified by a conversation, a generator yielding the bytes to
+    send along with how long to wait for a reply, and receiving each reply (b"" on
+    a timeout). The conversation is run by a blocking driver (grab, thread engine)
+    or an asyncio one (grab_async), so both engines share the same protocol logic:
+
+        TLS_PORTS: A TLS handshake (from an ssl MemoryBIO), then an HTTP HEAD over it.
+        HTTP_PORTS: An HTTP HEAD request.
+        Other ports: Waits BANNER_WAIT for a greeting (SSH, FTP, SMTP, ...),
+                     sending an HTTP HEAD request if there is none.
+
+    Attributes:
+        timeout: How long to wait for each reply (in seconds).
+        concurrency: Most open ports fingerprinted at once (asyncio engine).
+        context: The SSLContext used for TLS handshakes (certificates aren't verified).
+    """
+
+    def __init__(self, timeout: float = BANNER_TIMEOUT, concurrency: int = BANNER_CONCURRENCY):
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+        # Fingerprinting only needs the handshake to complete, not to be trusted.
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.context.check_hostname = False
+        self.context.verify_mode = ssl.CERT_NONE
+
+    def conversation(self, host: str, port: int):
+        """Generates the exchanges needed to identify the service of an open port.
+
+        Args:
+            host: The host of the open port.
+            port: The open port.
+
+        Yields:
+            tuple: The (bytes to send, seconds to wait for a reply) of each exchange.
+
+        Returns:
+            tuple: The (service, banner) of the port.
+        """
+
+        if port in TLS_PORTS:
+            return (yield from self.tls_conversation(host))
+
+        # Most non-web services greet first, so wait for a greeting before probing.
+        if port not in HTTP_PORTS:
+            greeting = yield b"", min(BANNER_WAIT, self.timeout)
+
+            if greeting:
+                return identify(greeting)
+
+        return identify((yield http_request(host), self.timeout))
+
+    def tls_conversation(self, host: str):
+        """Generates the exchanges of a TLS handshake followed by an HTTP HEAD request.
+
+        Args:
+            host: The host of the open port (sent as the SNI if it is a name).
+
+        Yields:
+            tuple: The (bytes to send, seconds to wait for a reply) of each exchange.
+
+        Returns:
+            tuple: The (service, banner) of the port ("https" if HTTP answered over TLS).
+        """
+
+        incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+        tls = self.context.wrap_bio(incoming, outgoing,
+                                    server_hostname=None if _is_address(host) else host)
+
+        # Send the ClientHello and feed back the replies until the handshake completes
+        # (a server's flight, e.g. a long certificate chain, often spans many reads).
+        deadline = time.monotonic() + self.timeout * TLS_ROUNDS
+        received = False
+
+        while True:
+            try:
+                tls.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                wait = min(self.timeout, deadline - time.monotonic())
+
+                if wait <= 0:
+                    return "tls", "handshake incomplete"
+
+                reply = yield outgoing.read(), wait
+            except ssl.SSLError as error:
+                return "tls", f"handshake failed ({error.reason})"
+
+            if not reply:
+                return ("tls", "handshake incomplete") if received else ("unknown", "")
+
+            # Something other than TLS answered the ClientHello.
+            if not received and identify(reply)[0] != "tls":
+                return identify(reply)
+
+            received = True
+            incoming.write(reply)
+
+        negotiated = f"{tls.version()} {tls.cipher()[0]}"
+
+        # Ask the service behind TLS whether it is a web server (the reply may
+        # come after session tickets, so allow a second read).
+        tls.write(http_request(host))
+        data = b""
+
+        for _ in range(2):
+            if not (reply := (yield outgoing.read(), self.timeout)):
+                break
+
+            incoming.write(reply)
+
+            try:
+                data = tls.read(BANNER_READ)
+                break
+            except ssl.SSLError:
+                continue
+
+        service, banner = identify(data)
+
+        if service == "http":
+            return "https", f"{banner} [{negotiated}]"[:BANNER_LENGTH]
+
+        return "tls", negotiated
+
+    def grab(self, sock: socket.socket, host: str, port: int) -> tuple:
+        """Identifies the service of an open port over its connected (blocking) socket.
+
+        Args:
+            sock: The connected socket that proved the port open.
+            host: The host of the open port.
+            port: The open port.
+
+        Returns:
+            tuple: The (service, banner) of the port.
+        """
+
+        conversation = self.conversation(host, port)
+
+        try:
+            payload, wait = next(conversation)
+
+            while True:
+                if payload:
+                    sock.sendall(payload)
+
+                sock.settimeout(wait)
+
+                try:
+                    reply = sock.recv(BANNER_READ)
+                except socket.timeout:
+                    reply = b""
+
+                payload, wait = conversation.send(reply)
+
+        except StopIteration as stop:
+            return stop.value
+        except OSError:
+            # The connection was reset or closed while identifying it.
+            return "unknown", ""
+
+    async def grab_async(self, sock: socket.socket, host: str, port: int) -> tuple:
+        """Asyncio version of grab, over a connected non-blocking socket.
+
+        Args:
+            sock: The connected socket that proved the port open.
+            host: The host of the open port.
+            port: The open port.
+
+        Returns:
+            tuple: The (service, banner) of the port.
+        """
+
+        loop = asyncio.get_running_loop()
+        conversation = self.conversation(host, port)
+
+        try:
+            payload, wait = next(conversation)
+
+            while True:
+                if payload:
+                    await loop.sock_sendall(sock, payload)
+
+                try:
+                    reply = await asyncio.wait_for(loop.sock_recv(sock, BANNER_READ), wait)
+                except asyncio.TimeoutError:
+                    reply = b""
+
+                payload, wait = conversation.send(reply)
+
+        except StopIteration as stop:
+            return stop.value
+        except OSError:
+            # The connection was reset or closed while identifying it.
+            return "unknown", ""
@@ -0,0 +1,348 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/flows.py
+"""
+
+import heapq  # nlargest
+import socket  # inet_ntop, AF_INET, AF_INET6
+import struct  # Struct
+
+from array import array
+from collections import OrderedDict
+
+from core.tools.packets import (
+    LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL, LINKTYPE_LINUX_SLL2,
+    ETHERTYPE_IPV4, ETHERTYPE_IPV6, ETHERTYPE_VLANS, IPPROTO_TCP, IPPROTO_UDP,
+    IPV6_EXTENSIONS, IPV6_FRAGMENT, PROTOCOL_NAMES
+)
+
+FLOW_MAX = 65536  # Most flows tracked at once (a few hundred bytes each).
+FLOW_IDLE = 60.0  # Time without packets after which a flow is expired (in seconds).
+FLOW_TOP = 10  # How many flows, talkers and SYN targets a snapshot lists.
+
+TCP_SYN = 0x02
+TCP_ACK = 0x10
+
+ETHERNET_TYPE = struct.Struct("!H")
+IPV4_FLOW = struct.Struct("!B5xHxB2x4s4s")  # Version/IHL, fragment, protocol and addresses.
+IPV6_FLOW = struct.Struct("!6xB1x16s16s")  # Next header and addresses.
+TCP_FLOW = struct.Struct("!HH9xB")  # Ports and flags.
+UDP_FLOW = struct.Struct("!HH")  # Ports.
+
+
+def flow_key(link_type: int, data, header: bytes = b"") -> tuple:
+    """Reads the 5-tuple of a captured packet, by offset and without decoding it to text.
+
+    Args:
+        link_type: The link type of the capture (see the LINKTYPE constants).
+        data: The captured packet (bytes or memoryview).
+        header: The link layer header built for the packet, when data starts at its
+                network header (see RingCapture), so it never has to be prepended.
+
+    Returns:
+        tuple: The ((protocol, source, destination, source port, destination port), TCP flags)
+               of the packet (the addresses as packed bytes), None if not an IP packet.
+    """
+
+    # Find the network header (see link_payload) without slicing the packet.
+    link = header or data
+
+    if link_type == LINKTYPE_ETHERNET:
+        ethertype, offset = ETHERNET_TYPE.unpack_from(link, 12)[0], 14
+
+        while ethertype in ETHERTYPE_VLANS:
+            ethertype, offset = ETHERNET_TYPE.unpack_from(link, offset + 2)[0], offset + 4
+    elif link_type == LINKTYPE_LINUX_SLL:
+        ethertype, offset = ETHERNET_TYPE.unpack_from(link, 14)[0], 16
+    elif link_type == LINKTYPE_LINUX_SLL2:
+        ethertype, offset = ETHERNET_TYPE.unpack_from(link, 0)[0], 20
+    elif link_type == LINKTYPE_RAW:
+        ethertype, offset = (ETHERTYPE_IPV4 if link[0] >> 4 == 4 else ETHERTYPE_IPV6), 0
+    else:
+        return None
+
+    # A separate header is followed by the network header at the start of data.
+    if header:
+        offset = 0
+
+    if ethertype == ETHERTYPE_IPV4:
+        version_ihl, fragment, protocol, source, destination = IPV4_FLOW.unpack_from(data, offset)
+
+        # Later fragments carry no ports, they are counted with the flow's portless twin.
+        if fragment & 0x1fff:
+            return (protocol, source, destination, 0, 0), 0
+
+        offset += (version_ihl & 0x0f) * 4
+
+    elif ethertype == ETHERTYPE_IPV6:
+        protocol, source, destination = IPV6_FLOW.unpack_from(data, offset)
+        offset += 40
+
+        while protocol in IPV6_EXTENSIONS or protocol == IPV6_FRAGMENT:
+            if protocol == IPV6_FRAGMENT:
+                if UDP_FLOW.unpack_from(data, offset)[1] & 0xfff8:
+                    return (data[offset], source, destination, 0, 0), 0
+
+                protocol, offset = data[offset], offset + 8
+            else:
+                protocol, offset = data[offset], offset + (data[offset + 1] + 1) * 8
+    else:
+        return None
+
+    if protocol == IPPROTO_TCP:
+        source_port, destination_port, flags = TCP_FLOW.unpack_from(data, offset)
+        return (protocol, source, destination, source_port, destination_port), flags
+
+    if protocol == IPPROTO_UDP:
+        source_port, destination_port = UDP_FLOW.unpack_from(data, offset)
+        return (protocol, source, destination, source_port, destination_port), 0
+
+    return (protocol, source, destination, 0, 0), 0
+
+
+def format_address(address: bytes) -> str:
+    """Formats a packed IPv4 or IPv6 address (see flow_key)."""
+
+    return socket.inet_ntop(socket.AF_INET if len(address) == 4 else socket.AF_INET6, address)
+
+
+class FlowTable:
+    """Aggregates captured packets into per 5-tuple flow counters.
+
+    Flows take a slot of preallocated counter arrays, found by their 5-tuple
+    in an ordered dictionary kept from the least to the most recently seen
+    flow. Flows idle for longer than the idle timeout are expired from its
+    front, and once every slot is taken the least recently seen flow is
+    evicted for the new one, so the table never holds more than max_flows
+    flows however many the traffic has.
+
+    SYNs without an ACK are also counted per destination (host and port)
+    between snapshots, which is how a SYN flood from spoofed sources (one
+    short flow per packet) still shows up.
+
+    Attributes:
+        max_flows: Most flows tracked at once.
+        idle: Time without packets after which a flow is expired (in seconds).
+        top: How many entries each snapshot list holds.
+        flows: The slot of each tracked flow, least recently seen first.
+        keys: The 5-tuple of each slot.
+        packets: The packets of each slot.
+        size: The bytes (on the wire) of each slot.
+        first: When each slots flow started (capture time).
+        last: When each slots flow was last seen (capture time).
+        syns: The SYNs without an ACK of each slot.
+        syn_targets: The SYNs without an ACK each (destination, port) received since the last snapshot.
+        evicted: The amount of flows evicted to make room for newer ones.
+        expired: The amount of flows expired for being idle.
+        overflowed: The amount of SYNs not counted because syn_targets was full.
+        total_packets: The amount of packets aggregated.
+        total_size: The amount of bytes aggregated.
+    """
+
+    def __init__(self, max_flows: int = FLOW_MAX, idle: float = FLOW_IDLE, top: int = FLOW_TOP):
+        self.max_flows = max_flows
+        self.idle = idle
+        self.top = top
+
+        self.flows = OrderedDict()
+        self.free = list(range(max_flows - 1, -1, -1))
+
+        self.keys = [None] * max_flows
+        self.packets = array("Q", bytes(8 * max_flows))
+        self.size = array("Q", bytes(8 * max_flows))
+        self.first = array("d", bytes(8 * max_flows))
+        self.last = array("d", bytes(8 * max_flows))
+        self.syns = array("I", bytes(4 * max_flows))
+
+        self.syn_targets = {}
+
+        self.evicted = self.expired = self.overflowed = 0
+        self.total_packets = self.total_size = 0
+
+    def __len__(self) -> int:
+        return len(self.flows)
+
+    def add(self, key: tuple, flags: int, length: int, now: float):
+        """Counts a packet of a flow.
+
+        Args:
+            key: The 5-tuple of the packet (see flow_key).
+            flags: The TCP flags of the packet (0 if not TCP).
+            length: The length of the packet on the wire.
+            now: When the packet was captured.
+        """
+
+        flows = self.flows
+        slot = flows.get(key)
+
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                # Every slot is taken, reuse the least recently seen flows.
+                slot = flows.popitem(last=False)[1]
+                self.evicted += 1
+
+            flows[key] = slot
+            self.keys[slot] = key
+            self.packets[slot] = self.size[slot] = self.syns[slot] = 0
+            self.first[slot] = now
+        else:
+            flows.move_to_end(key)
+
+        self.packets[slot] += 1
+        self.size[slot] += length
+        self.last[slot] = now
+
+        if flags & (TCP_SYN | TCP_ACK) == TCP_SYN:
+            self.syns[slot] += 1
+
+            target = (key[2], key[4])
+
+            if target in self.syn_targets:
+                self.syn_targets[target] += 1
+            elif len(self.syn_targets) < self.max_flows:
+                self.syn_targets[target] = 1
+            else:
+                self.overflowed += 1
+
+    def add_block(self, link_type: int, packets: list):
+        """
+        Counts every IP packet of a block handed out by RingCapture or PcapStream.
+        """
+
+        add = self.add
+
+        for seconds, nanoseconds, length, header, data in packets:
+            try:
+                # Cooked headers are read on their own, without copying the packet behind them.
+                flow = flow_key(link_type, data, header)
+            except (struct.error, IndexError):
+                # The packet was truncated by the snapshot length.
+                continue
+
+            if flow:
+                add(flow[0], flow[1], length, seconds + nanoseconds * 1e-9)
+                self.total_packets += 1
+                self.total_size += length
+
+    def expire(self, now: float):
+        """
+        Frees the slots of every flow idle for longer than the idle timeout.
+        """
+
+        flows, last, deadline = self.flows, self.last, now - self.idle
+
+        # The least recently seen flows are first, stop at the first active one.
+        while flows:
+            slot = next(iter(flows.values()))
+
+            if last[slot] > deadline:
+                break
+
+            flows.popitem(last=False)
+            self.keys[slot] = None
+            self.free.append(slot)
+            self.expired += 1
+
+    def snapshot(self, now: float = None) -> dict:
+        """Expires idle flows and lists the busiest flows, sources and SYN targets.
+
+        Args:
+            now: The current capture time (the latest packet if None).
+
+        Returns:
+            dict: The "flows" by bytes as (protocol, source, source port, destination,
+                  destination port, packets, bytes, duration, syns), the "talkers" (sources)
+                  by bytes as (source, flows, packets, bytes), the "syn_targets" by SYNs
+                  without an ACK since the last snapshot as (destination, port, syns),
+                  and the "active", "evicted", "expired", "packets" and "bytes" counters.
+        """
+
+        if now is None and self.flows:
+            now = self.last[self.flows[next(reversed(self.flows))]]
+
+        if now is not None:
+            self.expire(now)
+
+        slots = list(self.flows.values())
+        keys, packets, size, first, last, syns = (
+            self.keys, self.packets, self.size, self.first, self.last, self.syns)
+
+        flows = []
+
+        for slot in heapq.nlargest(self.top, slots, key=size.__getitem__):
+            protocol, source, destination, source_port, destination_port = keys[slot]
+            flows.append((PROTOCOL_NAMES.get(protocol, str(protocol)), format_address(source),
+                          source_port, format_address(destination), destination_port,
+                          packets[slot], size[slot], last[slot] - first[slot], syns[slot]))
+
+        # Sum the flows of each source.
+        talkers = {}
+
+        for slot in slots:
+            source = keys[slot][1]
+            counts = talkers.get(source)
+
+            if counts is None:
+                talkers[source] = [1, packets[slot], size[slot]]
+            else:
+                counts[0] += 1
+                counts[1] += packets[slot]
+                counts[2] += size[slot]
+
+        talkers = [(format_address(source), *counts) for source, counts in
+                   heapq.nlargest(self.top, talkers.items(), key=lambda item: item[1][2])]
+
+        syn_targets = [(format_address(destination), port, count) for (destination, port), count in
+                       heapq.nlargest(self.top, self.syn_targets.items(), key=lambda item: item[1])]
+
+        # SYN targets count the SYNs between snapshots (a rate, not a total).
+        self.syn_targets = {}
+
+        return {
+            "flows": flows,
+            "talkers": talkers,
+            "syn_targets": syn_targets,
+            "active": len(self.flows),
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "packets": self.total_packets,
+            "bytes": self.total_size
+        }
+
+
+def format_endpoint(address: str, port: int) -> str:
+    """Formats an address and port of a flow (the port left out for protocols without any)."""
+
+    if not port:
+        return address
+
+    return f"[{address}]:{port}" if ":" in address else f"{address}:{port}"
+
+
+def format_flows(snapshot: dict) -> list:
+    """Formats a flow table snapshot (see FlowTable.snapshot) into lines of tables."""
+
+    lines = [f"{snapshot['active']} active flow(s), {snapshot['packets']} packet(s), "
+             f"{snapshot['bytes']} byte(s), {snapshot['evicted']} evicted, {snapshot['expired']} expired"]
+
+    if snapshot["flows"]:
+        lines.append("Protocol\tSource\tDestination\tPackets\tBytes\tDuration\tSYNs")
+        lines.extend(f"{protocol}\t{format_endpoint(source, source_port)}\t"
+                     f"{format_endpoint(destination, destination_port)}\t"
+                     f"{packets}\t{size}\t{duration:.1f}s\t{syns}"
+                     for (protocol, source, source_port, destination, destination_port,
+                          packets, size, duration, syns) in snapshot["flows"])
+
+    if snapshot["talkers"]:
+        lines.append("Talker\tFlows\tPackets\tBytes")
+        lines.extend("\t".join(map(str, talker)) for talker in snapshot["talkers"])
+
+    if snapshot["syn_targets"]:
+        lines.append("SYN Target\tPort\tSYNs Without ACK")
+        lines.extend("\t".join(map(str, target)) for target in snapshot["syn_targets"])
+
+    return lines
@@ -0,0 +1,311 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/history.py
+"""
+
+import json  # dumps, loads
+import time  # time, monotonic
+import sqlite3  # connect, Row
+
+from threading import Lock
+
+from core.tools.results import PORT_OPEN
+
+HISTORY_BATCH = 4096  # How many results to buffer before inserting them.
+HISTORY_INTERVAL = 1.0  # Longest time results stay buffered (in seconds).
+
+# Results are clustered by (scan, host, port), so a scans rows are stored together and
+# a port of another scan is found with a single lookup. The partial index holds only
+# the open ports of each scan, which is all a diff has to read from either scan.
+HISTORY_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL,
+    hosts TEXT NOT NULL,
+    ports TEXT NOT NULL,
+    engine TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS results (
+    scan INTEGER NOT NULL,
+    host INTEGER NOT NULL,
+    port INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    time REAL NOT NULL,
+    latency REAL NOT NULL,
+    service TEXT,
+    banner TEXT,
+    PRIMARY KEY (scan, host, port)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS scans_started ON scans (started);
+CREATE INDEX IF NOT EXISTS results_host ON results (host, port);
+CREATE INDEX IF NOT EXISTS results_port ON results (port);
+CREATE INDEX IF NOT EXISTS results_open ON results (scan, host, port) WHERE status = {PORT_OPEN};
+"""
+
+# Ports open in the first scan that the second scan found not open (both scans must
+# have scanned the port). Swapping the scans gives the newly opened ports.
+DIFF_QUERY = f"""
+SELECT hosts.name, old.port, new.status, old.service
+FROM results AS old INDEXED BY results_open
+JOIN results AS new ON new.scan = :new AND new.host = old.host AND new.port = old.port
+JOIN hosts ON hosts.id = old.host
+WHERE old.scan = :old AND old.status = {PORT_OPEN} AND new.status != {PORT_OPEN}
+ORDER BY hosts.name, old.port
+"""
+
+
+class ScanHistory:
+    """SQLite store of every scan run, and the status of every port they scanned,
+       so that runs can be compared (see diff) instead of overwriting each other.
+
+    Results are buffered and inserted in batches of one transaction each, so
+    the scanner never waits on the disk for a single port.
+
+    Attributes:
+        path: The SQLite database file.
+        batch: How many results to buffer before inserting them.
+        interval: Longest time results stay buffered (in seconds).
+        buffer: The (scan, host id, port, status, time, latency, service, banner) rows waiting to be inserted.
+        written: The amount of results inserted so far.
+    """
+
+    def __init__(self, path: str, batch: int = HISTORY_BATCH, interval: float = HISTORY_INTERVAL):
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+
+        self.buffer = []
+        self.written = 0
+        self.flushed = time.monotonic()
+        self.host_ids = {}
+
+        # Results are written from every scanning thread.
+        self.lock = Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+
+        # WAL lets readers query the history while a scan is inserting into it.
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(HISTORY_SCHEMA)
+
+    def begin(self, hosts: list, ports: str, engine: str = "", resume: bool = False) -> int:
+        """Records the start of a scan.
+
+        Args:
+            hosts: The hosts of the scan.
+            ports: The port expression of the scan (see compress_ports).
+            engine: The scanning engine used.
+            resume: Whether to continue the latest unfinished scan of the same hosts and ports.
+
+        Returns:
+            int: The id of the scan.
+        """
+
+        hosts = json.dumps(hosts)
+
+        with self.lock, self.db:
+            if resume:
+                row = self.db.execute(
+                    "SELECT id FROM scans WHERE finished IS NULL AND hosts = ? AND ports = ? "
+                    "ORDER BY id DESC LIMIT 1", (hosts, ports)).fetchone()
+
+                if row:
+                    return row["id"]
+
+            return self.db.execute(
+                "INSERT INTO scans (started, hosts, ports, engine) VALUES (?, ?, ?, ?)",
+                (time.time(), hosts, ports, engine)).lastrowid
+
+    def host_id(self, host: str) -> int:
+        """Returns the id of a host name, adding it the first time (the lock must be held)."""
+
+        if (host_id := self.host_ids.get(host)) is None:
+            self.db.execute("INSERT OR IGNORE INTO hosts (name) VALUES (?)", (host,))
+            host_id = self.host_ids[host] = self.db.execute(
+                "SELECT id FROM hosts WHERE name = ?", (host,)).fetchone()["id"]
+
+        return host_id
+
+    def write(
+        self,
+        scan: int,
+        host: str,
+        port: int,
+        status: int,
+        when: float,
+        latency: float,
+        service: str = "",
+        banner: str = ""
+    ):
+        """Buffers a scanned port, inserting the buffer once it is full or old enough.
+
+        Args:
+            scan: The id of the scan (see begin).
+            host: The host of the scanned port.
+            port: The scanned port.
+            status: The ports status (PORT_OPEN, PORT_CLOSED or PORT_FILTERED).
+            when: When the port was scanned (time.time).
+            latency: How long the port took to answer (in seconds).
+            service: The service identified on an open port (blank if not fingerprinted).
+            banner: The banner read from an open port (blank if none).
+        """
+
+        with self.lock:
+            self.buffer.append((scan, self.host_id(host), port, status, when, latency,
+                                service or None, banner or None))
+
+            if len(self.buffer) >= self.batch or time.monotonic() - self.flushed >= self.interval:
+                self.flush_locked()
+
+    def flush(self):
+        """
+        Inserts every buffered result.
+        """
+
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        """
+        Inserts every buffered result in a single transaction (the lock must already be held).
+        """
+
+        if self.buffer:
+            # A resumed scan may scan a port again, keeping its latest status.
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.buffer)
+
+            self.written += len(self.buffer)
+            self.buffer.clear()
+        else:
+            # The host names added since the last batch.
+            self.db.commit()
+
+        self.flushed = time.monotonic()
+
+    def finish(self, scan: int):
+        """
+        Inserts the remaining results of a scan and records when it finished.
+        """
+
+        with self.lock:
+            self.flush_locked()
+
+            with self.db:
+                self.db.execute("UPDATE scans SET finished = ? WHERE id = ?", (time.time(), scan))
+
+    def close(self):
+        """
+        Inserts the remaining results and closes the database.
+        """
+
+        with self.lock:
+            self.flush_locked()
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def scans(self, limit: int = 20) -> list:
+        """Returns the latest scans, newest first.
+
+        Args:
+            limit: The most scans to return.
+
+        Returns:
+            list: A dictionary of each scan (id, started, finished, hosts, ports, engine, open).
+        """
+
+        rows = self.db.execute(
+            "SELECT scans.*, (SELECT COUNT(*) FROM results INDEXED BY results_open "
+            f"WHERE scan = scans.id AND status = {PORT_OPEN}) AS open "
+            "FROM scans ORDER BY started DESC LIMIT ?", (limit,)).fetchall()
+
+        return [dict(row, hosts=json.loads(row["hosts"])) for row in rows]
+
+    def previous(self, scan: int) -> int:
+        """Returns the id of the latest finished scan of the same hosts started before
+           the passed one (None if there is none)."""
+
+        row = self.db.execute(
+            "SELECT previous.id FROM scans AS previous JOIN scans AS current ON current.id = ? "
+            "WHERE previous.finished IS NOT NULL AND previous.hosts = current.hosts "
+            "AND previous.started < current.started ORDER BY previous.started DESC LIMIT 1",
+            (scan,)).fetchone()
+
+        return row["id"] if row else None
+
+    def results(self, scan: int, status: int = None, host: str = None):
+        """Generates the stored results of a scan.
+
+        Args:
+            scan: The id of the scan.
+            status: Only the ports with this status (all of them if None).
+            host: Only the ports of this host (every host if None).
+
+        Yields:
+            tuple: The (host, port, status, time, latency, service, banner) of each port.
+        """
+
+        query = ("SELECT hosts.name, port, status, time, latency, service, banner FROM results "
+                 "JOIN hosts ON hosts.id = results.host WHERE scan = ?")
+        params = [scan]
+
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+
+        if host is not None:
+            query += " AND hosts.name = ?"
+            params.append(host)
+
+        yield from map(tuple, self.db.execute(query + " ORDER BY hosts.name, port", params))
+
+    def port_history(self, host: str, port: int) -> list:
+        """Returns every stored status of a hosts port, oldest scan first.
+
+        Returns:
+            list: The (scan, started, status, service) of each scan of the port.
+        """
+
+        return [tuple(row) for row in self.db.execute(
+            "SELECT scans.id, scans.started, results.status, results.service FROM results "
+            "JOIN hosts ON hosts.id = results.host JOIN scans ON scans.id = results.scan "
+            "WHERE hosts.name = ? AND results.port = ? ORDER BY scans.started", (host, port))]
+
+    def diff(self, old: int, new: int) -> dict:
+        """Compares two scans, over the ports that both of them scanned.
+
+        Only the open ports of either scan are read (from the results_open index),
+        each looked up in the other scan by its primary key, so a diff takes
+        milliseconds however many closed ports are stored.
+
+        Args:
+            old: The id of the earlier scan.
+            new: The id of the later scan.
+
+        Returns:
+            dict: The "opened" ports (open in new only) as (host, port, service) and
+                  the "closed" ports (open in old only) as (host, port, status now).
+        """
+
+        opened = self.db.execute(DIFF_QUERY, {"old": new, "new": old}).fetchall()
+        closed = self.db.execute(DIFF_QUERY, {"old": old, "new": new}).fetchall()
+
+        return {
+            "opened": [(host, port, service or "") for host, port, _, service in opened],
+            "closed": [(host, port, status) for host, port, status, _ in closed]
+        }
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/journal.py
+"""
+
+import os  # fsync, path
+import json  # dumps, loads
+import time  # monotonic
+
+from threading import Lock
+
+JOURNAL_BATCH = 1024  # How many results to buffer before checkpointing them.
+JOURNAL_INTERVAL = 2.0  # Longest time results stay buffered (in seconds).
+
+
+class ScanJournal:
+    """Append-only checkpoint journal of a scan, allowing an interrupted scan to
+       be resumed without probing the completed ports again.
+
+    The journal is a file of JSON lines. The first line describes the scan
+    (its hosts and port range), and every following line is a checkpoint
+    holding the completed ports of each host as (start, end, status) runs.
+
+    Attributes:
+        journal_file: Where the journal is stored.
+        batch: How many results to buffer before checkpointing them.
+        interval: Longest time results stay buffered (in seconds).
+        buffer: The completed ports waiting to be checkpointed (host -> {port: status}).
+    """
+
+    def __init__(
+        self,
+        journal_file: str,
+        batch: int = JOURNAL_BATCH,
+        interval: float = JOURNAL_INTERVAL
+    ):
+        self.journal_file = journal_file
+        self.batch = batch
+        self.interval = interval
+
+        self.buffer = {}
+        self.buffered = 0
+        self.flushed = time.monotonic()
+
+        self.file = None
+        self.lock = Lock()
+
+    def begin(self, scan: dict, resume: bool = False) -> list:
+        """Opens the journal for a scan, replaying the completed ports when resuming.
+
+        Args:
+            scan: Description of the scan (hosts, start and end).
+            resume: Whether to continue the existing journal (a new one is started otherwise).
+
+        Returns:
+            list: The (host, port, status) of every port completed by earlier runs.
+
+        Raises:
+            ValueError: The existing journal belongs to a different scan.
+        """
+
+        completed = []
+
+        if resume and os.path.exists(self.journal_file):
+            previous, completed = self.load(self.journal_file)
+
+            # Validate that the journal was written by the same scan.
+            if previous != scan:
+                raise ValueError(f"'{self.journal_file}' belongs to a different scan")
+
+            self.file = open(self.journal_file, "a")
+        else:
+            # Start a new journal, beginning with the description of the scan.
+            self.file = open(self.journal_file, "w")
+            self.file.write(json.dumps(scan) + "\n")
+            self.sync()
+
+        return completed
+
+    def record(self, host: str, port: int, status: int):
+        """Buffers a completed port, checkpointing the buffer once it is full or old enough.
+
+        Args:
+            host: The host of the completed port.
+            port: The completed port.
+            status: The ports status (PORT_OPEN, PORT_CLOSED or PORT_FILTERED).
+        """
+
+        with self.lock:
+            self.buffer.setdefault(host, {})[port] = status
+            self.buffered += 1
+
+            if self.buffered >= self.batch or time.monotonic() - self.flushed >= self.interval:
+                self.flush_locked()
+
+    def flush(self):
+        """
+        Checkpoints every buffered port.
+        """
+
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        """
+        Checkpoints every buffered port (the lock must already be held).
+        """
+
+        if self.buffer and self.file and not self.file.closed:
+            checkpoint = {
+                host: self.encode_runs(ports) for host, ports in self.buffer.items()
+            }
+
+            self.file.write(json.dumps(checkpoint, separators=(",", ":")) + "\n")
+            self.sync()
+
+            self.buffer = {}
+            self.buffered = 0
+
+        self.flushed = time.monotonic()
+
+    def sync(self):
+        """
+        Forces the journal onto the disk, so that a checkpoint survives a crash.
+        """
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        """
+        Checkpoints the remaining ports and closes the journal.
+        """
+
+        with self.lock:
+            self.flush_locked()
+
+            if self.file:
+                self.file.close()
+
+    @staticmethod
+    def encode_runs(ports: dict) -> list:
+        """Compresses completed ports into runs of consecutive ports with the same status.
+
+        Args:
+            ports: The status of each completed port.
+
+        Returns:
+            list: The [start, end, status] runs of the ports.
+        """
+
+        runs = []
+
+        for port in sorted(ports):
+            status = ports[port]
+
+            # Extend the previous run if this port continues it.
+            if runs and runs[-1][1] == port - 1 and runs[-1][2] == status:
+                runs[-1][1] = port
+            else:
+                runs.append([port, port, status])
+
+        return runs
+
+    @staticmethod
+    def load(journal_file: str) -> tuple:
+        """Reads back a journal (including one cut off by a crash).
+
+        Args:
+            journal_file: The journal to read.
+
+        Returns:
+            tuple: The scans description and the (host, port, status) of every completed port.
+        """
+
+        completed = []
+
+        with open(journal_file) as file_obj:
+            scan = json.loads(file_obj.readline())
+
+            for line in file_obj:
+                try:
+                    checkpoint = json.loads(line)
+                except ValueError:
+                    # Skip a checkpoint that was cut off by a crash.
+                    continue
+
+                for host, runs in checkpoint.items():
+                    for start, end, status in runs:
+                        completed.extend((host, port, status) for port in range(start, end + 1))
+
+        return scan, completed
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/limits.py
+"""
+
+import os  # listdir
+import errno  # EMFILE, ENFILE, EADDRNOTAVAIL, ENOBUFS, ENOMEM
+import resource  # getrlimit, setrlimit, RLIMIT_NOFILE, RLIM_INFINITY
+
+FD_RESERVE = 64  # File descriptors kept free for output files, the resolver, the terminal, etc.
+PORT_SHARE = 0.5  # Share of the local port range a scan may keep in flight (the rest is
+# left to the rest of the machine and to ports waiting in TIME_WAIT).
+PORT_RANGE_FILE = "/proc/sys/net/ipv4/ip_local_port_range"
+DEFAULT_PORT_RANGE = (32768, 60999)  # Linux's default local port range.
+
+# Errors caused by the scanning machine running out of resources (file descriptors,
+# local ports, buffers), which say nothing about the probed port.
+RESOURCE_ERRORS = (errno.EMFILE, errno.ENFILE, errno.EADDRNOTAVAIL, errno.ENOBUFS, errno.ENOMEM)
+RESOURCE_RETRIES = 8  # How many times a probe that ran out of resources is retried.
+RESOURCE_BACKOFF = 0.05  # First wait before retrying such a probe (doubled each time, in seconds).
+RESOURCE_BACKOFF_MAX = 1.0  # Longest wait before retrying such a probe (in seconds).
+
+
+def is_resource_error(error: OSError) -> bool:
+    """Returns whether an error was caused by running out of resources (see RESOURCE_ERRORS)."""
+
+    return error.errno in RESOURCE_ERRORS
+
+
+def resource_delay(attempt: int) -> float:
+    """Returns how long to wait before retrying a probe that ran out of resources."""
+
+    return min(RESOURCE_BACKOFF * 2 ** attempt, RESOURCE_BACKOFF_MAX)
+
+
+def local_port_range() -> tuple:
+    """Returns the (first, last) local ports the kernel picks from for outgoing connections."""
+
+    try:
+        with open(PORT_RANGE_FILE) as file_obj:
+            first, last = map(int, file_obj.read().split())
+            return first, last
+    except (OSError, ValueError):
+        return DEFAULT_PORT_RANGE
+
+
+def open_fds() -> int:
+    """Returns the amount of file descriptors this process has open (0 if unknown)."""
+
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return 0
+
+
+def raise_fd_limit(wanted: int) -> int:
+    """Raises the soft file descriptor limit towards the wanted amount (up to the hard limit).
+
+    Args:
+        wanted: The amount of file descriptors wanted.
+
+    Returns:
+        int: The soft limit afterwards.
+    """
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    if soft == resource.RLIM_INFINITY or wanted <= soft:
+        return wanted if soft == resource.RLIM_INFINITY else soft
+
+    target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ValueError, OSError):
+        return soft
+
+    return target
+
+
+class FdBudget:
+    """Fits the concurrency of a scan to the file descriptors and local ports available.
+
+    Every connection in flight holds a file descriptor and a local port, so a
+    concurrency above either limit fails with EMFILE/EADDRNOTAVAIL instead of
+    scanning faster. The soft RLIMIT_NOFILE limit is raised first if it can be.
+
+    Attributes:
+        reserve: File descriptors kept free for everything but the probes.
+        port_share: Share of the local port range the probes may use.
+        limit: The soft file descriptor limit (after fit).
+        fds: File descriptors left for the probes (after fit).
+        ports: Local ports left for the probes (after fit).
+    """
+
+    def __init__(self, reserve: int = FD_RESERVE, port_share: float = PORT_SHARE):
+        self.reserve = reserve
+        self.port_share = port_share
+
+        self.limit = self.fds = self.ports = 0
+
+    def fit(self, concurrency: int) -> int:
+        """Returns the highest concurrency (up to the passed one) that fits the budget.
+
+        Args:
+            concurrency: The wanted amount of connections in flight.
+
+        Returns:
+            int: The amount of connections in flight that fits (at least 1).
+        """
+
+        used = open_fds()
+
+        self.limit = raise_fd_limit(used + concurrency + self.reserve)
+        self.fds = self.limit - used - self.reserve
+
+        first, last = local_port_range()
+        self.ports = int((last - first + 1) * self.port_share)
+
+        return max(1, min(concurrency, self.fds, self.ports))
@@ -0,0 +1,387 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/metrics.py
+"""
+
+import os  # replace
+import json  # dump
+import time  # monotonic, time
+
+from threading import Thread, Event, Lock
+
+METRICS_INTERVAL = 5.0  # How often the periodic snapshot is taken (in seconds).
+HISTOGRAM_SUB_BITS = 4  # Histograms keep 2^4 buckets per power of two (~6% precision).
+HISTOGRAM_QUANTILES = (0.5, 0.9, 0.99, 0.999)  # Quantiles included in snapshots.
+
+
+def metric_key(name: str, labels: dict = None) -> str:
+    """Returns the Prometheus style key of a metric (ex. probes_total{status="open"})."""
+
+    if not labels:
+        return name
+
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+class Counter:
+    """A value that only goes up (e.g., the amount of probes sent).
+
+    Attributes:
+        value: The current count.
+    """
+
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def collect(self):
+        return self.value
+
+
+class Gauge:
+    """A value that can go up and down (e.g., the amount of probes in flight).
+
+    Attributes:
+        value: The current value.
+        func: Called to get the value when collected instead (optional).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, func: callable = None):
+        self.value = 0
+        self.func = func
+        self.lock = Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self.lock:
+            self.value -= amount
+
+    def collect(self):
+        return self.func() if self.func else self.value
+
+
+class Histogram:
+    """Records a distribution of durations in log-linear buckets (like an HDR histogram).
+
+    Values are stored in microseconds. Below 2^(SUB_BITS + 1) each value has its own
+    bucket, above it every power of two is split into 2^SUB_BITS buckets, so recording
+    is a couple of integer operations and the relative error stays below ~6%.
+
+    Attributes:
+        counts: The amount of values in each bucket.
+        count: The amount of recorded values.
+        total: The sum of the recorded values (in seconds).
+        minimum: The smallest recorded value (in seconds).
+        maximum: The largest recorded value (in seconds).
+    """
+
+    kind = "histogram"
+
+    def __init__(self, sub_bits: int = HISTOGRAM_SUB_BITS):
+        self.sub_bits = sub_bits
+        self.sub_buckets = 1 << sub_bits
+
+        self.counts = [0] * (64 * self.sub_buckets)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+        self.lock = Lock()
+
+    def index(self, micros: int) -> int:
+        """Returns the bucket index of a value (in microseconds)."""
+
+        if micros < 2 * self.sub_buckets:
+            return micros
+
+        # The exponent picks the power of two, the top bits pick the bucket within it.
+        exponent = micros.bit_length() - (self.sub_bits + 1)
+        return exponent * self.sub_buckets + (micros >> exponent)
+
+    def lower_bound(self, index: int) -> int:
+        """Returns the smallest value (in microseconds) that falls into a bucket."""
+
+        if index < 2 * self.sub_buckets:
+            return index
+
+        exponent = index // self.sub_buckets - 1
+        return (index - exponent * self.sub_buckets) << exponent
+
+    def record(self, seconds: float):
+        """Records a duration.
+
+        Args:
+            seconds: The duration to record (in seconds).
+        """
+
+        index = self.index(max(0, int(seconds * 1_000_000)))
+
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+
+            if self.minimum is None or seconds < self.minimum:
+                self.minimum = seconds
+            if self.maximum is None or seconds > self.maximum:
+                self.maximum = seconds
+
+    def quantile(self, fraction: float) -> float:
+        """Returns the approximate value below which the passed fraction of values fall.
+
+        Args:
+            fraction: The quantile to get (0-1).
+
+        Returns:
+            float: The value in seconds (the middle of its bucket).
+        """
+
+        if not self.count:
+            return 0.0
+
+        target = max(1, round(fraction * self.count))
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= target:
+                low = self.lower_bound(index)
+                high = self.lower_bound(index + 1)
+                return min((low + high) / 2_000_000, self.maximum)
+
+        return self.maximum
+
+    def collect(self) -> dict:
+        with self.lock:
+            return {
+                "count": self.count,
+                "sum": self.total,
+                "min": self.minimum or 0.0,
+                "max": self.maximum or 0.0,
+                **{f"p{fraction * 100:g}": self.quantile(fraction)
+                   for fraction in HISTOGRAM_QUANTILES}
+            }
+
+
+class MetricsRegistry:
+    """Holds the metrics of a tool, and exports them as periodic snapshots, a JSON
+       dump and/or a Prometheus text file (for node_exporter's textfile collector).
+
+    Attributes:
+        metrics: Every registered metric (key -> metric).
+        help: The description of each metric name.
+        json_file: Where to dump the final snapshot as JSON (if not blank).
+        prometheus_file: Where to write the Prometheus text file (if not blank).
+        interval: How often the periodic snapshot is taken (in seconds).
+        on_snapshot: Called with every periodic snapshot (optional).
+        last: The previous snapshot, used to calculate rates.
+    """
+
+    def __init__(
+        self,
+        json_file: str = "",
+        prometheus_file: str = "",
+        interval: float = METRICS_INTERVAL,
+        on_snapshot: callable = None
+    ):
+        self.metrics = {}
+        self.help = {}
+
+        self.json_file = json_file
+        self.prometheus_file = prometheus_file
+        self.interval = interval
+        self.on_snapshot = on_snapshot
+
+        self.last = None
+        self.started = time.monotonic()
+
+        self.lock = Lock()
+        self.stopped = Event()
+        self.reporter = None
+
+    def register(self, cls, name: str, help: str, labels: dict = None, **options):
+        """Returns the metric with the passed name and labels, creating it if needed."""
+
+        key = metric_key(name, labels)
+
+        if metric := self.metrics.get(key):
+            return metric
+
+        with self.lock:
+            self.help.setdefault(name, help)
+            return self.metrics.setdefault(key, cls(**options))
+
+    def counter(self, name: str, help: str = "", labels: dict = None) -> Counter:
+        return self.register(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str = "", labels: dict = None, func: callable = None) -> Gauge:
+        return self.register(Gauge, name, help, labels, func=func)
+
+    def histogram(self, name: str, help: str = "", labels: dict = None) -> Histogram:
+        return self.register(Histogram, name, help, labels)
+
+    def snapshot(self) -> dict:
+        """Collects the current value of every metric, along with the per second
+           rate of each counter since the previous snapshot.
+
+        Returns:
+            dict: The time, uptime, values and rates of the metrics.
+        """
+
+        now = time.monotonic()
+        values = {key: metric.collect() for key, metric in list(self.metrics.items())}
+        rates = {}
+
+        if self.last:
+            elapsed = max(now - self.last["monotonic"], 1e-6)
+
+            for key, metric in list(self.metrics.items()):
+                if metric.kind == "counter":
+                    rates[key] = (values[key] - self.last["values"].get(key, 0)) / elapsed
+
+        self.last = {"monotonic": now, "values": values}
+
+        return {
+            "time": time.time(),
+            "uptime": now - self.started,
+            "values": values,
+            "rates": rates
+        }
+
+    def write_json(self, json_file: str = ""):
+        """
+        Dumps a snapshot of every metric to a JSON file.
+        """
+
+        with open(json_file or self.json_file, "w") as file_obj:
+            json.dump(self.snapshot(), file_obj, indent=4)
+
+    def prometheus_text(self) -> str:
+        """Formats every metric in the Prometheus text exposition format.
+
+        Histograms are exported as summaries (quantiles, sum and count).
+
+        Returns:
+            str: The formatted metrics.
+        """
+
+        lines = []
+        described = set()
+
+        for key, metric in sorted(list(self.metrics.items())):
+            name = key.split("{", 1)[0]
+            labels = key[len(name):]
+
+            # Describe each metric name once, before its first sample.
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self.help.get(name, '')}")
+                lines.append(f"# TYPE {name} "
+                             f"{'summary' if metric.kind == 'histogram' else metric.kind}")
+
+            if metric.kind != "histogram":
+                lines.append(f"{key} {metric.collect()}")
+                continue
+
+            summary = metric.collect()
+            inner = labels[1:-1] + "," if labels else ""
+
+            for fraction in HISTOGRAM_QUANTILES:
+                lines.append(f'{name}{{{inner}quantile="{fraction}"}} '
+                             f'{summary[f"p{fraction * 100:g}"]}')
+
+            lines.append(f"{name}_sum{labels} {summary['sum']}")
+            lines.append(f"{name}_count{labels} {summary['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, prometheus_file: str = ""):
+        """
+        Writes every metric to a Prometheus text file, replacing the old file
+        in one step so that a scraper never reads half a file.
+        """
+
+        prometheus_file = prometheus_file or self.prometheus_file
+
+        with open(prometheus_file + ".tmp", "w") as file_obj:
+            file_obj.write(self.prometheus_text())
+
+        os.replace(prometheus_file + ".tmp", prometheus_file)
+
+    def report(self):
+        """
+        Reporter thread, taking a snapshot every interval until stopped.
+        """
+
+        while not self.stopped.wait(self.interval):
+            snapshot = self.snapshot()
+
+            if self.prometheus_file:
+                self.write_prometheus()
+
+            if self.on_snapshot:
+                self.on_snapshot(snapshot)
+
+    def start(self):
+        """
+        Starts the periodic snapshots (if there is anywhere to send them).
+        """
+
+        self.stopped.clear()
+
+        if (self.prometheus_file or self.on_snapshot) and not self.reporter:
+            self.reporter = Thread(target=self.report, daemon=True)
+            self.reporter.start()
+
+    def stop(self):
+        """
+        Stops the periodic snapshots and writes the final JSON dump/Prometheus file.
+        """
+
+        self.stopped.set()
+
+        if self.reporter:
+            self.reporter.join()
+            self.reporter = None
+
+        if self.json_file:
+            self.write_json()
+
+        if self.prometheus_file:
+            self.write_prometheus()
+
+
+def open_metrics(metrics_file: str = "", **options) -> MetricsRegistry:
+    """Creates a MetricsRegistry exporting to the passed file, choosing the Prometheus
+       text format for .prom files and JSON otherwise.
+
+    Args:
+        metrics_file: Where to export the metrics (if not blank).
+        **options: Passed on to the MetricsRegistry (interval, on_snapshot).
+
+    Returns:
+        MetricsRegistry: The created registry.
+    """
+
+    if metrics_file.endswith(".prom"):
+        return MetricsRegistry(prometheus_file=metrics_file, **options)
+
+    return MetricsRegistry(json_file=metrics_file, **options)
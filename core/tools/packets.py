@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/packets.py
+"""
+
+import socket  # inet_ntop, AF_INET, AF_INET6
+import struct  # Struct
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101  # Packets starting with their IP header.
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276  # Newer tcpdumps capture every interface with these headers.
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_ARP = 0x0806
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLANS = (0x8100, 0x88a8, 0x9100)  # 802.1Q/802.1ad tags in front of the real type.
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPPROTO_ICMPV6 = 58
+# IPv6 extension headers skipped to reach the transport header (hop-by-hop, routing,
+# destination options). Fragments (44) are handled on their own.
+IPV6_EXTENSIONS = (0, 43, 60)
+IPV6_FRAGMENT = 44
+
+PROTOCOL_NAMES = {IPPROTO_ICMP: "ICMP", IPPROTO_TCP: "TCP", IPPROTO_UDP: "UDP", IPPROTO_ICMPV6: "ICMP6"}
+TCP_FLAG_NAMES = "FSRPAUEC"  # Fin, syn, reset, push, ack, urgent, ECN echo, congestion window reduced.
+
+ETHERNET_TYPE = struct.Struct("!H")
+IPV4_HEADER = struct.Struct("!BxHHHBBH4s4s")  # Version/IHL, length, id, fragment, TTL, protocol, checksum, addresses.
+IPV6_HEADER = struct.Struct("!4xHBB16s16s")  # Payload length, next header, hop limit and addresses.
+PORTS = struct.Struct("!HH")
+TCP_FLAGS = struct.Struct("!12xBB")  # Data offset and flags.
+ARP_HEADER = struct.Struct("!6xH6s4s6s4s")  # Operation, sender and target hardware/IPv4 addresses.
+
+
+def link_payload(link_type: int, data, header: bytes = b"") -> tuple:
+    """Strips the link layer header of a captured packet.
+
+    Args:
+        link_type: The link type of the capture (see the LINKTYPE constants).
+        data: The captured packet (bytes or memoryview).
+        header: The link layer header built for the packet, when data starts at its
+                network header (see RingCapture), so it never has to be prepended.
+
+    Returns:
+        tuple: The (ethertype, network layer data) of the packet (ethertype None if unknown).
+    """
+
+    if header:
+        return link_payload(link_type, header)[0], data
+
+    if link_type == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None, data
+
+        ethertype, offset = ETHERNET_TYPE.unpack_from(data, 12)[0], 14
+
+        # Skip (stacked) VLAN tags.
+        while ethertype in ETHERTYPE_VLANS and len(data) >= offset + 4:
+            ethertype, offset = ETHERNET_TYPE.unpack_from(data, offset + 2)[0], offset + 4
+
+        return ethertype, data[offset:]
+
+    if link_type == LINKTYPE_LINUX_SLL and len(data) >= 16:
+        return ETHERNET_TYPE.unpack_from(data, 14)[0], data[16:]
+
+    if link_type == LINKTYPE_LINUX_SLL2 and len(data) >= 20:
+        return ETHERNET_TYPE.unpack_from(data, 0)[0], data[20:]
+
+    if link_type == LINKTYPE_RAW and data:
+        return (ETHERTYPE_IPV4 if data[0] >> 4 == 4 else ETHERTYPE_IPV6), data
+
+    return None, data
+
+
+def decode_packet(link_type: int, data, header: bytes = b"") -> tuple:
+    """Decodes the link, network and transport headers of a captured packet.
+
+    Only the headers are read (by offset, without copying the packet), so a
+    packet is decoded in a few microseconds whatever its size.
+
+    Args:
+        link_type: The link type of the capture (see the LINKTYPE constants).
+        data: The captured packet (bytes or memoryview).
+        header: The link layer header built for the packet (see link_payload).
+
+    Returns:
+        tuple: The (protocol, source, destination, source port, destination port, info) of
+               the packet, the ports are 0 for protocols without any. None if not IP or ARP.
+    """
+
+    ethertype, data = link_payload(link_type, data, header)
+
+    try:
+        if ethertype == ETHERTYPE_IPV4:
+            (version_ihl, length, _, fragment, _, protocol, _,
+             source, destination) = IPV4_HEADER.unpack_from(data)
+
+            source = socket.inet_ntop(socket.AF_INET, source)
+            destination = socket.inet_ntop(socket.AF_INET, destination)
+
+            # Only the first fragment holds the transport header.
+            if fragment & 0x1fff:
+                return PROTOCOL_NAMES.get(protocol, str(protocol)), source, destination, 0, 0, "fragment"
+
+            # The length excludes the padding of short ethernet frames.
+            return decode_transport(protocol, source, destination, data[(version_ihl & 0x0f) * 4:length])
+
+        if ethertype == ETHERTYPE_IPV6:
+            length, protocol, _, source, destination = IPV6_HEADER.unpack_from(data)
+            data = data[:IPV6_HEADER.size + length]
+
+            source = socket.inet_ntop(socket.AF_INET6, source)
+            destination = socket.inet_ntop(socket.AF_INET6, destination)
+            offset = IPV6_HEADER.size
+
+            # Walk the extension headers up to the transport header.
+            while protocol in IPV6_EXTENSIONS or protocol == IPV6_FRAGMENT:
+                if protocol == IPV6_FRAGMENT:
+                    if PORTS.unpack_from(data, offset)[1] & 0xfff8:
+                        return (PROTOCOL_NAMES.get(data[offset], str(data[offset])),
+                                source, destination, 0, 0, "fragment")
+
+                    protocol, offset = data[offset], offset + 8
+                else:
+                    protocol, offset = data[offset], offset + (data[offset + 1] + 1) * 8
+
+            return decode_transport(protocol, source, destination, data[offset:])
+
+        if ethertype == ETHERTYPE_ARP:
+            operation, _, sender, _, target = ARP_HEADER.unpack_from(data)
+
+            sender = socket.inet_ntop(socket.AF_INET, sender)
+            target = socket.inet_ntop(socket.AF_INET, target)
+
+            return "ARP", sender, target, 0, 0, "request" if operation == 1 else "reply"
+
+    except (struct.error, IndexError):
+        # The packet was truncated by the snapshot length.
+        return None
+
+    return None
+
+
+def decode_transport(protocol: int, source: str, destination: str, data) -> tuple:
+    """Decodes the transport header of a packet (see decode_packet)."""
+
+    name = PROTOCOL_NAMES.get(protocol, str(protocol))
+
+    if protocol == IPPROTO_TCP:
+        source_port, destination_port = PORTS.unpack_from(data)
+        offset, flags = TCP_FLAGS.unpack_from(data)
+
+        flags = "".join(flag for bit, flag in enumerate(TCP_FLAG_NAMES) if flags & (1 << bit))
+        info = f"[{flags}] len {max(len(data) - (offset >> 4) * 4, 0)}"
+
+        return name, source, destination, source_port, destination_port, info
+
+    if protocol == IPPROTO_UDP:
+        source_port, destination_port = PORTS.unpack_from(data)
+        return name, source, destination, source_port, destination_port, f"len {max(len(data) - 8, 0)}"
+
+    if protocol in (IPPROTO_ICMP, IPPROTO_ICMPV6):
+        return name, source, destination, 0, 0, f"type {data[0]} code {data[1]}"
+
+    return name, source, destination, 0, 0, ""
+
+
+def format_packet(packet: tuple) -> str:
+    """Formats a decoded packet (see decode_packet) into a one line summary."""
+
+    protocol, source, destination, source_port, destination_port, info = packet
+
+    if source_port or destination_port:
+        source, destination = f"{source}.{source_port}", f"{destination}.{destination_port}"
+
+    return f"{protocol} {source} > {destination}: {info}"
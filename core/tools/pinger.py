@@ -5,11 +5,291 @@
     @package: core/tools/pinger.py
 """
 
-import subprocess  # run, PIPE
+import os  # getpid
+import time  # monotonic
+import socket  # socket, gaierror, AF_INET, AF_INET6
+import struct  # pack, unpack_from
+import select  # select
+import subprocess  # run, Popen, PIPE, DEVNULL
+
+from core.tools.resolver import RESOLVER
+
+PING_TIMEOUT = 1.0  # How long to wait for all of the echo replies (in seconds).
+PING_BATCH = 64  # How many echo requests to send before checking for replies.
+PING_PAYLOAD = b"security-assessment"  # Data sent inside every echo request.
+PING_PROCESSES = 128  # Most ping commands run at once when ICMP sockets aren't permitted.
+PING_GRACE = 1.0  # How long a ping command may outlive its own timeout before being killed.
+
+# ICMP echo request/reply types for each address family.
+ECHO_TYPES = {
+    socket.AF_INET: (8, 0),
+    socket.AF_INET6: (128, 129)
+}
+
+
+def checksum(data: bytes) -> int:
+    """Calculates the internet checksum (RFC 1071) of the passed data.
+
+    Args:
+        data: The bytes to calculate the checksum of.
+
+    Returns:
+        int: The 16-bit one's complement checksum.
+    """
+
+    # Pad the data to an even length so it can be read as 16-bit words.
+    if len(data) % 2:
+        data += b"\0"
+
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+
+    # Fold the carries back into the lower 16 bits.
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+
+    return ~total & 0xFFFF
+
+
+def open_icmp_socket(family: int) -> tuple:
+    """Opens the socket used to send echo requests for the passed address family.
+
+    Unprivileged datagram ICMP sockets are preferred, falling back to raw sockets
+    (which require root).
+
+    Args:
+        family: The address family to ping (AF_INET or AF_INET6).
+
+    Returns:
+        tuple: The opened (socket, whether it is a raw socket).
+
+    Raises:
+        OSError: Neither socket type is permitted.
+    """
+
+    proto = socket.IPPROTO_ICMP if family == socket.AF_INET else socket.IPPROTO_ICMPV6
+
+    try:
+        sock, raw = socket.socket(family, socket.SOCK_DGRAM, proto), False
+    except OSError:
+        sock, raw = socket.socket(family, socket.SOCK_RAW, proto), True
+
+    # Make room for thousands of replies arriving at once.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.setblocking(False)
+
+    return sock, raw
+
+
+def build_echo_request(family: int, ident: int, sequence: int) -> bytes:
+    """Builds an ICMP (or ICMPv6) echo request packet.
+
+    Args:
+        family: The address family of the target (AF_INET or AF_INET6).
+        ident: The echo identifier (replaced by the kernel on datagram sockets).
+        sequence: The echo sequence number used to match the reply.
+
+    Returns:
+        bytes: The echo request to send.
+    """
+
+    request_type = ECHO_TYPES[family][0]
+    header = struct.pack("!BBHHH", request_type, 0, 0, ident, sequence)
+
+    # The kernel calculates ICMPv6 checksums itself, as they cover the IPv6 header.
+    if family == socket.AF_INET:
+        header = struct.pack("!BBHHH", request_type, 0,
+                             checksum(header + PING_PAYLOAD), ident, sequence)
+
+    return header + PING_PAYLOAD
+
+
+def parse_echo_reply(family: int, data: bytes, raw: bool) -> tuple:
+    """Parses a received packet into its echo identifier and sequence number.
+
+    Args:
+        family: The address family the packet was received on.
+        data: The received packet.
+        raw: Whether the packet was received on a raw socket.
+
+    Returns:
+        tuple: The (ident, sequence) of the echo reply, or None if it isn't one.
+    """
+
+    # Raw IPv4 sockets include the IP header, whose length is in its first byte.
+    offset = (data[0] & 0x0F) * 4 if raw and family == socket.AF_INET else 0
+
+    if len(data) < offset + 8:
+        return None
+
+    reply_type, _, _, ident, sequence = struct.unpack_from("!BBHHH", data, offset)
+
+    # Ignore everything that isn't an echo reply (including our own requests on loopback).
+    if reply_type != ECHO_TYPES[family][1]:
+        return None
+
+    return ident, sequence
+
+
+def ping_sweep(hosts: list, timeout: float = PING_TIMEOUT) -> dict:
+    """Sends an echo request to every passed host from a single socket per address
+       family, matching the replies by their address and sequence number.
+
+    Falls back to running the ping command for every host (PING_PROCESSES at a time)
+    if ICMP sockets can't be opened.
+
+    Args:
+        hosts: The hosts to ping.
+        timeout: How long to wait for all of the replies (in seconds).
+
+    Returns:
+        dict: The round trip time (in seconds) of each host, or None if it didn't reply.
+    """
+
+    results = dict.fromkeys(hosts)
+    deadline = time.monotonic() + timeout
+
+    # Group the requests by address family, as each needs its own socket.
+    requests = {socket.AF_INET: [], socket.AF_INET6: []}
+
+    for host in results:
+        try:
+            family, address = RESOLVER.resolve(host)
+        except socket.gaierror:
+            # Unknown hosts can't reply to a ping request.
+            continue
+
+        requests[family].append((host, address))
+
+    try:
+        sockets = {
+            family: open_icmp_socket(family)
+            for family, targets in requests.items() if targets
+        }
+    except OSError:
+        # ICMP sockets aren't permitted, so use the ping command instead.
+        return ping_sweep_subprocess(requests, results, timeout)
+
+    ident = os.getpid() & 0xFFFF
+    pending = {}  # (family, address, sequence) -> (host, time sent)
+    outbox = [
+        (family, host, address, i & 0xFFFF)
+        for family, targets in requests.items()
+        for i, (host, address) in enumerate(targets)
+    ]
+
+    try:
+        while (outbox or pending) and (remaining := deadline - time.monotonic()) > 0:
+            # Send the next batch of echo requests.
+            for family, host, address, sequence in outbox[:PING_BATCH]:
+                sock, _ = sockets[family]
+
+                try:
+                    sock.sendto(build_echo_request(family, ident, sequence), (address, 0))
+                    pending[(family, address, sequence)] = (host, time.monotonic())
+                except OSError:
+                    # Unreachable networks fail straight away.
+                    continue
+
+            del outbox[:PING_BATCH]
+
+            # Wait for replies, without blocking if there are more requests to send.
+            readable, _, _ = select.select(
+                [sock for sock, _ in sockets.values()], [], [],
+                0 if outbox else remaining)
+
+            # Read every reply that has arrived so far.
+            for family, (sock, raw) in sockets.items():
+                if sock not in readable:
+                    continue
+
+                while True:
+                    try:
+                        data, sender = sock.recvfrom(2048)
+                    except BlockingIOError:
+                        break
+
+                    if not (reply := parse_echo_reply(family, data, raw)):
+                        continue
+
+                    # Datagram sockets replace the identifier, and only ever
+                    # receive replies to their own requests.
+                    if raw and reply[0] != ident:
+                        continue
+
+                    if request := pending.pop((family, sender[0], reply[1]), None):
+                        host, sent = request
+                        results[host] = time.monotonic() - sent
+
+    finally:
+        for sock, _ in sockets.values():
+            sock.close()
+
+    return results
+
+
+def ping_sweep_subprocess(requests: dict, results: dict, timeout: float) -> dict:
+    """Pings the resolved hosts by running the ping command for each of them, keeping
+       up to PING_PROCESSES commands running at once (refilled as each one exits) so
+       that large sweeps stay within the process and file descriptor limits.
+
+    Args:
+        requests: The (host, address) pairs to ping for each address family.
+        results: The results dictionary to fill in.
+        timeout: How long to wait for each hosts reply (in seconds).
+
+    Returns:
+        dict: The round trip time (in seconds) of each host, or None if it didn't reply.
+    """
+
+    # The ping command only waits for whole seconds.
+    wait = max(1, round(timeout))
+
+    targets = ((host, address) for hosts in requests.values() for host, address in hosts)
+    processes = {}
+
+    try:
+        while True:
+            # Start the next commands as the running ones exit.
+            while len(processes) < PING_PROCESSES and (target := next(targets, None)):
+                host, address = target
+                processes[host] = (time.monotonic(), subprocess.Popen(
+                    ["ping", "-c", "1", "-W", str(wait), address],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                ))
+
+            if not processes:
+                break
+
+            # Collect the results as the commands exit.
+            for host, (started, process) in list(processes.items()):
+                if process.poll() is None:
+                    # Stop the commands that didn't finish in time.
+                    if time.monotonic() - started < wait + PING_GRACE:
+                        continue
+
+                    process.kill()
+                    process.wait()
+
+                # 0 = success code.
+                elif process.returncode == 0:
+                    results[host] = time.monotonic() - started
+
+                del processes[host]
+
+            time.sleep(0.01)
+
+    finally:
+        # Stop the commands still running if the sweep was interrupted.
+        for _, process in processes.values():
+            process.kill()
+            process.wait()
+
+    return results
 
 
 def ping_host(host: str) -> bool:
-    """Sends a ping request to the passed host address using subprocess.
+    """Sends a ping request to the passed host address.
 
     Args:
         host: The host to send the ping request to.
@@ -18,12 +298,4 @@ def ping_host(host: str) -> bool:
         bool: Whether the host responded to the ping request (True) or not (False).
     """
 
-    # Create and execute the constructed subprocess command.
-    ping = subprocess.run(
-        ["ping", "-c", "1", host],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-
-    # Return whether the host replied to the request or not (0 = success code).
-    return ping.returncode == 0
+    return ping_sweep([host]).get(host) is not None
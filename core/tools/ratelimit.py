@@ -0,0 +1,291 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/ratelimit.py
+"""
+
+import math  # inf
+import time  # monotonic
+
+from threading import Lock
+
+RATE_MIN = 10.0  # Lowest rate congestion control can cut a limit down to (probes per second).
+RATE_DECREASE = 0.5  # How much the rate is multiplied by when timeouts spike.
+RATE_GROWTH = 1.25  # How much the rate is multiplied by when responses recover.
+CONGESTION_WINDOW = 64  # How many probe outcomes are judged at once.
+SPIKE_THRESHOLD = 0.2  # How far the timeout ratio must rise above its baseline to count as a spike.
+BASELINE_ALPHA = 1 / 16  # How quickly the baseline timeout ratio follows the measured one.
+
+
+class TokenBucket:
+    """Limits how often an action may happen using the token bucket algorithm.
+
+    Tokens are added at a steady rate up to the burst size, and each action
+    spends one. Reservations are allowed to go into debt, with the caller
+    being told how long to wait instead, which lets both threads (time.sleep)
+    and coroutines (asyncio.sleep) share the same bucket.
+
+    Attributes:
+        rate: How many tokens are added per second.
+        burst: The maximum amount of tokens that can be saved up.
+        tokens: The current amount of tokens (negative when in debt).
+        updated: When the tokens were last refilled (time.monotonic).
+    """
+
+    def __init__(self, rate: float, burst: float = 0):
+        self.rate = float(rate)
+
+        # Default to a tenth of a second worth of tokens, but at least one.
+        self.burst = float(burst) or max(1.0, self.rate / 10)
+
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+        self.lock = Lock()
+
+    def set_rate(self, rate: float):
+        """Changes the rate of the bucket, keeping a tenth of a second worth of burst.
+
+        Args:
+            rate: The new amount of tokens added per second.
+        """
+
+        with self.lock:
+            self.rate = float(rate)
+            self.burst = max(1.0, self.rate / 10)
+            self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self, amount: float = 1) -> float:
+        """Takes tokens from the bucket, returning how long to wait before using them.
+
+        Args:
+            amount: The amount of tokens to take.
+
+        Returns:
+            float: The amount of seconds to wait before acting (0 if none).
+        """
+
+        with self.lock:
+            now = time.monotonic()
+
+            # Refill the bucket with the tokens earned since the last reservation.
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # Take the tokens, even if it puts the bucket into debt.
+            self.tokens -= amount
+
+            # Wait for as long as it takes to pay back any debt.
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, amount: float = 1):
+        """
+        Blocks the calling thread until the reserved tokens can be used.
+        """
+
+        if delay := self.reserve(amount):
+            time.sleep(delay)
+
+
+class RateController:
+    """Limits a probe rate with a TokenBucket, adjusting it from the outcomes of the
+       probes by cutting it in half and growing it back gradually, like TCP congestion control.
+
+    Every CONGESTION_WINDOW outcomes the timeout ratio is compared to its slowly moving
+    baseline. A spike above the baseline (e.g., an IDS or a full conntrack table
+    dropping probes) cuts the rate, while a normal window lets it grow back. Hosts that
+    always time out (filtered) have a high baseline, so they aren't slowed down for it.
+
+    Attributes:
+        ceiling: The highest allowed rate (math.inf for unlimited).
+        floor: The lowest rate congestion control can cut it down to.
+        rate: The current rate (math.inf for unlimited).
+        bucket: The TokenBucket enforcing the current rate (None while unlimited).
+        adaptive: Whether the rate is adjusted from the probe outcomes.
+        baseline: The usual timeout ratio (None until the first window).
+        peak: The highest measured probe rate, used to lift the limit again when unlimited.
+        decreases: How many times the rate was cut.
+        increases: How many times the rate was raised.
+    """
+
+    def __init__(
+        self,
+        ceiling: float = 0,
+        floor: float = RATE_MIN,
+        window: int = CONGESTION_WINDOW,
+        adaptive: bool = True
+    ):
+        self.ceiling = float(ceiling) if ceiling > 0 else math.inf
+        self.floor = min(floor, self.ceiling)
+        self.window = window
+        self.adaptive = adaptive
+
+        self.rate = self.ceiling
+        self.bucket = TokenBucket(self.rate) if self.rate != math.inf else None
+
+        self.baseline = None
+        self.peak = 0.0
+        self.decreases = 0
+        self.increases = 0
+
+        self.outcomes = 0
+        self.timeouts = 0
+        self.started = time.monotonic()
+
+        self.lock = Lock()
+
+    def reserve(self) -> float:
+        """Reserves a probe, returning how long to wait before sending it.
+
+        Returns:
+            float: The amount of seconds to wait (0 if none).
+        """
+
+        bucket = self.bucket
+        return bucket.reserve() if bucket else 0.0
+
+    def set_rate(self, rate: float):
+        """
+        Changes the current rate, creating or removing the TokenBucket as needed.
+        """
+
+        self.rate = rate
+
+        if rate == math.inf:
+            self.bucket = None
+        elif self.bucket:
+            self.bucket.set_rate(rate)
+        else:
+            self.bucket = TokenBucket(rate)
+
+    def observe(self, timed_out: bool):
+        """Counts the outcome of a probe, adjusting the rate at the end of each window.
+
+        Args:
+            timed_out: Whether the probe timed out.
+        """
+
+        if not self.adaptive:
+            return
+
+        with self.lock:
+            self.outcomes += 1
+            self.timeouts += timed_out
+
+            if self.outcomes < self.window:
+                return
+
+            now = time.monotonic()
+            ratio = self.timeouts / self.outcomes
+            measured = self.outcomes / max(now - self.started, 1e-6)
+
+            # Start the next window.
+            self.outcomes = self.timeouts = 0
+            self.started = now
+            self.peak = max(self.peak, measured)
+
+            # The first window only sets the baseline.
+            if self.baseline is None:
+                self.baseline = ratio
+                return
+
+            if ratio - self.baseline > SPIKE_THRESHOLD:
+                # Timeouts spiked, so cut the rate (starting from the measured
+                # rate if there was no limit yet).
+                self.set_rate(max(self.floor, min(self.rate, measured) * RATE_DECREASE))
+                self.decreases += 1
+
+            elif self.rate < self.ceiling:
+                # Responses are normal, so grow the rate back towards the ceiling,
+                # lifting the limit completely once it is well past the peak.
+                rate = min(self.ceiling, self.rate * RATE_GROWTH)
+
+                if self.ceiling == math.inf and rate > self.peak * 2:
+                    rate = math.inf
+
+                self.set_rate(rate)
+                self.increases += 1
+
+            # Let the baseline slowly follow the timeout ratio.
+            self.baseline += BASELINE_ALPHA * (ratio - self.baseline)
+
+    @property
+    def stats(self) -> dict:
+        """Returns the current rate and how often it was adjusted."""
+
+        return {
+            "rate": self.rate,
+            "decreases": self.decreases,
+            "increases": self.increases
+        }
+
+
+class ProbeScheduler:
+    """Paces probes under a global rate limit and a rate limit per host, each
+       adjusted by congestion control (see RateController).
+
+    Attributes:
+        global_control: The RateController shared by every host.
+        host_rate: The rate limit of each host (0 for unlimited).
+        adaptive: Whether the rates are adjusted from the probe outcomes.
+        hosts: The RateController of each host.
+    """
+
+    def __init__(self, rate: float = 0, host_rate: float = 0, adaptive: bool = True):
+        self.global_control = RateController(rate, adaptive=adaptive)
+        self.host_rate = host_rate
+        self.adaptive = adaptive
+
+        self.hosts = {}
+        self.lock = Lock()
+
+    def host(self, host: str) -> RateController:
+        """Returns the RateController of the passed host, creating it if needed."""
+
+        if control := self.hosts.get(host):
+            return control
+
+        with self.lock:
+            return self.hosts.setdefault(
+                host, RateController(self.host_rate, adaptive=self.adaptive))
+
+    def reserve(self, host: str) -> float:
+        """Reserves a probe of the passed host, returning how long to wait before sending it.
+
+        Args:
+            host: The host that will be probed.
+
+        Returns:
+            float: The amount of seconds to wait (0 if none).
+        """
+
+        return max(self.global_control.reserve(), self.host(host).reserve())
+
+    def acquire(self, host: str):
+        """
+        Blocks the calling thread until a probe of the passed host may be sent.
+        """
+
+        if delay := self.reserve(host):
+            time.sleep(delay)
+
+    def observe(self, host: str, timed_out: bool):
+        """Counts the outcome of a probe towards the global and the hosts rate.
+
+        Args:
+            host: The probed host.
+            timed_out: Whether the probe timed out.
+        """
+
+        self.global_control.observe(timed_out)
+        self.host(host).observe(timed_out)
+
+    def report(self) -> dict:
+        """Returns the rate of every host, along with the global rate ("*")."""
+
+        return {
+            "*": self.global_control.stats,
+            **{host: control.stats for host, control in self.hosts.items()}
+        }
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/resolver.py
+"""
+
+import time  # monotonic
+import socket  # getaddrinfo, AF_INET, AF_INET6, AF_UNSPEC
+
+from threading import Lock
+
+RESOLVER_TTL = 300  # How long a resolved host stays cached (in seconds).
+
+
+class Resolver:
+    """Resolves host names to addresses, caching the results for a set time
+       so that each target is only looked up once per scan.
+
+    Attributes:
+        ttl: How long a cached address is valid for (in seconds).
+        hits: The amount of lookups answered from the cache.
+        misses: The amount of lookups that had to query the system resolver.
+        cache: Storage for the resolved addresses ((host, family) -> (expiry, addresses)).
+    """
+
+    def __init__(self, ttl: float = RESOLVER_TTL):
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self.cache = {}
+        self.lock = Lock()
+
+    def lookup(self, host: str, family: int = socket.AF_UNSPEC) -> list:
+        """Queries the system resolver for all of the addresses of the passed host.
+
+        Args:
+            host: The host name or IP address to resolve.
+            family: Restrict the results to an address family (AF_INET/AF_INET6).
+
+        Returns:
+            list: (family, address) tuples in the order preferred by the system.
+        """
+
+        addresses = []
+
+        # Only ask for TCP results, otherwise every address is returned once
+        # for each socket type.
+        for info in socket.getaddrinfo(host, None, family, socket.SOCK_STREAM):
+            # Format: (family, type, proto, canonname, sockaddr)
+            address = (info[0], info[4][0])
+
+            # Skip duplicate addresses while keeping the preferred order.
+            if address not in addresses:
+                addresses.append(address)
+
+        return addresses
+
+    def resolve_all(self, host: str, family: int = socket.AF_UNSPEC) -> list:
+        """Resolves all addresses of the passed host, using the cache if possible.
+
+        Args:
+            host: The host name or IP address to resolve.
+            family: Restrict the results to an address family (AF_INET/AF_INET6).
+
+        Returns:
+            list: (family, address) tuples in the order preferred by the system.
+
+        Raises:
+            socket.gaierror: The host could not be resolved.
+        """
+
+        key = (host, family)
+
+        with self.lock:
+            # Answer from the cache if the entry hasn't expired yet.
+            if (entry := self.cache.get(key)) and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+        # Query the resolver outside of the lock so that other hosts
+        # aren't blocked behind a slow lookup.
+        addresses = self.lookup(host, family)
+
+        with self.lock:
+            self.cache[key] = (time.monotonic() + self.ttl, addresses)
+
+        return addresses
+
+    def resolve(self, host: str, family: int = socket.AF_UNSPEC) -> tuple:
+        """Resolves the preferred address of the passed host.
+
+        Args:
+            host: The host name or IP address to resolve.
+            family: Restrict the result to an address family (AF_INET/AF_INET6).
+
+        Returns:
+            tuple: The (family, address) to connect to.
+        """
+
+        return self.resolve_all(host, family)[0]
+
+    def clear(self):
+        """
+        Removes every cached address, forcing the next lookups to be resolved again.
+        """
+
+        with self.lock:
+            self.cache.clear()
+
+    @property
+    def stats(self) -> dict:
+        """Returns the cache counters of the resolver.
+
+        Returns:
+            dict: The hits, misses and amount of cached hosts.
+        """
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "cached": len(self.cache)
+        }
+
+
+class PinnedResolver:
+    """Answers the lookups of a scan from the addresses its targets resolved to
+       when it started, so that a cache entry expiring mid-scan never blocks a
+       probe (or an event loop) on the system resolver.
+
+    Attributes:
+        resolver: The Resolver the targets are resolved with (and other hosts fall back to).
+        addresses: The pinned (family, address) of each target.
+    """
+
+    def __init__(self, resolver: Resolver):
+        self.resolver = resolver
+        self.addresses = {}
+
+    def pin(self, host: str) -> tuple:
+        """Resolves a target, keeping its address for the rest of the scan.
+
+        Args:
+            host: The host name or IP address to resolve.
+
+        Returns:
+            tuple: The (family, address) to connect to.
+
+        Raises:
+            socket.gaierror: The host could not be resolved.
+        """
+
+        self.addresses[host] = self.resolver.resolve(host)
+        return self.addresses[host]
+
+    def get(self, host: str) -> tuple:
+        """Returns the pinned (family, address) of a target (None if it wasn't pinned)."""
+
+        return self.addresses.get(host)
+
+    def resolve(self, host: str, family: int = socket.AF_UNSPEC) -> tuple:
+        """Resolves the preferred address of the passed host (see Resolver.resolve),
+           answering from the pinned addresses first.
+        """
+
+        if family == socket.AF_UNSPEC and (address := self.addresses.get(host)):
+            return address
+
+        return self.resolver.resolve(host, family)
+
+
+# Resolver shared by every tool so that they all benefit from the same cache.
+RESOLVER = Resolver()
+
+
+def resolve_host(host: str) -> str:
+    """Resolves the preferred address of the passed host using the shared resolver.
+
+    Args:
+        host: The host name or IP address to resolve.
+
+    Returns:
+        str: The resolved IPv4 or IPv6 address.
+    """
+
+    return RESOLVER.resolve(host)[1]
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/results.py
+"""
+
+import time  # time
+
+from array import array
+from datetime import datetime
+from threading import Lock
+
+# Port statuses, stored as 2 bits per port.
+PORT_UNSCANNED = 0  # The port hasn't been scanned yet.
+PORT_OPEN = 1  # The connection was accepted.
+PORT_CLOSED = 2  # The connection was refused (or failed).
+PORT_FILTERED = 3  # The connection timed out.
+
+STATUS_NAMES = ("unscanned", "open", "closed", "filtered")
+
+LATENCY_SCALE = 10000  # Latencies are stored in tenths of a millisecond.
+LATENCY_MAX = 0xFFFF  # Largest storable latency (about 6.5 seconds).
+
+
+class Port:
+    """Represents a network port to be scanned.
+
+    Attributes:
+        host: The parent host the port belongs to.
+        port: The target port to be scanned on the host.
+        time: The time (datetime) the port was scanned.
+        status: Whether the port was open or not.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        time: datetime = datetime.now(),
+        status: bool = False
+    ):
+        self.host = host
+        self.port = port
+        self._time = time
+        self.status = status
+
+    @property
+    def time(self, format: str = "%H:%M:%S") -> str:
+        """Returns the formatted version of the ports scanned time.
+
+        Args:
+            format: Formatting string to pass to datetime.strftime.
+
+        Returns:
+            str: The formatted datetime based on the specified format.
+        """
+
+        return self._time.strftime(format)
+
+    @time.setter
+    def time(self, new_time: datetime) -> str:
+        """Sets a new scanned time for the port.
+
+        Args:
+            new_time: New datetime instance to replace the old one with.
+        """
+
+        # Verify that the new time is a valid datetime object.
+        if isinstance(new_time, datetime):
+            self._time = new_time
+
+
+class HostResults:
+    """Compact results of a single hosts scanned range of ports.
+
+    Statuses are packed 4 to a byte, with the scan times (milliseconds since the
+    stores epoch) and latencies (tenths of a millisecond) in typed arrays, so
+    a port costs about 6 bytes instead of a full Port object.
+
+    Attributes:
+        host: The host the results belong to.
+        start: The first port of the scanned range.
+        end: The last port of the scanned range.
+        status: The 2-bit status of each port in the range.
+        times: When each port was scanned (milliseconds since the stores epoch).
+        latencies: How long each port took to answer (tenths of a millisecond).
+        counts: The amount of ports with each status (indexed by status).
+        skipped: The amount of ports in the range that aren't part of the scan
+                 (ex. excluded by the port expression), which stay unscanned.
+    """
+
+    __slots__ = ("host", "start", "end", "status", "times", "latencies", "counts", "skipped")
+
+    def __init__(self, host: str, start: int, end: int, skipped: int = 0):
+        size = end - start + 1
+
+        self.host = host
+        self.start = start
+        self.end = end
+        self.skipped = skipped
+
+        self.status = bytearray((size + 3) // 4)
+        self.times = array("I", bytes(4 * size))
+        self.latencies = array("H", bytes(2 * size))
+
+        # Every port starts unscanned.
+        self.counts = [size, 0, 0, 0]
+
+    def __contains__(self, port: int) -> bool:
+        return self.start <= port <= self.end
+
+    def get(self, port: int) -> int:
+        """Returns the status of the passed port.
+
+        Args:
+            port: The port to get the status of.
+
+        Returns:
+            int: The ports status (PORT_UNSCANNED, PORT_OPEN, PORT_CLOSED or PORT_FILTERED).
+        """
+
+        i = port - self.start
+        return (self.status[i >> 2] >> ((i & 3) * 2)) & 3
+
+    def set(self, port: int, status: int, when: int, latency: int) -> int:
+        """Stores the result of the passed port (not thread-safe, see ResultStore.record).
+
+        Args:
+            port: The scanned port.
+            status: The ports new status.
+            when: When the port was scanned (milliseconds since the stores epoch).
+            latency: How long the port took to answer (tenths of a millisecond).
+
+        Returns:
+            int: The ports previous status.
+        """
+
+        i = port - self.start
+        shift = (i & 3) * 2
+        previous = (self.status[i >> 2] >> shift) & 3
+
+        # Replace the ports 2 status bits.
+        self.status[i >> 2] = (self.status[i >> 2] & ~(3 << shift)) | (status << shift)
+        self.times[i] = when
+        self.latencies[i] = min(latency, LATENCY_MAX)
+
+        # Move the port between the status counters.
+        self.counts[previous] -= 1
+        self.counts[status] += 1
+
+        return previous
+
+    @property
+    def remaining(self) -> int:
+        """Returns the amount of ports left to scan."""
+
+        return self.counts[PORT_UNSCANNED] - self.skipped
+
+    @property
+    def complete(self) -> bool:
+        """Returns whether every port of the scan has been scanned."""
+
+        return not self.remaining
+
+    def ports(self, status: int = None):
+        """Generates the scanned ports of the host in order, without sorting.
+
+        Args:
+            status: Only generate ports with this status (all scanned ports if None).
+
+        Yields:
+            tuple: The (port, status, time, latency) of each scanned port.
+        """
+
+        for i in range(self.end - self.start + 1):
+            port_status = (self.status[i >> 2] >> ((i & 3) * 2)) & 3
+
+            if port_status == PORT_UNSCANNED or (status is not None and port_status != status):
+                continue
+
+            yield self.start + i, port_status, self.times[i], self.latencies[i]
+
+
+class ResultStore:
+    """Thread-safe storage for the results of a (multi-host) scan.
+
+    Attributes:
+        hosts: The HostResults of each host, in the order they were added.
+        epoch: When the store was created (time.time), which scan times are relative to.
+        lock: Guards every update, as the thread engine records from many threads.
+    """
+
+    def __init__(self):
+        self.hosts = {}
+        self.epoch = time.time()
+        self.lock = Lock()
+
+    def add_host(self, host: str, start: int, end: int, skipped: int = 0) -> HostResults:
+        """Adds a host and the range of ports that will be scanned on it.
+
+        Args:
+            host: The host to add.
+            start: The first port of the scanned range.
+            end: The last port of the scanned range.
+            skipped: The amount of ports in the range that won't be scanned.
+
+        Returns:
+            HostResults: The hosts results.
+        """
+
+        with self.lock:
+            self.hosts[host] = HostResults(host, start, end, skipped)
+            return self.hosts[host]
+
+    def record(
+        self,
+        host: str,
+        port: int,
+        status: int,
+        latency: float = 0,
+        when: float = None
+    ) -> bool:
+        """Stores the result of a scanned port.
+
+        Args:
+            host: The host of the scanned port.
+            port: The scanned port.
+            status: The ports status (PORT_OPEN, PORT_CLOSED or PORT_FILTERED).
+            latency: How long the port took to answer (in seconds).
+            when: When the port was scanned (time.time, defaults to now).
+
+        Returns:
+            bool: Whether this port finished the scan of its host.
+        """
+
+        when = int(((when or time.time()) - self.epoch) * 1000)
+
+        with self.lock:
+            results = self.hosts[host]
+            previous = results.set(port, status, when, int(latency * LATENCY_SCALE))
+
+            # Only the port that scanned the last unscanned port finishes the host.
+            return previous == PORT_UNSCANNED and results.complete
+
+    def get(self, host: str, port: int) -> int:
+        """Returns the status of the passed hosts port (PORT_UNSCANNED if unknown)."""
+
+        results = self.hosts.get(host)
+        return results.get(port) if results and port in results else PORT_UNSCANNED
+
+    def count(self, status: int, host: str = None) -> int:
+        """Returns the amount of ports with the passed status.
+
+        Args:
+            status: The status to count.
+            host: Only count the ports of this host (every host if None).
+
+        Returns:
+            int: The amount of ports.
+        """
+
+        if host is not None:
+            return self.hosts[host].counts[status]
+
+        return sum(results.counts[status] for results in list(self.hosts.values()))
+
+    def remaining(self) -> int:
+        """Returns the amount of ports left to scan over every host."""
+
+        return sum(results.remaining for results in list(self.hosts.values()))
+
+    @property
+    def total_open(self) -> int:
+        """Returns the amount of open ports over every host."""
+
+        return self.count(PORT_OPEN)
+
+    def __len__(self) -> int:
+        """Returns the amount of scanned ports over every host."""
+
+        return sum(
+            results.end - results.start + 1 - results.counts[PORT_UNSCANNED]
+            for results in list(self.hosts.values())
+        )
+
+    def iter_results(self, host: str = None, status: int = None):
+        """Generates the scanned ports in host then port order, without sorting.
+
+        Args:
+            host: Only generate the ports of this host (every host if None).
+            status: Only generate ports with this status (all scanned ports if None).
+
+        Yields:
+            tuple: The (host, port, status, time, latency) of each scanned port.
+        """
+
+        hosts = [self.hosts[host]] if host is not None else list(self.hosts.values())
+
+        for results in hosts:
+            for port, port_status, when, latency in results.ports(status):
+                yield results.host, port, port_status, when, latency
+
+    def views(self, host: str = None, status: int = None):
+        """Generates Port objects for the scanned ports, only creating them on demand.
+
+        Args:
+            host: Only generate the ports of this host (every host if None).
+            status: Only generate ports with this status (all scanned ports if None).
+
+        Yields:
+            Port: A Port object for each scanned port.
+        """
+
+        for host, port, port_status, when, _ in self.iter_results(host, status):
+            yield Port(host, port,
+                       time=datetime.fromtimestamp(self.epoch + when / 1000),
+                       status=port_status == PORT_OPEN)
+
+    def rows(self):
+        """Generates the CSV rows of the scanned ports, in host then port order.
+
+        Yields:
+            dict: The host, port and status (whether it was open) of each port.
+        """
+
+        for host, port, port_status, _, _ in self.iter_results():
+            yield {
+                "host": host,
+                "port": port,
+                "status": port_status == PORT_OPEN
+            }
@@ -5,122 +5,560 @@
     @package: core/tools/scanner.py
 """
 
+import time  # monotonic, strftime
+import errno  # ECONNREFUSED, EAGAIN, EWOULDBLOCK, ETIMEDOUT
 import socket  # setdefaulttimeout, socket, connect_ex
+import asyncio  # run, sleep, get_running_loop
 
-from queue import Queue
-from threading import Thread
 from datetime import datetime
 
 from core.terminal import *
 from core.tools.util import write_scan_output
+from core.tools.resolver import RESOLVER, Resolver, PinnedResolver
+from core.tools.ratelimit import ProbeScheduler
+from core.tools.targets import parse_targets, parse_ports, compress_ports, order_ports, PORT_ORDERS
+from core.tools.timing import TimingTable, WARMUP_PROBES
+from core.tools.results import *  # Port, ResultStore, PORT_OPEN, PORT_CLOSED, PORT_FILTERED
+from core.tools.writers import open_writer
+from core.tools.journal import ScanJournal
+from core.tools.history import ScanHistory
+from core.tools.metrics import MetricsRegistry
+from core.tools.executor import ScanExecutor, TaskGroup, SHUTDOWN_TIMEOUT
+from core.tools.fingerprint import BannerGrabber
+from core.tools.udp import UdpScanEngine, UDP_RETRIES
+from core.tools.syn import SynScanEngine
+from core.tools.limits import FdBudget, RESOURCE_ERRORS, RESOURCE_RETRIES, is_resource_error, resource_delay
 
-THREADS = 20  # Maximum number of threads to run similtaneously.
+THREADS = 20  # Maximum number of threads to run similtaneously (without a shared executor).
+ASYNC_CONCURRENCY = 500  # Default number of connections the asyncio engine
+# keeps in flight at once (can be raised into the thousands).
+ASYNC_YIELD_EVERY = 64  # Probes an asyncio worker runs before letting the others in.
 SOCKET_TIMEOUT = 0.1  # How long to wait before stopping the connection
-# to one of the hosts ports (in seconds).
+# to one of the hosts ports (in seconds) when adaptive timeouts are disabled.
+RETRIES = 1  # How many times a timed out probe is sent again (adaptive timeouts only).
+TIMEOUT_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ETIMEDOUT, errno.EINPROGRESS)
+ENGINES = ("async", "thread", "udp", "syn")  # Available scanning engines (first is the default).
 
 
-class Port:
-    """Represents a network port to be scanned.
+def settle(future: asyncio.Future, result: bool):
+    """
+    Sets the result of a future unless it is already done (the first of its callbacks wins).
+    """
+
+    if not future.done():
+        future.set_result(result)
+
+
+class Scanner:
+    """Scans a host for open ports using either asyncio or a pool of threads (ScanExecutor),
+       or for open UDP ports using the udp engine (UdpScanEngine). Root runs can use
+       the syn engine (SynScanEngine), half-open scanning from raw sockets.
+
+    TABLE_COLUMNS are the headers of the live scan table (see format_row).
 
     Attributes:
-        host: The parent host the port belongs to.
-        port: The target port to be scanned on the host.
-        time: The time (datetime) the port was scanned.
-        status: Whether the port was open or not.
+        results: Compact storage for the scanned ports (ResultStore).
+        host: The host to scan the ports of.
+        hosts: Every host to scan (only self.host for a single host scan).
+        targets: The requested target expression (identifies the scan in the journal).
+        output_file: Where to write the sorted scanned ports once finished (if not blank).
+        stream_file: Where to stream the scanned ports to while scanning (if not blank).
+        stream_format: The format of the stream file (csv, ndjson or binary, guessed if blank).
+        writer: The StreamWriter of the running scan (None when not streaming).
+        journal_file: Where to keep the checkpoint journal (if not blank).
+        resume: Whether to resume the scan recorded in the journal file.
+        journal: The ScanJournal of the running scan (None when not journaling).
+        history_file: The SQLite scan history to record the scan in (if not blank).
+        history: The ScanHistory of the running scan (None when not recording).
+        history_scan: The id of the scan in the history (once started).
+        metrics: MetricsRegistry updated from the probe path (see instrument).
+        renderer: Renderer drawing the live scan table (only the summary when quiet).
+        engine: Which scanning engine to use ("async", "thread", "udp" or "syn").
+        order: The order the ports are probed in (see order_ports).
+        seed: Seed of the random port order (random if None).
+        concurrency: Maximum number of connections the asyncio engine keeps in flight.
+        resolver: The Resolver used to look up the hosts address (shared by default).
+        pinned: The addresses the targets resolved to, kept for the whole scan (PinnedResolver).
+        scheduler: ProbeScheduler pacing the probes under the global and per host rates.
+        timing: TimingTable adapting the connect timeout of each host to its RTT.
+        retries: How many times a timed out probe is sent again.
+        executor: The ScanExecutor running the thread engines probes (shared by the
+                  session, or started and shut down by each scan if None).
+        fingerprinter: BannerGrabber identifying the services of open ports (None to skip,
+                       unused by the syn engine as it never completes a connection).
+        services: The (service, banner) of each fingerprinted (host, port).
+        budget: FdBudget fitting the asyncio engines concurrency to the fd limit and local ports.
+        warmups: The warm-up state of each host the asyncio engine hasn't measured yet (see warm_up).
     """
 
+    TABLE_COLUMNS = ("Time Scanned", "Port", "Status", "Total Open")
+
     def __init__(
         self,
         host: str,
-        port: int,
-        time: datetime = datetime.now(),
-        status: bool = False
+        output_file: str,
+        engine: str = ENGINES[0],
+        concurrency: int = ASYNC_CONCURRENCY,
+        resolver: Resolver = RESOLVER,
+        rate: float = 0,
+        host_rate: float = 0,
+        congestion: bool = True,
+        adaptive: bool = True,
+        stream_file: str = "",
+        stream_format: str = "",
+        journal_file: str = "",
+        resume: bool = False,
+        metrics: MetricsRegistry = None,
+        quiet: bool = False,
+        order: str = PORT_ORDERS[0],
+        seed: int = None,
+        executor: ScanExecutor = None,
+        fingerprint: bool = False,
+        history_file: str = ""
     ):
+        """Initializes a Scanner object."""
+
+        # Validate the requested scanning engine.
+        if engine not in ENGINES:
+            raise ValueError(f"unknown scan engine '{engine}'")
+
+        # Validate the requested port order.
+        if order not in PORT_ORDERS:
+            raise ValueError(f"unknown port order '{order}'")
+
+        self.results = ResultStore()
+        self.formatted_ports = [{}]
+
         self.host = host
-        self.port = port
-        self._time = time
-        self.status = status
+        self.hosts = [host]
+        self.targets = host
+        self.output_file = output_file
+        self.stream_file = stream_file
+        self.stream_format = stream_format
+        self.writer = None
+        self.journal_file = journal_file
+        self.resume = resume
+        self.journal = None
+        self.history_file = history_file
+        self.history = None
+        self.history_scan = None
 
-    @property
-    def time(self, format: str = "%H:%M:%S") -> str:
-        """Returns the formatted version of the ports scanned time.
+        self.engine = engine
+        self.order = order
+        self.seed = seed
+        self.concurrency = max(1, int(concurrency))
+        self.resolver = resolver
+        self.pinned = PinnedResolver(resolver)
+        self.scheduler = ProbeScheduler(rate, host_rate, adaptive=congestion)
 
-        Args:
-            format: Formatting string to pass to datetime.strftime.
+        # Without adaptive timeouts every host keeps SOCKET_TIMEOUT and isn't retried.
+        if adaptive:
+            self.timing = TimingTable()
+            self.retries = RETRIES
+        else:
+            self.timing = TimingTable(SOCKET_TIMEOUT, SOCKET_TIMEOUT, SOCKET_TIMEOUT)
+            self.retries = 0
 
-        Returns:
-            str: The formatted datetime based on the specified format.
-        """
+        self.executor = executor
+        self.budget = FdBudget()
 
-        return self._time.strftime(format)
+        # Open ports are fingerprinted over the connection that proved them open.
+        self.fingerprinter = BannerGrabber() if fingerprint else None
+        self.services = {}
+        self.grab_slots = None
+        self.grabs = set()
+        self.warmups = {}
 
-    @time.setter
-    def time(self, new_time: datetime) -> str:
-        """Sets a new scanned time for the port.
+        self.metrics = metrics or MetricsRegistry()
+        self.instrument()
 
-        Args:
-            new_time: New datetime instance to replace the old one with.
-        """
+        # The live scan table is redrawn in the background, so probes never wait on the terminal.
+        self.renderer = Renderer(self.TABLE_COLUMNS, self.format_row, quiet=quiet)
 
-        # Verify that the new time is a valid datetime object.
-        if isinstance(new_time, datetime):
-            self._time = new_time
+    def instrument(self):
+        """
+        Registers the scanners metrics, keeping the ones updated on every probe
+        as attributes so that the probe path doesn't have to look them up.
+        """
 
+        self.probe_counters = {
+            status: self.metrics.counter(
+                "scanner_probes_total", "Ports probed, by their status",
+                labels={"status": STATUS_NAMES[status]})
+            for status in (PORT_OPEN, PORT_CLOSED, PORT_FILTERED)
+        }
+        self.timeout_counter = self.metrics.counter(
+            "scanner_timeouts_total", "Connection attempts that timed out")
+        self.retry_counter = self.metrics.counter(
+            "scanner_retries_total", "Connection attempts sent again after a timeout")
+        self.resource_counter = self.metrics.counter(
+            "scanner_resource_errors_total", "Probes delayed by running out of file descriptors or local ports")
+        self.skipped_counter = self.metrics.counter(
+            "scanner_skipped_probes_total", "Probes left unscanned after running out of resources")
+        self.latency_histogram = self.metrics.histogram(
+            "scanner_probe_latency_seconds", "Time taken to get each ports status")
+        self.busy_counter = self.metrics.counter(
+            "scanner_worker_busy_seconds_total", "Time workers spent probing")
+        self.idle_counter = self.metrics.counter(
+            "scanner_worker_idle_seconds_total", "Time workers spent waiting for work or the rate limit")
+        self.inflight_gauge = self.metrics.gauge(
+            "scanner_inflight_probes", "Probes currently in flight")
+        self.workers_gauge = self.metrics.gauge(
+            "scanner_workers", "Workers of the running scan")
+        self.grab_histogram = self.metrics.histogram(
+            "scanner_fingerprint_seconds", "Time taken to identify each open ports service")
 
-class Scanner:
-    """Scans a host for open ports using multiple threads and queues.
+        # Gauges read when a snapshot is taken, costing nothing on the probe path.
+        self.metrics.gauge("scanner_pending_probes", "Probes left to send",
+                           func=self.results.remaining)
+        self.metrics.gauge("scanner_queue_depth", "Probes waiting in the thread engines queue",
+                           func=lambda: self.executor.qsize() if self.executor else 0)
+        self.metrics.gauge("scanner_open_ports", "Open ports found so far",
+                           func=lambda: self.total_open)
 
-    Attributes:
-        ports: Storage for the scanned ports (Port objects).
-        total_open: A counter to store the amount of open ports.
-        host: The host to scan the ports of.
-        output_file: Where to write the scanned ports (if not blank).
-        queue: The queue to manage the latest ports for threads to use.
-    """
+    @property
+    def ports(self) -> list:
+        """Returns Port objects for every scanned port (created on demand).
 
-    def __init__(self, host: str, output_file: str):
-        """Initializes a Scanner object."""
+        Returns:
+            list: The scanned ports in host then port order.
+        """
 
-        self.ports = []
-        self.formatted_ports = [{}]
-        self.total_open = 0
+        return list(self.results.views())
 
-        self.host = host
-        self.output_file = output_file
+    @property
+    def total_open(self) -> int:
+        """Returns the amount of open ports found so far."""
 
-        self.queue = Queue()
+        return self.results.total_open
 
     @staticmethod
-    def get_sock_connection() -> socket.socket:
+    def get_sock_connection(family: int = socket.AF_INET) -> socket.socket:
         """Creates, configures and returns a socket connection used for scanning.
 
+        Args:
+            family: The address family of the host (AF_INET or AF_INET6).
+
         Returns:
             socket.socket: The socket to use when scanning a host.
         """
 
-        return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        return socket.socket(family, socket.SOCK_STREAM)
 
     def format_ports(self) -> list:
-        """Formats the list of ports into a list of dictionaries.
+        """Formats the scanned ports into a list of dictionaries.
            This is only used for passing the list of ports to the CSV writer.
 
         Returns:
             list: A list of dictionaries containing the formatted port data.
         """
 
-        return [
-            {
-                # Removes the port._time/time attribute.
-                "host": port.host,
-                "port": port.port,
-                "status": port.status
-            }
-            for port in self.ports
-        ]
+        # The result store is already in host then port order.
+        return list(self.results.rows())
 
-    def scan_port(self, port: Port) -> Port:
+    def probe_port(self, host: str, port: int) -> tuple:
         """Uses a socket connection to test if the passed hosts port is open
-           by attempting to connect to it with a set timeout to stop invalid connections.
+           by attempting to connect to it with a timeout based on the hosts RTT.
+
+        Args:
+            host: The host to scan.
+            port: The port to scan on the host.
+
+        Returns:
+            tuple: The (status, latency) of the port (see core/tools/results.py).
+        """
+
+        status, elapsed, sock = self.connect_port(host, port)
+
+        if sock:
+            sock.close()  # Close the opened socket.
+
+        return status, elapsed
+
+    def connect_port(self, host: str, port: int) -> tuple:
+        """Probes the passed hosts port (see probe_port), keeping the connection of an open port.
+
+        Probes that run out of file descriptors or local ports are retried after
+        a backoff, instead of being mistaken for closed ports.
+
+        Args:
+            host: The host to scan.
+            port: The port to scan on the host.
+
+        Returns:
+            tuple: The (status, latency) of the port (PORT_UNSCANNED if it kept running
+                   out of resources), and the connected socket of an open port (None
+                   otherwise, the caller must close it).
+        """
+
+        for attempt in range(RESOURCE_RETRIES + 1):
+            status, elapsed, sock = self.try_connect(host, port)
+
+            if status != PORT_UNSCANNED:
+                return status, elapsed, sock
+
+            # Wait for other probes to release their sockets before trying again.
+            self.resource_counter.inc()
+            time.sleep(resource_delay(attempt))
+
+        return PORT_UNSCANNED, 0.0, None
+
+    def try_connect(self, host: str, port: int) -> tuple:
+        """Probes the passed hosts port once it has the resources to (see connect_port).
+
+        Returns:
+            tuple: The (status, latency) of the port (PORT_UNSCANNED if the scanning machine
+                   ran out of resources), and the connected socket of an open port.
+        """
+
+        # Get the timing estimate of the host, used to choose the timeout.
+        estimator = self.timing.get(host)
+
+        status, elapsed = PORT_CLOSED, 0.0
+        sock = None
+
+        try:
+            # Look up the hosts address (pinned when the scan started).
+            family, address = self.pinned.resolve(host)
+
+            for attempt in range(self.retries + 1):
+                # Create and configure the socket connection with a timeout to stop
+                # any ports that it failed to connect to in time, based on the hosts RTT.
+                sock = self.get_sock_connection(family)
+                sock.settimeout(estimator.backoff(attempt))
+
+                # Attempt to connect to the host through the passed port.
+                started = time.monotonic()
+                conn_result = sock.connect_ex((address, port))
+                elapsed = time.monotonic() - started
+
+                # socket.connect_ex success code is 0.
+                if conn_result == 0:
+                    # The port is open, hand over its connection.
+                    estimator.observe(elapsed)
+                    sock, connected = None, sock
+                    return PORT_OPEN, elapsed, connected
+
+                sock.close()
+                sock = None
+
+                # A refused connection is still a reply from the host.
+                if conn_result == errno.ECONNREFUSED:
+                    status = PORT_CLOSED
+                    estimator.observe(elapsed)
+                    break
+
+                # Running out of local ports says nothing about the port.
+                if conn_result in RESOURCE_ERRORS:
+                    status = PORT_UNSCANNED
+                    break
+
+                # Any other error (e.g., unreachable) won't change when retried.
+                if conn_result not in TIMEOUT_ERRORS:
+                    status = PORT_CLOSED
+                    break
+
+                # Retry timed out probes with a longer timeout.
+                status = PORT_FILTERED
+                self.count_timeout(estimator, retrying=attempt < self.retries)
+
+        except OSError as error:
+            # Running out of file descriptors says nothing about the port, any other
+            # socket error (e.g., an unknown host) is assumed to mean that it is closed.
+            status = PORT_UNSCANNED if is_resource_error(error) else PORT_CLOSED
+        finally:
+            if sock:
+                sock.close()  # Close the opened socket.
+
+        return status, elapsed, None
+
+    async def probe_port_async(self, host: str, port: int) -> tuple:
+        """Asyncio version of probe_port, using a non-blocking socket so that
+           thousands of connection attempts can be in flight at once.
+
+        Args:
+            host: The host to scan.
+            port: The port to scan on the host.
+
+        Returns:
+            tuple: The (status, latency) of the port (see core/tools/results.py).
+        """
+
+        status, elapsed, sock = await self.connect_port_async(host, port)
+
+        if sock:
+            sock.close()  # Close the opened socket.
+
+        return status, elapsed
+
+    async def connect_port_async(self, host: str, port: int) -> tuple:
+        """Asyncio version of connect_port, keeping the connection of an open port.
+
+        Args:
+            host: The host to scan.
+            port: The port to scan on the host.
+
+        Returns:
+            tuple: The (status, latency) of the port (PORT_UNSCANNED if it kept running
+                   out of resources), and the connected socket of an open port (None
+                   otherwise, the caller must close it).
+        """
+
+        for attempt in range(RESOURCE_RETRIES + 1):
+            status, elapsed, sock = await self.try_connect_async(host, port)
+
+            if status != PORT_UNSCANNED:
+                return status, elapsed, sock
+
+            # Wait for other probes to release their sockets before trying again.
+            self.resource_counter.inc()
+            await asyncio.sleep(resource_delay(attempt))
+
+        return PORT_UNSCANNED, 0.0, None
+
+    async def try_connect_async(self, host: str, port: int) -> tuple:
+        """Asyncio version of try_connect.
+
+        Returns:
+            tuple: The (status, latency) of the port (PORT_UNSCANNED if the scanning machine
+                   ran out of resources), and the connected socket of an open port.
+        """
+
+        # Get the timing estimate of the host, used to choose the timeout.
+        estimator = self.timing.get(host)
+        loop = asyncio.get_running_loop()
+
+        status, elapsed = PORT_CLOSED, 0.0
+
+        # Use the address pinned when the scan started, looking up any other
+        # host off the event loop so that a slow lookup can't stall every probe.
+        if not (resolved := self.pinned.get(host)):
+            try:
+                resolved = await loop.run_in_executor(None, self.resolver.resolve, host)
+            except socket.gaierror:
+                # The host can't be resolved, so assume that the port is closed.
+                return status, elapsed, None
+
+        family, address = resolved
+
+        for attempt in range(self.retries + 1):
+            sock = None
+
+            try:
+                # Create a non-blocking socket so the event loop can wait on it.
+                sock = self.get_sock_connection(family)
+                sock.setblocking(False)
+
+                # Attempt to connect to the host through the passed port,
+                # giving up after the hosts current timeout.
+                started = time.monotonic()
+                conn_result = await self.connect_async(loop, sock, (address, port), estimator.backoff(attempt))
+                elapsed = time.monotonic() - started
+
+                if conn_result == 0:
+                    # The connection completed, so the port is open, hand over its connection.
+                    estimator.observe(elapsed)
+                    sock, connected = None, sock
+                    return PORT_OPEN, elapsed, connected
+
+                # A refused connection is still a reply from the host.
+                if conn_result == errno.ECONNREFUSED:
+                    status = PORT_CLOSED
+                    estimator.observe(elapsed)
+                    break
+
+                # Running out of local ports says nothing about the port.
+                if conn_result in RESOURCE_ERRORS:
+                    status = PORT_UNSCANNED
+                    break
+
+                # Any other error (e.g., unreachable) won't change when retried.
+                if conn_result not in TIMEOUT_ERRORS:
+                    status = PORT_CLOSED
+                    break
+
+                # Retry timed out probes with a longer timeout.
+                status = PORT_FILTERED
+                self.count_timeout(estimator, retrying=attempt < self.retries)
+
+            except OSError as error:
+                # Running out of file descriptors says nothing about the port, any other
+                # socket error is assumed to mean that it is closed.
+                status = PORT_UNSCANNED if is_resource_error(error) else PORT_CLOSED
+                break
+
+            finally:
+                if sock:
+                    sock.close()  # Close the opened socket.
+
+        return status, elapsed, None
+
+    @staticmethod
+    async def connect_async(loop, sock: socket.socket, address: tuple, timeout: float) -> int:
+        """Connects a non-blocking socket, waiting for it to become writable.
+
+        A bare future woken by the socket or a timer is far cheaper than wrapping
+        loop.sock_connect in the task that asyncio.wait_for creates, which matters
+        on fast networks where the event loop, not the network, is the bottleneck.
+
+        Args:
+            loop: The running event loop.
+            sock: The non-blocking socket to connect.
+            address: The (address, port) to connect to.
+            timeout: How long to wait for the connection (in seconds).
+
+        Returns:
+            int: The connect_ex style result (0 if connected, errno.ETIMEDOUT if timed out).
+        """
+
+        conn_result = sock.connect_ex(address)
+
+        if conn_result != errno.EINPROGRESS:
+            return conn_result
+
+        # Nearby hosts (e.g., loopback) often answer within connect itself, in which
+        # case the result is already known and the event loop can be skipped.
+        if conn_result := sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            return conn_result
+
+        try:
+            sock.getpeername()
+            return 0
+        except OSError:
+            pass
+
+        # Wake up with True once the socket is writable (connected or refused), False on timeout.
+        fd = sock.fileno()
+        connected = loop.create_future()
+
+        loop.add_writer(fd, settle, connected, True)
+        timer = loop.call_later(timeout, settle, connected, False)
+
+        try:
+            if not await connected:
+                return errno.ETIMEDOUT
+        finally:
+            loop.remove_writer(fd)
+            timer.cancel()
+
+        return sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+    def count_timeout(self, estimator, retrying: bool):
+        """Counts a timed out connection attempt in the hosts timing and the metrics.
+
+        Args:
+            estimator: The RttEstimator of the probed host.
+            retrying: Whether the probe is going to be sent again.
+        """
+
+        estimator.observe_timeout(retrying)
+        self.timeout_counter.inc()
+
+        if retrying:
+            self.retry_counter.inc()
+
+    def scan_port(self, port: Port) -> Port:
+        """Scans a single Port object outside of a range scan.
 
         Args:
             Port: The Port object to scan, modify and return.
@@ -132,57 +570,449 @@ class Scanner:
         # Set the time that the port was scanned to the current time.
         port.time = datetime.now()
 
-        # Create and configure the socket connection with a timeout to stop
-        # any ports that it failed to connect to in SOCKET_TIMEOUT seconds (default=0.5).
-        sock = self.get_sock_connection()
-        sock.settimeout(SOCKET_TIMEOUT)
+        status, _ = self.probe_port(port.host, port.port)
+        port.status = status == PORT_OPEN
+
+        return port
+
+    def record_port(
+        self,
+        host: str,
+        port: int,
+        status: int,
+        latency: float,
+        service: tuple = None
+    ) -> bool:
+        """Stores and displays a scanned port, shared by both scanning engines.
+
+        Args:
+            host: The host of the scanned port.
+            port: The scanned port.
+            status: The ports status (PORT_OPEN, PORT_CLOSED or PORT_FILTERED).
+            latency: How long the port took to answer (in seconds).
+            service: The (service, banner) of a fingerprinted open port.
+
+        Returns:
+            bool: Whether this port finished the scan of its host.
+        """
+
+        when = time.time()
+
+        # Keep the service before the port is stored, so it is known once the host finishes.
+        if service:
+            self.services[(host, port)] = service
+
+        # Store the port in the result store (thread-safe).
+        finished = self.results.record(host, port, status, latency, when)
+
+        # Stream the port out to the stream file (flushed in batches).
+        if self.writer:
+            self.writer.write(host, port, status, when, latency, *(service or ()))
+
+        # Update the probe metrics.
+        self.probe_counters[status].inc()
+        self.latency_histogram.record(latency)
+
+        # Let congestion control know whether the probe was answered.
+        self.scheduler.observe(host, status == PORT_FILTERED)
+
+        # Keep the port in the scan history (inserted in batches).
+        if self.history:
+            self.history.write(self.history_scan, host, port, status, when, latency, *(service or ()))
+
+        # Checkpoint the port so that it isn't scanned again when resuming.
+        if self.journal:
+            self.journal.record(host, port, status)
+
+        if finished:
+            self.finish_host(host)
+
+        # Hand the port to the live scan table (drawn by the renderer's next frame).
+        self.renderer.update("scan", when, host, port, status)
+
+        return finished
+
+    def format_row(self, when: float, host: str, port: int, status: int) -> tuple:
+        """Formats the latest scanned port as a row of the live scan table.
+
+        Args:
+            when: When the port was scanned (time.time).
+            host: The host of the scanned port.
+            port: The scanned port.
+            status: The ports status.
+
+        Returns:
+            tuple: The values of the row (see TABLE_COLUMNS).
+        """
+
+        return time.strftime('%H:%M:%S', time.localtime(when)), port, status == PORT_OPEN, self.total_open
+
+    def finish_host(self, host: str):
+        """Called once every port of a host has been scanned (used by MultiScanner).
+
+        Args:
+            host: The host that finished scanning.
+        """
+
+    def worker(self, host: str, port: int):
+        """
+        Task run by the executors threads to scan a single (host, port) probe
+        of the thread engine.
+        """
+
+        waiting = time.monotonic()
+
+        # Wait for the global and hosts rate limits before probing.
+        self.scheduler.acquire(host)
+
+        started = time.monotonic()
+        self.idle_counter.inc(started - waiting)
+        self.inflight_gauge.inc()
 
         try:
-            # Attempt to connect to the host through the Port object's port.
-            conn_result = sock.connect_ex((port.host, port.port))
-
-            # socket.connect_ex success code is 0.
-            if conn_result == 0:
-                # The port is open, and the Port object's status can be set to True.
-                port.status = True
-
-        except socket.error:
-            # Handle socket errors (e.g., connection refused).
-            # Assume that the port is closed.
-            port.status = False
+            status, latency, sock = self.connect_port(host, port)
+            service = None
+
+            # Leave the port unscanned (for a resumed scan) if resources never freed up.
+            if status == PORT_UNSCANNED:
+                self.skipped_counter.inc()
+                return
+
+            # Identify the service of an open port over the same connection.
+            if sock:
+                with sock:
+                    service = self.fingerprint(sock, host, port)
+
+            # Store and display the port.
+            self.record_port(host, port, status, latency, service)
         finally:
-            sock.close()  # Close the opened socket.
+            self.inflight_gauge.dec()
+            self.busy_counter.inc(time.monotonic() - started)
+
+    async def async_worker(self, probes):
+        """
+        Coroutine executed by each asyncio worker to continually scan the next
+        port from the shared iterator, exits when there are no more ports to scan.
+        """
+
+        # The iterator is shared between all workers, and as the event loop is
+        # single threaded each port is only ever handed to one of them.
+        for count, (host, port) in enumerate(probes, 1):
+            # Wait for the global and hosts rate limits before probing.
+            if delay := self.scheduler.reserve(host):
+                await asyncio.sleep(delay)
+                self.idle_counter.inc(delay)
+
+            # Probes of nearby hosts complete without waiting on the event loop, so
+            # yield now and then to let the other workers (and Ctrl+C) in.
+            elif not count % ASYNC_YIELD_EVERY:
+                await asyncio.sleep(0)
+
+            # Hold back the probes of a host until it has been measured.
+            warming = await self.warm_up(host)
+
+            started = time.monotonic()
+            self.inflight_gauge.inc()
+
+            status, latency, sock = await self.connect_port_async(host, port)
+
+            if warming:
+                self.warmed_up(host)
+
+            if status == PORT_UNSCANNED:
+                # Leave the port unscanned (for a resumed scan) if resources never freed up.
+                self.skipped_counter.inc()
+            elif sock and self.fingerprinter:
+                # Identify the service of the open port in the background, waiting
+                # for a free slot first so that open connections stay bounded.
+                await self.grab_slots.acquire()
+
+                task = asyncio.create_task(
+                    self.fingerprint_async(sock, host, port, status, latency))
+                self.grabs.add(task)
+                task.add_done_callback(self.grabs.discard)
+            else:
+                if sock:
+                    sock.close()  # Close the opened socket.
+
+                # Store and display each port as soon as it completes.
+                self.record_port(host, port, status, latency)
+
+            self.inflight_gauge.dec()
+            self.busy_counter.inc(time.monotonic() - started)
+
+    async def warm_up(self, host: str) -> bool:
+        """Holds back the probes of a host until its RTT has been measured, so that the
+           whole window doesn't go out to it with TIMEOUT_INITIAL (far too long on a LAN).
+
+        The first WARMUP_PROBES probes of the host are sent straight away, and the
+        others wait for one of them to be answered, or for all of them to time out
+        (as the host may well be filtered). Hosts already measured (e.g., seeded from
+        their ping RTT by seed_timing) are never held back.
+
+        Args:
+            host: The host about to be probed.
+
+        Returns:
+            bool: Whether the probe is one of the hosts warm-up probes (see warmed_up).
+        """
+
+        if self.timing.get(host).samples:
+            return False
+
+        # The (warm-up probes sent, warm-up probes finished, measured event) of the host.
+        warmup = self.warmups.setdefault(host, [0, 0, asyncio.Event()])
+
+        if warmup[2].is_set():
+            return False
+
+        if warmup[0] < WARMUP_PROBES:
+            warmup[0] += 1
+            return True
+
+        await warmup[2].wait()
+        return False
+
+    def warmed_up(self, host: str):
+        """
+        Counts a finished warm-up probe of a host (see warm_up), letting its other
+        probes go once it has been measured or every warm-up probe has finished.
+        """
+
+        warmup = self.warmups[host]
+        warmup[1] += 1
+
+        if self.timing.get(host).samples or warmup[1] >= WARMUP_PROBES:
+            warmup[2].set()
+
+    def fingerprint(self, sock: socket.socket, host: str, port: int) -> tuple:
+        """Identifies the service of an open port over its connection (thread engine).
+
+        Returns:
+            tuple: The (service, banner) of the port (None when not fingerprinting).
+        """
+
+        if not self.fingerprinter:
+            return None
+
+        started = time.monotonic()
+        service = self.fingerprinter.grab(sock, host, port)
+        self.grab_histogram.record(time.monotonic() - started)
+
+        return service
 
-            # Return the modified or unmodified Port object.
-            return port
+    async def fingerprint_async(
+        self,
+        sock: socket.socket,
+        host: str,
+        port: int,
+        status: int,
+        latency: float
+    ):
+        """
+        Task identifying the service of an open port over its connection (asyncio engine),
+        recording the port once done. Releases the grab slot taken by the worker.
+        """
+
+        try:
+            started = time.monotonic()
+            service = await self.fingerprinter.grab_async(sock, host, port)
+            self.grab_histogram.record(time.monotonic() - started)
+        finally:
+            sock.close()
+            self.grab_slots.release()
+
+        self.record_port(host, port, status, latency, service)
+
+    async def scan_with_udp(self, ports: list):
+        """Scans the UDP ports with up to self.concurrency probes waiting for a reply.
+
+        Filtered UDP ports are open|filtered, as a port that never replied may
+        still be open (see UdpScanEngine).
 
-    def worker(self):
+        Args:
+            ports (list): The ports to scan, in the order to probe them.
         """
-        Worker function executed by each thread to continually scan the latest
-        ports from the queue, automatically exits when there are no more ports to scan.
+
+        engine = UdpScanEngine(
+            self.pinned, self.timing, self.scheduler,
+            on_result=self.record_datagram, on_timeout=self.count_timeout,
+            retries=UDP_RETRIES if self.retries else 0, window=self.concurrency)
+
+        self.workers_gauge.set(1)
+        self.inflight_gauge.func = lambda: len(engine.outstanding)
+
+        try:
+            await engine.run(self.probes(ports))
+        finally:
+            self.inflight_gauge.func = None
+
+    def record_datagram(self, host: str, port: int, status: int, latency: float, service: tuple):
+        """
+        Records a UDP port, keeping the service named by its reply when fingerprinting.
         """
 
-        # Continually scan and append the latest port in the queue.
-        while True:
-            # Retrieve the latest available port in the queue.
-            latest_port = self.queue.get()
+        self.record_port(host, port, status, latency, service if self.fingerprinter else None)
+
+    def scan_with_syn(self, ports: list):
+        """Scans the ports with up to self.concurrency SYN probes waiting for a reply
+           (requires root, see SynScanEngine).
 
-            # Append the scanned port to the self.ports array.
-            self.ports.append(
-                result := self.scan_port(latest_port)
-            )
+        Args:
+            ports (list): The ports to scan, in the order to probe them.
+        """
 
-            if result.status:
-                # If the previously scanned port was open,
-                # increment the self.total_open counter.
-                self.total_open += 1
+        engine = SynScanEngine(
+            self.pinned, self.timing, self.scheduler,
+            on_result=self.record_port, on_timeout=self.count_timeout,
+            retries=self.retries, window=self.concurrency)
 
-            # Display the port in a table format.
-            print(
-                f"{result.time}\t{result.port}\t{result.status}\t{self.total_open}", end='\r')
+        # The calling thread sends the probes while a receive thread reads the replies.
+        self.workers_gauge.set(2)
+        self.inflight_gauge.func = lambda: len(engine.table)
 
-            # Tell the queue that this task has completed.
-            self.queue.task_done()
+        try:
+            engine.run(self.probes(ports))
+        finally:
+            self.inflight_gauge.func = None
+
+    async def scan_with_asyncio(self, ports: list):
+        """Scans the ports with up to self.concurrency connections in flight.
+
+        Args:
+            ports (list): The ports to scan, in the order to probe them.
+        """
+
+        # Lazily generate the probes so that only in-flight ones exist.
+        probes = self.probes(ports)
+
+        # Never start more workers than there are ports left to scan.
+        workers = min(self.concurrency, self.results.remaining())
+        self.workers_gauge.set(workers)
+
+        # Bound the open ports being fingerprinted at once.
+        self.grab_slots = asyncio.Semaphore(
+            self.fingerprinter.concurrency if self.fingerprinter else 1)
+
+        # Measure each host with a few probes before the rest of the window goes out to it.
+        self.warmups = {}
+
+        # Run all of the workers until the shared iterator is exhausted.
+        await asyncio.gather(
+            *(self.async_worker(probes) for _ in range(workers))
+        )
+
+        # Wait for the open ports still being fingerprinted.
+        await asyncio.gather(*list(self.grabs))
+
+    def probes(self, ports: list):
+        """Generates the (host, port) probes to scan, interleaving the hosts so that
+           every host is probed at the same pace and a slow host can't stall the others.
+
+        Args:
+            ports (list): The ports to scan, in the order to probe them.
+
+        Yields:
+            tuple: The next (host, port) to be scanned.
+        """
+
+        # Iterate through the passed ports.
+        for i in ports:
+            # Probe the current port of each host, skipping the ports that
+            # were already completed by a resumed scan.
+            for host in self.hosts:
+                if self.results.get(host, i) == PORT_UNSCANNED:
+                    yield host, i
+
+    def resolve_targets(self):
+        """
+        Resolves the host before scanning, so that an unknown host fails straight
+        away, pinning its address so that every probe of the scan uses it.
+        """
+
+        self.pinned.pin(self.host)
+
+    def seed_timing(self, rtts: dict):
+        """Uses round trip times measured before the scan (e.g., by ping_sweep)
+           as the first samples of each hosts timing estimate.
+
+        Args:
+            rtts: The round trip time of each host (None for hosts that didn't reply).
+        """
+
+        for host, rtt in rtts.items():
+            if rtt is not None:
+                self.timing.get(host).observe(rtt)
+
+    def scan_with_threads(self, ports: list):
+        """Scans the ports on the executors thread pool, starting a private
+           pool of THREADS threads for this scan if the Scanner has no executor.
+
+        Args:
+            ports (list): The ports to scan, in the order to probe them.
+        """
+
+        executor = self.executor or ScanExecutor(THREADS)
+        group = TaskGroup()
+
+        self.workers_gauge.set(executor.threads)
+
+        try:
+            # Submit every probe to the executor (blocking while its queue is full),
+            # tracking them in this scans own group.
+            for host, port in self.probes(ports):
+                executor.submit(self.worker, host, port, group=group)
+
+            # Wait for every probe of this scan to complete.
+            group.wait()
+        finally:
+            # Skip the probes that haven't started if the scan was interrupted, and let
+            # the running ones finish before the stream file and journal are closed.
+            group.cancel()
+            group.wait(SHUTDOWN_TIMEOUT)
+
+            # Only shut down the private pool, a shared one outlives the scan.
+            if executor is not self.executor:
+                executor.shutdown()
+
+        # Raise the first error of the probes, like an unhandled one would have.
+        if group.errors:
+            raise group.errors[0]
+
+    def run_engine(self, ports: list):
+        """Scans the ports using the configured engine.
+
+        Args:
+            ports (list): The ports to scan, in the order to probe them.
+        """
+
+        if self.engine == "thread":
+            self.scan_with_threads(ports)
+        elif self.engine == "udp":
+            asyncio.run(self.scan_with_udp(ports))
+        elif self.engine == "syn":
+            self.scan_with_syn(ports)
+        else:
+            asyncio.run(self.scan_with_asyncio(ports))
+
+    def size_concurrency(self):
+        """
+        Lowers the asyncio engines concurrency to what the file descriptor limit and the
+        local port range allow (raising the soft file descriptor limit first if it can).
+        """
+
+        # Only the asyncio engine holds a socket per probe in flight (with one more per
+        # open port being fingerprinted), the other engines use a handful of sockets.
+        if self.engine != "async":
+            return
+
+        grabs = self.fingerprinter.concurrency if self.fingerprinter else 0
+        fitted = max(1, self.budget.fit(self.concurrency + grabs) - grabs)
+
+        if fitted < self.concurrency:
+            std_warning(f"Lowered the concurrency from {self.concurrency} to {fitted} "
+                        f"(fd limit {self.budget.limit}, {self.budget.ports} local ports)", end=".")
+            self.concurrency = fitted
 
     def scan_in_range(self, start: int, end: int):
         """Scans the predefined host between the passed range of ports (start-end).
@@ -192,37 +1022,198 @@ class Scanner:
             end (int): The port to stop the port scanning.
         """
 
-        # Display the table headers for the ports to be scanned.
-        std_info("Live Scan Table", start="\n", end=":")
-        print("Time Scanned\tPort\tStatus\tTotal Open")
+        self.scan_ports(range(start, end + 1))
 
-        # Create and start THREADS amount of threads for self.worker.
-        for i in range(THREADS):
-            thread = Thread(target=self.worker)
-            thread.daemon = True
-            thread.start()
+    def scan_ports(self, ports):
+        """Scans the predefined host over the passed ports, probing them in self.order.
 
-        # Iterate through the passed range of ports.
-        for i in range(start, end + 1):
-            # Create a Port object containing the current ports attributes
-            port = Port(self.host, i)
+        Args:
+            ports: The ports to scan (a list, a range or a port expression, see parse_ports).
 
-            # Add the created port to the queue for it to be scanned.
-            self.queue.put(port)
+        Raises:
+            ValueError: There are no ports to scan.
+        """
 
-        # Wait for all tasks in the queue to complete.
-        self.queue.join()
+        # Parse port expressions (ex. 1-1024,3306,!25).
+        if isinstance(ports, str):
+            ports = parse_ports(ports)
 
-        # Sort the scanned ports in the order of their ids.
-        # This is required as using threading doesn't scan them in their original order.
-        self.formatted_ports = sorted(
-            self.format_ports(),
-            # Sort the ports by their port number.
-            key=lambda port: port.get('port')
-        )
+        ports = sorted(set(ports))
+
+        # Validate that something is left to scan.
+        if not ports:
+            raise ValueError("port list contains no ports")
+
+        start, end = ports[0], ports[-1]
 
-        # Write the sorted scanned ports list to the output file.
+        # Resolve the targets once before scanning.
+        self.resolve_targets()
+
+        # Allocate the compact results of every host, covering the ports
+        # between the first and last one (the excluded ones are skipped).
+        for host in self.hosts:
+            self.results.add_host(host, start, end, skipped=end - start + 1 - len(ports))
+
+        # Fit the concurrency to the file descriptors and local ports available.
+        self.size_concurrency()
+
+        # Display the title of the live scan table (the renderer draws the table itself).
+        if not self.renderer.quiet:
+            std_info("Live Scan Table", start="\n", end=":")
+
+        # Open the journal, replaying the ports completed by earlier runs when resuming.
+        if self.journal_file:
+            self.journal = ScanJournal(self.journal_file)
+
+            # The scan is described by what was requested rather than by self.hosts, as
+            # the hosts left after resolving (and dropping the ones down) can differ between
+            # runs. Contiguous scans are described by their range, others by their port expression.
+            scan = {"targets": self.targets, "start": start, "end": end}
+            if len(ports) != end - start + 1:
+                scan["ports"] = compress_ports(ports)
+
+            for host, port, status in self.journal.begin(scan, resume=self.resume):
+                # Skip the replayed ports of hosts that aren't scanned by this run.
+                if host in self.results.hosts and self.results.record(host, port, status):
+                    self.finish_host(host)
+
+        # Record the scan in the history database (continuing the unfinished one when resuming).
+        if self.history_file:
+            self.history = ScanHistory(self.history_file)
+            self.history_scan = self.history.begin(
+                self.hosts, compress_ports(ports), self.engine, resume=self.resume)
+
+        # Open the stream file before scanning, so results are saved as they come in
+        # (appending to the previous runs results when resuming).
+        if self.stream_file:
+            self.writer = open_writer(self.stream_file, self.stream_format, append=self.resume)
+
+        # Start the periodic metrics snapshots and the live scan table.
+        self.metrics.start()
+        self.renderer.start()
+
+        try:
+            # Order the ports (ex. the most common ones first).
+            self.run_engine(order_ports(ports, self.order, self.seed))
+        finally:
+            # Flush the buffered results, even if the scan was interrupted.
+            if self.writer:
+                self.writer.close()
+                self.writer = None
+
+            # Checkpoint the remaining ports.
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+
+            # Only a scan with nothing left to scan is finished (others are continued when resuming).
+            if self.history:
+                if not self.results.remaining():
+                    self.history.finish(self.history_scan)
+
+                self.history.close()
+                self.history = None
+
+            # Write the final metrics.
+            self.metrics.stop()
+
+            # Draw the final scan table (or only the summary when quiet).
+            skipped = self.skipped_counter.value
+
+            self.renderer.stop(
+                f"Scanned {len(self.results)} port(s) "
+                f"of {len(self.hosts)} host(s), {self.total_open} open" +
+                (f", {skipped} left unscanned (out of file descriptors or local ports)" if skipped else ""))
+
+        # The result store keeps the ports in order, so no sorting is required.
+        self.formatted_ports = self.format_ports()
+
+        # Write the scanned ports list to the output file.
         write_scan_output(objects=self.formatted_ports,  # List of objects to write to the CSV file.
                           # Headers to use in the CSV file.
                           headers=["host", "port", "status"],
                           output_file=self.output_file)  # File path to write to.
+
+
+class MultiScanner(Scanner):
+    """Scans many hosts at once, interleaving their (host, port) probes under the
+       Scanner's global concurrency and rate limits.
+
+    Attributes:
+        on_host_complete: Called with (host, open ports) when a host finishes.
+    """
+
+    TABLE_COLUMNS = ("Time Scanned", "Host", "Port", "Status", "Total Open")
+
+    def __init__(
+        self,
+        targets: str,
+        output_file: str,
+        on_host_complete: callable = None,
+        **options
+    ):
+        """Initializes a MultiScanner object.
+
+        Args:
+            targets: Hosts, CIDR blocks and/or ranges to scan (see parse_targets).
+            output_file: Where to write the scanned ports (if not blank).
+            on_host_complete: Called with (host, open ports) when a host finishes.
+            **options: Passed on to Scanner (engine, concurrency, resolver, rate).
+        """
+
+        super().__init__(targets, output_file, **options)
+
+        self.hosts = parse_targets(targets)
+        self.targets = targets
+        self.on_host_complete = on_host_complete or self.display_host
+
+    def resolve_targets(self):
+        """
+        Resolves every host before scanning, dropping the ones that can't be resolved.
+        """
+
+        resolved = []
+
+        for host in self.hosts:
+            try:
+                self.pinned.pin(host)
+                resolved.append(host)
+            except socket.gaierror as error:
+                std_error(f"Skipping {host}", error=error)
+
+        self.hosts = resolved
+
+    def finish_host(self, host: str):
+        """Streams out the results of a host as soon as it has finished.
+
+        Args:
+            host: The host that finished scanning.
+        """
+
+        self.on_host_complete(host, [
+            port for _, port, *_ in self.results.iter_results(host, PORT_OPEN)
+        ])
+
+    def format_row(self, when: float, host: str, port: int, status: int) -> tuple:
+        """Formats the latest scanned port as a row of the live scan table (with its host)."""
+
+        return (time.strftime('%H:%M:%S', time.localtime(when)), host, port,
+                status == PORT_OPEN, self.total_open)
+
+    def display_host(self, host: str, open_ports: list):
+        """Displays the results of a finished host (above the live scan table).
+
+        Args:
+            host: The host that finished scanning.
+            open_ports: The open ports found on the host.
+        """
+
+        # Name the service of each fingerprinted port (ex. 22/ssh).
+        named = [
+            f"{port}/{self.services[(host, port)][0]}" if (host, port) in self.services else str(port)
+            for port in open_ports
+        ]
+
+        self.renderer.log(success_text(
+            f"{host} finished with {len(open_ports)} open port(s)" +
+            (f": {', '.join(named)}" if open_ports else ""), end=""))
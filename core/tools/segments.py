@@ -0,0 +1,452 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/segments.py
+"""
+
+import os  # path, remove, replace
+import re  # compile, escape
+import glob  # glob, escape
+import gzip  # compress
+import json  # dump, load
+import zlib  # decompress, MAX_WBITS
+import struct  # error
+import ipaddress  # ip_address
+
+from queue import Queue
+from threading import Thread
+
+from core.tools.capture import PcapWriter, PCAP_HEADER, PCAP_RECORD, CAPTURE_SNAPLEN
+from core.tools.packets import LINKTYPE_ETHERNET
+from core.tools.flows import flow_key, format_address
+
+INDEX_CHUNK = 1 << 20  # Bytes of packets indexed (and compressed) together.
+INDEX_MAX_KEYS = 4096  # Most hosts (or ports) listed per chunk, past that a chunk matches any.
+INDEX_SUFFIX = ".idx"  # Appended to a segments name for its sidecar index.
+COMPRESS_LEVEL = 6
+
+
+class SegmentWriter:
+    """Writes a capture into pcap segments rotated by size and/or time, each with a
+       sidecar index, keeping only the latest segments if asked (a ring buffer).
+
+    Segments are named after the output file (capture.pcap is written into
+    capture-00000.pcap, capture-00001.pcap, ...). Their packets are indexed
+    in chunks of about INDEX_CHUNK bytes: the file offset, time range, hosts
+    and ports of each chunk are written into the segments sidecar (JSON) as
+    soon as the chunk closes, so a query only reads the chunks that can hold
+    its packets (see CaptureArchive), and the chunks of the open segment can
+    be queried (and survive a crash) before it closes.
+
+    Closed segments are compressed (and old ones deleted) by a background
+    thread, one gzip member per chunk, so a chunk is still read on its own.
+
+    A capture to an output file that already has segments continues their
+    numbering, counting them towards the segments kept.
+
+    Attributes:
+        output_file: The file the segments are named after.
+        link_type: The link type of the packets.
+        snaplen: Most bytes kept of each packet.
+        max_size: Size at which a segment is closed (in bytes, 0 for no limit).
+        max_time: Capture time after which a segment is closed (in seconds, 0 for no limit).
+        keep: How many segments to keep, deleting the oldest (0 to keep them all).
+        compress: Whether to gzip closed segments.
+        writer: The pcap writer of the open segment.
+        index: The sidecar index of the open segment.
+        segments: The closed segments, oldest first.
+    """
+
+    def __init__(
+        self,
+        output_file: str,
+        link_type: int = LINKTYPE_ETHERNET,
+        snaplen: int = CAPTURE_SNAPLEN,
+        max_size: int = 0,
+        max_time: float = 0,
+        keep: int = 0,
+        compress: bool = False
+    ):
+        self.output_file = output_file
+        self.link_type = link_type
+        self.snaplen = snaplen
+        self.max_size = max_size
+        self.max_time = max_time
+        self.keep = keep
+        self.compress = compress
+
+        self.root, self.extension = os.path.splitext(output_file)
+        self.extension = self.extension or ".pcap"
+
+        # Continue after the segments of earlier captures, so they are never overwritten.
+        numbers = self.find_segments()
+
+        self.number = numbers[-1] + 1 if numbers else 0
+        self.writer = None
+        self.index = None
+        self.chunk = None
+        self.segments = [self.segment_path(number) for number in numbers]
+
+        # Closed segments are compressed and deleted in order, off the capturing thread.
+        self.queue = Queue()
+        self.thread = Thread(target=self.finish_segments, daemon=True)
+        self.thread.start()
+
+    def segment_path(self, number: int) -> str:
+        """Returns the path of the segment with the passed number (uncompressed)."""
+
+        return f"{self.root}-{number:05d}{self.extension}"
+
+    def find_segments(self) -> list:
+        """Returns the numbers of the segments already written to the output file
+           (compressed, uncompressed or only indexed), oldest first.
+        """
+
+        pattern = re.compile(
+            re.escape(os.path.basename(self.root)) + r"-(\d+)" + re.escape(self.extension) +
+            "(?:" + re.escape(".gz") + "|" + re.escape(INDEX_SUFFIX) + ")?$")
+        numbers = set()
+
+        for path in glob.glob(f"{glob.escape(self.root)}-*{glob.escape(self.extension)}*"):
+            if match := pattern.match(os.path.basename(path)):
+                numbers.add(int(match.group(1)))
+
+        return sorted(numbers)
+
+    def open_segment(self, now: float):
+        """
+        Opens the next segment, starting at the passed capture time.
+        """
+
+        path = self.segment_path(self.number)
+        self.number += 1
+
+        self.writer = PcapWriter(path, self.link_type, self.snaplen)
+        self.index = {
+            "segment": os.path.basename(path),
+            "file": os.path.basename(path),
+            "link_type": self.link_type,
+            "snaplen": self.snaplen,
+            "first": now,
+            "last": now,
+            "packets": 0,
+            "compressed": False,
+            "chunks": []
+        }
+
+    def open_chunk(self, now: float):
+        """
+        Starts indexing a new chunk of the open segment at the passed capture time.
+        """
+
+        self.chunk = {"offset": self.writer.size, "size": 0, "first": now, "last": now,
+                      "packets": 0, "hosts": set(), "ports": set()}
+
+    def close_chunk(self):
+        """
+        Adds the open chunk to the segments index.
+        """
+
+        chunk, self.chunk = self.chunk, None
+
+        if not chunk or not chunk["packets"]:
+            return
+
+        chunk["size"] = self.writer.size - chunk["offset"]
+
+        # Chunks that had too many keys to be selective (None) are read for every query.
+        hosts, ports = chunk["hosts"], chunk["ports"]
+        chunk["hosts"] = None if hosts is None else [format_address(host) for host in sorted(hosts)]
+        chunk["ports"] = None if ports is None else sorted(ports)
+
+        self.index["chunks"].append(chunk)
+
+    def close_segment(self):
+        """
+        Closes the open segment and hands it to the background thread.
+        """
+
+        if not self.writer:
+            return
+
+        self.close_chunk()
+        self.writer.close()
+
+        self.index["packets"] = self.writer.packets
+        self.queue.put((self.writer.path, self.index))
+
+        self.writer = self.index = None
+
+    def write(self, seconds: int, microseconds: int, length: int, header: bytes, data):
+        """Writes and indexes a packet (see PcapWriter.write), rotating segments as needed."""
+
+        now = seconds + microseconds / 1e6
+
+        if self.writer and (self.max_time and now - self.index["first"] >= self.max_time or
+                            self.max_size and self.writer.size >= self.max_size):
+            self.close_segment()
+
+        if not self.writer:
+            self.open_segment(now)
+
+        if not self.chunk:
+            self.open_chunk(now)
+
+        chunk = self.chunk
+
+        try:
+            # Cooked headers are read on their own, without copying the packet behind them.
+            flow = flow_key(self.link_type, data, header)
+        except (struct.error, IndexError):
+            flow = None
+
+        if flow:
+            (_, source, destination, source_port, destination_port), _ = flow
+
+            if chunk["hosts"] is not None:
+                chunk["hosts"].update((source, destination))
+                chunk["hosts"] = chunk["hosts"] if len(chunk["hosts"]) <= INDEX_MAX_KEYS else None
+
+            if chunk["ports"] is not None and (source_port or destination_port):
+                chunk["ports"].update((source_port, destination_port))
+                chunk["ports"] = chunk["ports"] if len(chunk["ports"]) <= INDEX_MAX_KEYS else None
+
+        self.writer.write(seconds, microseconds, length, header, data)
+
+        chunk["packets"] += 1
+        chunk["last"] = self.index["last"] = now
+
+        if self.writer.size - chunk["offset"] >= INDEX_CHUNK:
+            self.close_chunk()
+            self.update_index()
+
+    def update_index(self):
+        """
+        Writes (or replaces) the index of the open segment, covering its closed chunks.
+        """
+
+        # The indexed chunks must be on disk before a query reads them.
+        self.writer.flush()
+
+        self.index["packets"] = sum(chunk["packets"] for chunk in self.index["chunks"])
+        write_index(self.writer.path, self.index)
+
+    def write_block(self, packets: list):
+        """
+        Writes every packet of a block handed out by RingCapture or PcapStream.
+        """
+
+        for seconds, nanoseconds, length, header, data in packets:
+            self.write(seconds, nanoseconds // 1000, length, header, data)
+
+    def finish_segments(self):
+        """
+        Background thread writing the index of closed segments, compressing them
+        and deleting the oldest ones, until closed.
+        """
+
+        while (item := self.queue.get()) is not None:
+            path, index = item
+
+            write_index(path, index)
+
+            if self.compress:
+                compress_segment(path, index)
+
+            self.segments.append(path)
+
+            # Keep the newest segments only.
+            while self.keep and len(self.segments) > self.keep:
+                remove_segment(self.segments.pop(0))
+
+    def close(self):
+        """
+        Closes the open segment and waits for the background thread to finish.
+        """
+
+        self.close_segment()
+
+        self.queue.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def write_index(path: str, index: dict):
+    """
+    Writes (or replaces) the sidecar index of a segment.
+    """
+
+    temporary = path + INDEX_SUFFIX + ".tmp"
+
+    with open(temporary, "w") as file_obj:
+        json.dump(index, file_obj)
+
+    # Replaced at once, a reader never sees half an index.
+    os.replace(temporary, path + INDEX_SUFFIX)
+
+
+def compress_segment(path: str, index: dict):
+    """Gzips a closed segment, one gzip member for its header and one per chunk, so
+       the chunks are still found by offset (the file decompresses to the whole pcap).
+    """
+
+    compressed = path + ".gz"
+    offset = 0
+
+    with open(path, "rb") as source, open(compressed + ".tmp", "wb") as target:
+        # The pcap header, then each chunk (which follow each other).
+        parts = [{"offset": 0, "size": PCAP_HEADER.size}] + index["chunks"]
+
+        for part in parts:
+            source.seek(part["offset"])
+            member = gzip.compress(source.read(part["size"]), COMPRESS_LEVEL)
+            target.write(member)
+
+            part["compressed_offset"], part["compressed_size"] = offset, len(member)
+            offset += len(member)
+
+    os.replace(compressed + ".tmp", compressed)
+
+    index["file"] = os.path.basename(compressed)
+    index["compressed"] = True
+    write_index(path, index)
+
+    os.remove(path)
+
+
+def remove_segment(path: str):
+    """
+    Deletes a segment (compressed or not) and its sidecar index.
+    """
+
+    for name in (path, path + ".gz", path + INDEX_SUFFIX):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+class CaptureArchive:
+    """Queries the segments written by a SegmentWriter through their sidecar indexes.
+
+    Only the chunks whose time range, hosts and ports can hold the queried
+    packets are read (seeking straight to them, and decompressing them on
+    their own), then each of their packets is checked.
+
+    Attributes:
+        output_file: The file the segments are named after.
+    """
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.root, self.extension = os.path.splitext(output_file)
+        self.extension = self.extension or ".pcap"
+
+    def indexes(self) -> list:
+        """Returns the sidecar index of every segment, oldest first (with its directory)."""
+
+        indexes = []
+
+        for path in sorted(glob.glob(f"{glob.escape(self.root)}-*{self.extension}{INDEX_SUFFIX}")):
+            try:
+                with open(path) as file_obj:
+                    index = json.load(file_obj)
+            except (OSError, ValueError):
+                # Deleted (or being replaced) in the meantime.
+                continue
+
+            index["directory"] = os.path.dirname(path)
+            indexes.append(index)
+
+        return indexes
+
+    def read_chunk(self, index: dict, chunk: dict) -> bytes:
+        """Reads the records of a chunk of a segment."""
+
+        with open(os.path.join(index["directory"], index["file"]), "rb") as file_obj:
+            if index["compressed"]:
+                file_obj.seek(chunk["compressed_offset"])
+                return zlib.decompress(file_obj.read(chunk["compressed_size"]), zlib.MAX_WBITS | 16)
+
+            file_obj.seek(chunk["offset"])
+            return file_obj.read(chunk["size"])
+
+    def query(self, host: str = None, port: int = None, start: float = None, end: float = None):
+        """Finds the captured packets to or from a host and/or port, within a time range.
+
+        Args:
+            host: Only the packets from or to this address (any if None).
+            port: Only the packets from or to this port (any if None).
+            start: Only the packets captured from this time on (time.time, any if None).
+            end: Only the packets captured up to this time (time.time, any if None).
+
+        Yields:
+            tuple: The (seconds, microseconds, length, header, data) of each packet
+                   (see PcapWriter.write), oldest first.
+        """
+
+        address = ipaddress.ip_address(host).packed if host else None
+        host = format_address(address) if address else None
+
+        for index in self.indexes():
+            if start is not None and index["last"] < start or end is not None and index["first"] > end:
+                continue
+
+            for chunk in index["chunks"]:
+                # Skip the chunks that can't hold a matching packet.
+                if start is not None and chunk["last"] < start or end is not None and chunk["first"] > end:
+                    continue
+
+                if host and chunk["hosts"] is not None and host not in chunk["hosts"]:
+                    continue
+
+                if port and chunk["ports"] is not None and port not in chunk["ports"]:
+                    continue
+
+                try:
+                    data = self.read_chunk(index, chunk)
+                except (OSError, zlib.error):
+                    # Deleted by the ring buffer in the meantime.
+                    continue
+
+                yield from self.match(index["link_type"], data, address, port, start, end)
+
+    @staticmethod
+    def match(link_type: int, data: bytes, address: bytes, port: int, start: float, end: float):
+        """Generates the packets of a chunk's records matching a query (see query)."""
+
+        view = memoryview(data)
+        offset = 0
+
+        while offset + PCAP_RECORD.size <= len(data):
+            seconds, microseconds, captured, length = PCAP_RECORD.unpack_from(view, offset)
+            packet = view[offset + PCAP_RECORD.size:offset + PCAP_RECORD.size + captured]
+            offset += PCAP_RECORD.size + captured
+
+            now = seconds + microseconds / 1e6
+
+            if start is not None and now < start or end is not None and now > end:
+                continue
+
+            if address or port:
+                try:
+                    flow = flow_key(link_type, packet)
+                except (struct.error, IndexError):
+                    continue
+
+                if not flow:
+                    continue
+
+                (_, source, destination, source_port, destination_port), _ = flow
+
+                if address and address not in (source, destination):
+                    continue
+
+                if port and port not in (source_port, destination_port):
+                    continue
+
+            yield seconds, microseconds, length, b"", bytes(packet)
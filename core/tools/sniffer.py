@@ -2,26 +2,145 @@
 # -*- coding: utf-8 -*-
 """
     @author:  Max
-    @package: core/sniffer.py
+    @package: core/tools/sniffer.py
 """
 
-import subprocess  # Popen, PIPE, STDOUT
+import re  # compile
+import time  # monotonic
+import subprocess  # run, Popen, PIPE, STDOUT, DEVNULL
 
 from core.terminal import *
 from core.tools.util import defer
+from core.tools.capture import RingCapture, PcapStream, PcapWriter, CAPTURE_SNAPLEN
+from core.tools.bpf import parse_filter
+from core.tools.packets import decode_packet, format_packet
+from core.tools.flows import FlowTable, format_flows
+from core.tools.segments import SegmentWriter
+
+SNIFFER_ENGINES = ("tcpdump", "pipe", "ring")
+SNIFFER_STATS_INTERVAL = 0.5  # Time between reads of the ring captures drop counters (in seconds).
+SNIFFER_FLOW_INTERVAL = 2.0  # Time between flow table snapshots (in seconds).
+DROPPED_PATTERN = re.compile(r"(\d+) packets? dropped by kernel")  # From tcpdumps exit statistics.
+
+
+def tcpdump_command(interface: str) -> list:
+    """Returns the start of every tcpdump command run on the passed interface
+       (privileged, and on the default interface if blank).
+    """
+
+    command = ["sudo", "tcpdump"]
+
+    # If the interface isn't blank, add it to the command.
+    if interface:
+        # Add the tcpdump command flag (-i <interface>) to specify
+        # the passed interface as the only one to capture packets on.
+        command.extend(["-i", interface])
+
+    return command
+
+
+def validate_filter(expression: str, engine: str, interface: str = ""):
+    """Validates a capture filter for the passed engine.
+
+    The ring engine compiles the filter itself, so it must be within the subset
+    of pcap-filter that parse_filter knows. The tcpdump engines hand it over to
+    tcpdump, which compiles the whole language, so it is checked by tcpdump -d
+    (compiling it without capturing anything). The check runs like the capture
+    (see tcpdump_command), as tcpdump opens the interface for its link type.
+
+    Args:
+        expression: The capture filter (blank for none).
+        engine: The capture engine (see SNIFFER_ENGINES).
+        interface: The interface that will be captured (blank for the default one).
+
+    Raises:
+        ValueError: The filter is invalid.
+    """
+
+    if not expression:
+        return
+
+    if engine == "ring":
+        parse_filter(expression)
+        return
+
+    try:
+        result = subprocess.run(tcpdump_command(interface) + ["-d", expression],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    except FileNotFoundError:
+        # Without tcpdump the capture can't start anyway, which reports it.
+        return
+
+    if result.returncode:
+        # tcpdump ends with the reason the filter was rejected.
+        raise ValueError(result.stderr.strip().splitlines()[-1] if result.stderr.strip()
+                         else "rejected by tcpdump")
 
 
 class PacketSniffer:
-    """Captures network packets using the tcpdump Linux command.
+    """Captures network packets using the tcpdump Linux command (decoding its binary
+       output with the pipe engine), or in-process through a memory-mapped packet
+       ring (see RingCapture).
 
     Attributes:
         output_file: Where to store the tcpdump scan (pcap format).
+        engine: How packets are captured (one of SNIFFER_ENGINES).
+        expression: The capture filter, applied by the kernel (blank to capture every packet).
+        snaplen: Most bytes kept of each packet.
         process: The tcpdump process running the packet sniffing (subprocess).
+        capture: The ring capture running the packet sniffing (ring engine).
+        renderer: Renderer drawing the live packet display (only the summary when quiet).
+        packets: The amount of packets displayed by the current capture.
+        size: The amount of bytes on the wire of the captured packets (pipe and ring engines).
+        dropped: The amount of packets the kernel dropped (pipe and ring engines).
+        flow_table: Aggregates the packets into flows, displayed instead of the packets (None if off).
+        snapshot: The latest flow table snapshot (see FlowTable.snapshot).
+        segment_size: Size at which the output is rotated into a new segment (in bytes, 0 for never).
+        segment_time: Time after which the output is rotated into a new segment (in seconds, 0 for never).
+        segment_count: How many segments to keep, deleting the oldest (0 to keep them all).
+        compress: Whether to gzip the closed segments.
     """
 
-    def __init__(self, output_file: str = ""):
+    def __init__(
+        self,
+        output_file: str = "",
+        quiet: bool = False,
+        engine: str = "tcpdump",
+        flows: bool = False,
+        expression: str = "",
+        snaplen: int = CAPTURE_SNAPLEN,
+        segment_size: int = 0,
+        segment_time: float = 0,
+        segment_count: int = 0,
+        compress: bool = False
+    ):
         self.output_file = output_file
+        self.engine = engine
+        self.expression = expression
+        self.snaplen = snaplen
+
+        # Validate the filter the ring engine compiles itself (tcpdump compiles its own).
+        if engine == "ring":
+            parse_filter(expression)
+
+        # Segments are indexed from the decoded pipe and ring engines.
+        self.segment_size = segment_size
+        self.segment_time = segment_time
+        self.segment_count = segment_count
+        self.compress = compress
+        self.segmented = bool(output_file and (segment_size or segment_time) and engine != "tcpdump")
+
         self.process = None
+        self.capture = None
+
+        # Flows are aggregated from the decoded pipe and ring engines.
+        self.flow_table = FlowTable() if flows and engine != "tcpdump" else None
+        self.snapshot = None
+        self.snapshotted = time.monotonic()
+
+        columns = ("Packets",) if engine == "tcpdump" else ("Packets", "Bytes", "Dropped")
+        self.renderer = Renderer(columns, quiet=quiet)
+        self.packets = self.size = self.dropped = 0
 
     def construct_command(self, interface: str) -> list:
         """Constructs and returns the tcpdump command to be executed.
@@ -33,20 +152,27 @@ class PacketSniffer:
             list: The constructed tcpdump command as a list of strings.
         """
 
-        command = ["sudo", "tcpdump"]
+        command = tcpdump_command(interface)
 
-        # If the interface isn't blank, add it to the command.
-        if interface:
-            # Add the tcpdump command flag (-i <interface>) to specify
-            # the passed interface as the only one to capture packets on.
-            command.extend(["-i", interface])
+        # With the pipe engine, write packet buffered pcap to STDOUT instead,
+        # which is copied into the output file as it is decoded.
+        if self.engine == "pipe":
+            command.extend(["-U", "-w", "-"])
 
         # If the output file isn't blank, add it to the command.
-        if self.output_file:
+        elif self.output_file:
             # Add the tcpdump command flag (-w <file>) to specify the output
             # file to write the packet capturing information to (pcap format).
             command.extend(["-w", self.output_file])
 
+        # Keep only the first bytes of each packet (-s <snaplen>).
+        if self.snaplen != CAPTURE_SNAPLEN:
+            command.extend(["-s", str(self.snaplen)])
+
+        # The capture filter goes last, tcpdump compiles it into the kernel itself.
+        if self.expression:
+            command.append(self.expression)
+
         return command
 
     @defer(
@@ -62,6 +188,14 @@ class PacketSniffer:
             display (bool, optional): Whether to display captured packets live. Defaults to False.
         """
 
+        if self.engine == "ring":
+            self.capture_packets_with_ring(*options, display=display)
+            return
+
+        if self.engine == "pipe":
+            self.capture_packets_with_pipe(*options, display=display)
+            return
+
         # Construct the tcpdump command to use based on the passed options.
         command = self.construct_command(*options)
 
@@ -77,22 +211,214 @@ class PacketSniffer:
             # that no packets will be displayed to the screen, as all output is
             # directed to the passed output file instead.
             if display:
-                std_info("Live packet display", start="\n", end=":")
-                # Print every line written to the processes STDOUT.
-                # This will result in all incoming packets being displayed.
-                for line in iter(self.process.stdout.readline, b''):
-                    std_info(line.strip())
+                if not self.renderer.quiet:
+                    std_info("Live packet display", start="\n", end=":")
+
+                self.renderer.start()
+
+                # Hand every line written to the processes STDOUT to the renderer,
+                # which prints them in batches so that tcpdump is never held up.
+                for line in iter(self.process.stdout.readline, ''):
+                    self.packets += 1
+                    self.renderer.log(info_text(line.strip(), end=""))
+                    self.renderer.update("packets", self.packets)
+
+        except KeyboardInterrupt:
+            # Stop capturing packets as CTRL-C was pressed.
+            std_success("Stopped capturing packets", start="\n", end="...")
+            return
+
+        finally:
+            # Print the remaining lines and the amount of captured packets.
+            if display:
+                self.renderer.stop(f"Captured {self.packets} packet(s)")
+
+    def handle_block(self, link_type: int, packets: list, display: bool, writer=None):
+        """Writes, counts and displays a block of captured packets (see RingCapture).
+
+        Args:
+            link_type: The link type of the packets.
+            packets: The (seconds, nanoseconds, length, header, data) of each packet.
+            display: Whether to display the decoded packets (or flows) live.
+            writer: The PcapWriter (or SegmentWriter) of the output file (None if already written).
+        """
+
+        if writer:
+            writer.write_block(packets)
+
+        self.packets += len(packets)
+        self.size += sum(packet[2] for packet in packets)
+
+        if self.flow_table is not None:
+            self.flow_table.add_block(link_type, packets)
+
+            # Display the busiest flows every interval instead of every packet.
+            if time.monotonic() - self.snapshotted >= SNIFFER_FLOW_INTERVAL:
+                self.snapshotted = time.monotonic()
+                self.snapshot = self.flow_table.snapshot()
+
+                if display:
+                    for line in format_flows(self.snapshot):
+                        self.renderer.log(info_text(line, end=""))
+
+        elif display and not self.renderer.quiet:
+            for _, _, length, header, data in packets:
+                # Cooked headers are read on their own, without copying the packet behind them.
+                packet = decode_packet(link_type, data, header)
+                line = format_packet(packet) if packet else f"{length} byte packet"
+
+                self.renderer.log(info_text(line, end=""))
+
+        if display:
+            self.renderer.update("packets", self.packets, self.size, self.dropped)
+
+    def open_writer(self, link_type: int, snaplen: int):
+        """Opens the writer of the output file (rotated into indexed segments if asked).
+
+        Returns:
+            The SegmentWriter or PcapWriter (None if there is no output file).
+        """
+
+        if self.segmented:
+            return SegmentWriter(self.output_file, link_type, snaplen, self.segment_size,
+                                 self.segment_time, self.segment_count, self.compress)
+
+        return PcapWriter(self.output_file, link_type, snaplen) if self.output_file else None
+
+    def capture_packets_with_pipe(self, interface: str = "", display: bool = False):
+        """Captures packets on the specified network interface with tcpdump writing pcap
+           to a pipe, decoding the packets for the live display while copying the raw
+           stream into the output file.
+
+        Args:
+            interface (str): Network interface to capture packets on (blank for all).
+            display (bool, optional): Whether to display captured packets live. Defaults to False.
+        """
+
+        # Construct the tcpdump command to use based on the passed options.
+        command = self.construct_command(interface)
+
+        # Segments are written from the decoded packets, otherwise the stream is copied as it is.
+        tee = open(self.output_file, "wb") if self.output_file and not self.segmented else None
+        writer = None
+
+        # Read the binary pipe without Pythons buffering, PcapStream reads large chunks itself.
+        self.process = subprocess.Popen(command,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        bufsize=0)
+        stream = PcapStream(self.process.stdout, tee)
+
+        def on_block(packets: list):
+            nonlocal writer
+
+            # The link type is known once the streams header was read.
+            if self.segmented and writer is None:
+                writer = self.open_writer(stream.link_type, stream.snaplen)
+
+            self.handle_block(stream.link_type, packets, display, writer)
+
+        try:
+            if display:
+                if not self.renderer.quiet:
+                    std_info(f"Live {'flow' if self.flow_table is not None else 'packet'} display",
+                             start="\n", end=":")
+
+                self.renderer.start()
+
+            try:
+                for packets in stream.blocks():
+                    on_block(packets)
+
+            except KeyboardInterrupt:
+                # Stop capturing packets as CTRL-C was pressed.
+                std_success("Stopped capturing packets", start="\n", end="...")
+
+                # Let tcpdump flush the packets it captured, and keep them.
+                self.process.terminate()
+
+                for packets in stream.blocks():
+                    on_block(packets)
+
+        finally:
+            if tee:
+                tee.close()
+
+            if writer:
+                writer.close()
+
+            # tcpdump reports its drop counter when it exits.
+            if self.process.poll() is None:
+                self.process.terminate()
+
+            self.process.wait()
+            match = DROPPED_PATTERN.search(self.process.stderr.read().decode(errors="replace"))
+            self.dropped = int(match[1]) if match else 0
+
+            # Print the final counters and the amount of captured packets.
+            if display:
+                self.renderer.update("packets", self.packets, self.size, self.dropped)
+                self.renderer.stop(f"Captured {self.packets} packet(s), {self.dropped} dropped by the kernel")
+
+    def capture_packets_with_ring(self, interface: str = "", display: bool = False):
+        """Captures packets on the specified network interface through a packet ring,
+           writing them straight into the output file.
+
+        Args:
+            interface (str): Network interface to capture packets on (blank for all).
+            display (bool, optional): Whether to display captured packets live. Defaults to False.
+        """
+
+        self.capture = RingCapture(interface, expression=self.expression, snaplen=self.snaplen)
+        writer = self.open_writer(self.capture.link_type, self.snaplen)
+
+        # The kernels counters are read from the capturing thread, between blocks.
+        checked = time.monotonic()
+
+        def on_block(packets: list):
+            nonlocal checked
+
+            if time.monotonic() - checked >= SNIFFER_STATS_INTERVAL:
+                checked = time.monotonic()
+                self.dropped = self.capture.statistics()[1]
+
+            self.handle_block(self.capture.link_type, packets, display, writer)
+
+        try:
+            if display:
+                if not self.renderer.quiet:
+                    std_info(f"Live {'flow' if self.flow_table is not None else 'packet'} display",
+                             start="\n", end=":")
+
+                self.renderer.start()
+
+            self.capture.run(on_block)
 
         except KeyboardInterrupt:
             # Stop capturing packets as CTRL-C was pressed.
             std_success("Stopped capturing packets", start="\n", end="...")
             return
 
+        finally:
+            if writer:
+                writer.close()
+
+            self.dropped = self.capture.dropped
+
+            # Print the final counters and the amount of captured packets.
+            if display:
+                self.renderer.update("packets", self.packets, self.size, self.dropped)
+                self.renderer.stop(f"Captured {self.packets} packet(s), {self.dropped} dropped by the kernel")
+
     def stop_packet_capture(self):
         """
-        Stops the tcpdump packet capture process.
+        Stops the tcpdump packet capture process (or the ring capture).
         """
 
+        if self.capture:
+            self.capture.stop()
+            self.capture = None
+
         if self.process and self.process.poll() is None:
             self.process.terminate()
             self.process.wait()
@@ -0,0 +1,510 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/syn.py
+"""
+
+import time  # monotonic
+import zlib  # crc32
+import heapq  # heappush, heappop
+import random  # getrandbits
+import select  # select
+import socket  # socket, SOCK_RAW, IPPROTO_TCP, inet_pton
+import struct  # Struct, pack
+
+from array import array
+from threading import Thread, Event, Lock
+
+from core.tools.pinger import checksum
+from core.tools.results import PORT_OPEN, PORT_CLOSED, PORT_FILTERED
+from core.tools.timing import WarmUpGate
+from core.tools.limits import is_resource_error
+
+SYN_WINDOW = 4096  # Default most probes waiting for a reply at once.
+SYN_RETRIES = 1  # How many times an unanswered SYN is sent again.
+SYN_TICK = 0.05  # Longest time the sender and receiver sleep between checks (in seconds).
+SYN_READ = 4096  # Most bytes read from a captured packet.
+SYN_BATCH = 1024  # Most packets read from the raw socket at once.
+SYN_BUFFER = 4 << 20  # Receive buffer of the raw sockets (in bytes).
+
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+# Source port, destination port, sequence, acknowledgment, data offset, flags,
+# window, checksum and urgent pointer, followed by an MSS option (like a real SYN).
+TCP_HEADER = struct.Struct("!HHIIBBHHH")
+TCP_OPTIONS = b"\x02\x04\x05\xb4"  # MSS 1460.
+TCP_REPLY = struct.Struct("!HHII")  # The source/destination ports, sequence and acknowledgment of a reply.
+
+
+class SynStateTable:
+    """Fixed size table of the SYN probes waiting for a reply.
+
+    Each probe takes a slot of preallocated arrays (a few dozen bytes), found
+    by its (address, port) and freed once the port is classified, so the
+    table never grows past the engines window whatever the amount of ports.
+
+    Attributes:
+        slots: The slot of each outstanding (address, port).
+        hosts: The hosts waiting for each slot (several if their names share an address).
+        families: The address family of each slot.
+        addresses: The address of each slot.
+        ports: The port of each slot.
+        attempts: How many times each slots probe has been sent again.
+        generations: Incremented on each send, telling stale retransmission deadlines apart.
+        sent: When each slots probe was last sent (time.monotonic).
+        first: When each slots probe was first sent (time.monotonic).
+    """
+
+    def __init__(self, size: int):
+        self.slots = {}
+        self.free = list(range(size - 1, -1, -1))
+
+        self.hosts = [None] * size
+        self.families = bytearray(size)
+        self.addresses = [None] * size
+        self.ports = array("H", bytes(2 * size))
+        self.attempts = bytearray(size)
+        self.generations = array("I", bytes(4 * size))
+        self.sent = array("d", bytes(8 * size))
+        self.first = array("d", bytes(8 * size))
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def add(self, host: str, family: int, address: str, port: int) -> int:
+        """Takes a slot for a probe, or joins the outstanding probe of the same address and port.
+
+        Returns:
+            int: The slot of the new probe (None if the host joined an outstanding one).
+        """
+
+        if (slot := self.slots.get((address, port))) is not None:
+            self.hosts[slot].append(host)
+            return None
+
+        slot = self.slots[(address, port)] = self.free.pop()
+
+        self.hosts[slot] = [host]
+        self.families[slot] = family
+        self.addresses[slot] = address
+        self.ports[slot] = port
+        self.attempts[slot] = 0
+        self.first[slot] = 0.0
+
+        return slot
+
+    def remove(self, slot: int) -> list:
+        """Frees the slot of a classified probe.
+
+        Returns:
+            list: The hosts that were waiting for the probe.
+        """
+
+        del self.slots[(self.addresses[slot], self.ports[slot])]
+        hosts, self.hosts[slot] = self.hosts[slot], None
+        self.free.append(slot)
+
+        return hosts
+
+
+class SynScanEngine:
+    """Half-open (SYN) TCP scanner, sending hand built SYN packets from raw sockets (requires root).
+
+    No connection is ever completed, so probes don't use a file descriptor,
+    an ephemeral port or a connect() call each. A receive thread reads the
+    replies from the raw sockets while the calling thread sends the probes:
+
+        SYN-ACK: PORT_OPEN (the kernel answers it with a RST, closing the half-open connection).
+        RST: PORT_CLOSED.
+        No reply after every retransmission: PORT_FILTERED.
+
+    Replies are matched statelessly, as the sequence number of each SYN is a
+    keyed checksum of its address and port that the reply must acknowledge.
+    The source port is reserved by binding a (never connected) TCP socket to
+    it, so the engine never collides with a connection of the machine.
+
+    Attributes:
+        resolver: The Resolver (or the scans PinnedResolver) used to look up each hosts address.
+        timing: TimingTable giving the retransmission timeout of each host.
+        scheduler: ProbeScheduler pacing the probes (None for no pacing, the
+                   outcomes are left to on_result to report).
+        on_result: Called with (host, port, status, latency) for each port.
+        on_timeout: Called with (estimator, retrying) for each unanswered probe.
+        retries: How many times an unanswered SYN is sent again.
+        window: Most probes waiting for a reply at once.
+        warmup: WarmUpGate holding back the probes of hosts that haven't been measured yet.
+        table: The SynStateTable of the outstanding probes.
+        timers: Heap of the (deadline, slot, generation) of each sent probe.
+        sent: The amount of SYN packets sent.
+    """
+
+    def __init__(
+        self,
+        resolver,
+        timing,
+        scheduler=None,
+        on_result: callable = None,
+        on_timeout: callable = None,
+        retries: int = SYN_RETRIES,
+        window: int = SYN_WINDOW
+    ):
+        self.resolver = resolver
+        self.timing = timing
+        self.scheduler = scheduler
+        self.on_result = on_result
+        self.on_timeout = on_timeout
+        self.retries = retries
+        self.window = max(1, window)
+        self.warmup = WarmUpGate(timing)
+
+        self.table = SynStateTable(self.window)
+        self.timers = []
+        self.sent = 0
+
+        self.sockets = {}  # The raw socket of each address family.
+        self.source_ports = {}  # The reserved (socket, port) of each address family.
+        self.routes = {}  # The (source, destination) packed addresses of each address.
+        self.secret = random.getrandbits(32)
+
+        # The table is shared by the sending and the receiving thread.
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.opened = Event()
+        self.stopping = Event()
+        self.receiver = None
+
+    def open_socket(self, family: int) -> socket.socket:
+        """Returns the raw socket of an address family, opening it (and reserving
+           its source port) the first time.
+
+        Raises:
+            PermissionError: Raw sockets require root (or CAP_NET_RAW).
+        """
+
+        if sock := self.sockets.get(family):
+            return sock
+
+        sock = socket.socket(family, socket.SOCK_RAW, socket.IPPROTO_TCP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SYN_BUFFER)
+        sock.setblocking(False)
+
+        # Reserve the source port, so that no connection of this machine uses it.
+        reserved = socket.socket(family, socket.SOCK_STREAM)
+        reserved.bind(("::" if family == socket.AF_INET6 else "0.0.0.0", 0))
+        self.source_ports[family] = reserved, reserved.getsockname()[1]
+
+        self.sockets[family] = sock
+        self.opened.set()
+        return sock
+
+    def close_sockets(self):
+        """
+        Closes the raw sockets, releasing their reserved source ports.
+        """
+
+        for sock in self.sockets.values():
+            sock.close()
+
+        for reserved, _ in self.source_ports.values():
+            reserved.close()
+
+        self.sockets.clear()
+        self.source_ports.clear()
+
+    def route(self, family: int, address: str) -> tuple:
+        """Returns the packed (source, destination) addresses used to probe an address."""
+
+        if route := self.routes.get(address):
+            return route
+
+        # Connecting a UDP socket asks the kernel which local address reaches the host.
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.connect((address, 9))
+            source = sock.getsockname()[0]
+
+        route = self.routes[address] = (socket.inet_pton(family, source),
+                                        socket.inet_pton(family, address))
+        return route
+
+    def cookie(self, destination: bytes, port: int) -> int:
+        """Returns the sequence number of the SYN sent to a (packed) address and port."""
+
+        return zlib.crc32(destination + port.to_bytes(2, "big"), self.secret)
+
+    def build_syn(self, family: int, address: str, port: int) -> bytes:
+        """Builds the TCP header of the SYN probing an address and port.
+
+        Args:
+            family: The address family of the address.
+            address: The probed address.
+            port: The probed port.
+
+        Returns:
+            bytes: The TCP header (the kernel adds the IP header).
+        """
+
+        source, destination = self.route(family, address)
+        source_port = self.source_ports[family][1]
+
+        header = TCP_HEADER.pack(
+            source_port, port, self.cookie(destination, port), 0,
+            (TCP_HEADER.size + len(TCP_OPTIONS)) << 2, TCP_SYN, 1024, 0, 0
+        ) + TCP_OPTIONS
+
+        # The checksum covers a pseudo header of the addresses, protocol and length.
+        if family == socket.AF_INET6:
+            pseudo = source + destination + struct.pack("!I3xB", len(header), socket.IPPROTO_TCP)
+        else:
+            pseudo = source + destination + struct.pack("!xBH", socket.IPPROTO_TCP, len(header))
+
+        return header[:16] + struct.pack("!H", checksum(pseudo + header)) + header[18:]
+
+    def start(self, host: str, port: int):
+        """Starts probing a hosts port.
+
+        Args:
+            host: The host to probe.
+            port: The port to probe.
+        """
+
+        try:
+            # Look up the hosts address (cached after the first port).
+            family, address = self.resolver.resolve(host)
+            self.open_socket(family)
+        except socket.gaierror:
+            # The host can't be resolved, so assume that the port is closed.
+            self.report(host, port, PORT_CLOSED, 0.0)
+            return
+
+        with self.lock:
+            slot = self.table.add(host, family, address, port)
+
+        if slot is not None:
+            self.send(slot)
+
+    def send(self, slot: int):
+        """
+        Sends (or sends again) the SYN of a slot, scheduling its retransmission deadline.
+        """
+
+        table = self.table
+
+        with self.lock:
+            # The probe may have been answered since its deadline passed.
+            if table.hosts[slot] is None:
+                return
+
+            family, address, port = table.families[slot], table.addresses[slot], table.ports[slot]
+            host = table.hosts[slot][0]
+
+            # Stamp the probe before sending it, as the receive thread can classify it
+            # (timing it from the stamp) before sendto even returns.
+            table.sent[slot] = time.monotonic()
+            table.first[slot] = table.first[slot] or table.sent[slot]
+            table.generations[slot] = generation = (table.generations[slot] + 1) & 0xFFFFFFFF
+
+        try:
+            self.sockets[family].sendto(self.build_syn(family, address, port), (address, 0))
+        except BlockingIOError:
+            # The send buffer is full, so let the retransmission send it.
+            pass
+        except OSError as error:
+            # Any other error than running out of buffers (e.g., unreachable)
+            # won't change when retried.
+            if not is_resource_error(error):
+                self.finish(slot, PORT_CLOSED)
+                return
+
+        self.sent += 1
+
+        with self.lock:
+            if table.hosts[slot] is None:
+                return
+
+            deadline = table.sent[slot] + self.timing.get(host).backoff(table.attempts[slot])
+
+        heapq.heappush(self.timers, (deadline, slot, generation))
+
+    def finish(self, slot: int, status: int):
+        """
+        Completes a probe, reporting the status of the port to every waiting host.
+        """
+
+        table = self.table
+        now = time.monotonic()
+
+        with self.lock:
+            # Skip the duplicate replies of an already classified probe.
+            if table.hosts[slot] is None:
+                return
+
+            port, attempt = table.ports[slot], table.attempts[slot]
+            sent, first = table.sent[slot], table.first[slot]
+            hosts = table.remove(slot)
+
+        # Only replies to probes that weren't retransmitted are timed (Karn's algorithm).
+        if status != PORT_FILTERED and not attempt:
+            self.timing.get(hosts[0]).observe(now - sent)
+
+        for host in hosts:
+            self.report(host, port, status, now - first)
+
+        # Let the sender fill the freed slot straight away.
+        self.wakeup.set()
+
+    def report(self, host: str, port: int, status: int, latency: float):
+        self.warmup.finished(host)
+
+        if self.on_result:
+            self.on_result(host, port, status, latency)
+
+    def receive(self, family: int, sock: socket.socket):
+        """
+        Reads every captured packet of a raw socket, classifying the probes they answer.
+        """
+
+        source_port = self.source_ports[family][1]
+
+        for _ in range(SYN_BATCH):
+            try:
+                packet, address = sock.recvfrom(SYN_READ)
+            except BlockingIOError:
+                break
+            except OSError:
+                # The socket was closed while stopping.
+                return
+
+            # IPv4 raw sockets include the IP header, IPv6 ones start at the TCP header.
+            offset = (packet[0] & 0x0F) * 4 if family == socket.AF_INET else 0
+
+            if len(packet) < offset + 14:
+                continue
+
+            port, destination_port, _, ack = TCP_REPLY.unpack_from(packet, offset)
+            flags = packet[offset + 13]
+
+            # Only SYN-ACKs and RSTs sent to the engines source port answer a probe.
+            if destination_port != source_port or not flags & (TCP_SYN | TCP_RST):
+                continue
+
+            slot = self.table.slots.get((address[0], port))
+
+            if slot is None:
+                continue
+
+            # The reply must acknowledge the SYNs sequence number.
+            if ack != (self.cookie(socket.inet_pton(family, address[0]), port) + 1) & 0xFFFFFFFF:
+                continue
+
+            if flags & (TCP_SYN | TCP_ACK) == TCP_SYN | TCP_ACK:
+                self.finish(slot, PORT_OPEN)
+            elif flags & TCP_RST:
+                self.finish(slot, PORT_CLOSED)
+
+    def receive_loop(self):
+        """
+        Receive thread, reading the replies of every raw socket until the engine stops.
+        """
+
+        while not self.stopping.is_set():
+            sockets = {sock: family for family, sock in list(self.sockets.items())}
+
+            # Wake up as soon as the first socket is opened, so its first replies aren't delayed.
+            if not sockets:
+                self.opened.wait(SYN_TICK)
+                continue
+
+            readable, _, _ = select.select(list(sockets), [], [], SYN_TICK)
+
+            for sock in readable:
+                self.receive(sockets[sock], sock)
+
+    def expire(self):
+        """
+        Retransmits the probes whose deadline passed, giving up on the ones out of retries.
+        """
+
+        table = self.table
+        now = time.monotonic()
+
+        while self.timers and self.timers[0][0] <= now:
+            _, slot, generation = heapq.heappop(self.timers)
+
+            with self.lock:
+                # Skip the deadlines of answered (or already retransmitted) probes.
+                if table.hosts[slot] is None or table.generations[slot] != generation:
+                    continue
+
+                retrying = table.attempts[slot] < self.retries
+                host = table.hosts[slot][0]
+
+                if retrying:
+                    table.attempts[slot] += 1
+
+            if self.on_timeout:
+                self.on_timeout(self.timing.get(host), retrying)
+
+            if retrying:
+                self.send(slot)
+            else:
+                self.finish(slot, PORT_FILTERED)
+
+    def run(self, probes):
+        """Probes every (host, port) of the passed iterable, keeping up to window
+           probes outstanding, until every port has been classified.
+
+        Args:
+            probes: The (host, port) probes to scan.
+
+        Raises:
+            PermissionError: Raw sockets require root (or CAP_NET_RAW).
+        """
+
+        probes = iter(probes)
+        exhausted = False
+
+        self.stopping.clear()
+        self.receiver = Thread(target=self.receive_loop, daemon=True)
+        self.receiver.start()
+
+        try:
+            while True:
+                self.wakeup.clear()
+                self.expire()
+
+                # Fill the window with new probes, paced by the scheduler (the released
+                # probes of measured hosts go first, and the held back ones count towards it).
+                while len(self.table) < self.window:
+                    if probe := self.warmup.release():
+                        host, port = probe
+                    elif exhausted or len(self.table) + len(self.warmup) >= self.window:
+                        break
+                    else:
+                        try:
+                            host, port = next(probes)
+                        except StopIteration:
+                            exhausted = True
+                            continue
+
+                        if not self.warmup.admit(host, port):
+                            continue
+
+                    if self.scheduler and (delay := self.scheduler.reserve(host)):
+                        time.sleep(delay)
+                        self.expire()
+
+                    self.start(host, port)
+
+                if exhausted and not self.table and not self.warmup:
+                    break
+
+                # Sleep until the next deadline, a finished probe frees the window, or a tick.
+                wait = self.timers[0][0] - time.monotonic() if self.timers else SYN_TICK
+                self.wakeup.wait(min(max(wait, 0), SYN_TICK))
+        finally:
+            self.stopping.set()
+            self.receiver.join()
+            self.close_sockets()
@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/targets.py
+"""
+
+import random  # Random
+import ipaddress  # ip_address, ip_network
+
+MAX_TARGETS = 65536  # Largest amount of hosts a single target expression may expand to.
+PORT_MIN, PORT_MAX = 1, 65535  # Range of scannable ports.
+PORT_ORDERS = ("sequential", "top", "random")  # Orders the ports of a scan can be probed in.
+
+# The most frequently open TCP ports, most frequent first (based on nmap's
+# nmap-services frequencies), probed first by the "top" order and selected
+# by topN items of port expressions.
+TOP_PORTS = (
+    80, 23, 443, 21, 22, 25, 3389, 110, 445, 139, 143, 53, 135, 3306, 8080, 1723,
+    111, 995, 993, 5900, 1025, 587, 8888, 199, 1720, 465, 548, 113, 81, 6001, 10000,
+    514, 5060, 179, 1026, 2000, 8443, 8000, 32768, 554, 26, 1433, 49152, 2001, 515,
+    8008, 49154, 1027, 5666, 646, 5000, 5631, 631, 49153, 8081, 2049, 88, 79, 5800,
+    106, 2121, 1110, 49155, 6000, 513, 990, 5357, 427, 49156, 543, 544, 5101, 144,
+    7, 389, 8009, 3128, 444, 9999, 5009, 7070, 5190, 3000, 5432, 1900, 3986, 13,
+    1029, 9, 5051, 6646, 49157, 1028, 873, 1755, 2717, 4899, 9100, 119, 37
+)
+
+
+def expand_range(item: str) -> list:
+    """Expands an address range into the list of addresses it covers.
+
+    Both full ranges (10.0.0.1-10.0.0.20) and last octet ranges (10.0.0.1-20)
+    are accepted.
+
+    Args:
+        item: The address range to expand.
+
+    Returns:
+        list: Every address in the range (inclusive).
+    """
+
+    first, last = item.split("-", 1)
+    first = ipaddress.ip_address(first)
+
+    # A plain number replaces the last octet (or hextet) of the first address.
+    if last.isdigit() or (first.version == 6 and ":" not in last and "." not in last):
+        separator = "." if first.version == 4 else ":"
+        base = str(first).rsplit(separator, 1)[0]
+        last = f"{base}{separator}{last}"
+
+    last = ipaddress.ip_address(last)
+
+    # Validate that the range goes forwards.
+    if int(last) < int(first):
+        raise ValueError(f"range '{item}' ends before it starts")
+
+    # Validate the size of the range before creating it.
+    if int(last) - int(first) >= MAX_TARGETS:
+        raise ValueError(f"range '{item}' is larger than {MAX_TARGETS} hosts")
+
+    return [
+        str(ipaddress.ip_address(i)) for i in range(int(first), int(last) + 1)
+    ]
+
+
+def expand_network(item: str) -> list:
+    """Expands a CIDR block into the list of usable host addresses it covers.
+
+    Args:
+        item: The CIDR block to expand (ex. 192.168.1.0/24).
+
+    Returns:
+        list: Every host address in the network.
+    """
+
+    network = ipaddress.ip_network(item, strict=False)
+
+    # Validate the size of the network before creating it.
+    if network.num_addresses > MAX_TARGETS:
+        raise ValueError(f"network '{item}' is larger than {MAX_TARGETS} hosts")
+
+    # .hosts() skips the network and broadcast addresses, but is empty for
+    # single address networks (/32 and /128), which should still be scanned.
+    return [str(host) for host in network.hosts()] or [str(network.network_address)]
+
+
+def parse_targets(expression: str) -> list:
+    """Parses a target expression into the list of hosts it describes.
+
+    The expression is a comma and/or space separated list of host names,
+    IP addresses, CIDR blocks (10.0.0.0/24) and address ranges (10.0.0.1-20).
+
+    Args:
+        expression: The target expression to parse.
+
+    Returns:
+        list: The unique hosts in the order they were given.
+
+    Raises:
+        ValueError: An item of the expression is invalid or too large.
+    """
+
+    hosts = {}  # Dictionaries keep their insertion order, which removes duplicates in order.
+
+    # Iterate through each of the items in the expression.
+    for item in expression.replace(",", " ").split():
+        if "/" in item:
+            expanded = expand_network(item)
+        elif "-" in item and _is_address(item.split("-", 1)[0]):
+            expanded = expand_range(item)
+        else:
+            # Host names and single addresses are used as they are.
+            expanded = [item]
+
+        hosts.update(dict.fromkeys(expanded))
+
+        # Validate the total amount of targets so far.
+        if len(hosts) > MAX_TARGETS:
+            raise ValueError(f"targets expand to more than {MAX_TARGETS} hosts")
+
+    return list(hosts)
+
+
+def _is_address(text: str) -> bool:
+    """Returns whether the passed text is a valid IPv4 or IPv6 address."""
+
+    try:
+        ipaddress.ip_address(text)
+        return True
+    except ValueError:
+        return False
+
+
+def expand_ports(item: str) -> range:
+    """Expands a single item of a port expression into the ports it covers.
+
+    Args:
+        item: A port (80), a port range (1-1024) or the most common ports (top100).
+
+    Returns:
+        range: The ports of the item (or a tuple for topN items).
+    """
+
+    if item.startswith("top") and item[3:].isdigit():
+        count = int(item[3:])
+        # Validate that there are that many known ports.
+        if not 1 <= count <= len(TOP_PORTS):
+            raise ValueError(f"'{item}' must be between top1 and top{len(TOP_PORTS)}")
+
+        return TOP_PORTS[:count]
+
+    first, _, last = item.partition("-")
+
+    # Validate that the item is made of numbers.
+    if not first.isdigit() or not (last or first).isdigit():
+        raise ValueError(f"invalid port item '{item}'")
+
+    first, last = int(first), int(last or first)
+
+    # Validate the port range.
+    if not PORT_MIN <= first <= last <= PORT_MAX:
+        raise ValueError(f"port range '{item}' must be within {PORT_MIN}-{PORT_MAX} and go forwards")
+
+    return range(first, last + 1)
+
+
+def parse_ports(expression: str) -> list:
+    """Parses a port expression into the sorted list of ports it describes.
+
+    The expression is a comma and/or space separated list of ports (80), port
+    ranges (1-1024) and the most common ports (top100). Items starting with !
+    exclude their ports instead (ex. 1-1024,3306,!25).
+
+    Args:
+        expression: The port expression to parse.
+
+    Returns:
+        list: The unique ports in ascending order.
+
+    Raises:
+        ValueError: An item of the expression is invalid, or no ports are left.
+    """
+
+    included, excluded = set(), set()
+
+    # Iterate through each of the items in the expression.
+    for item in expression.replace(",", " ").split():
+        if item.startswith("!"):
+            excluded.update(expand_ports(item[1:]))
+        else:
+            included.update(expand_ports(item))
+
+    ports = sorted(included - excluded)
+
+    # Validate that something is left to scan.
+    if not ports:
+        raise ValueError(f"port expression '{expression}' contains no ports")
+
+    return ports
+
+
+def compress_ports(ports: list) -> str:
+    """Compresses sorted ports back into a port expression (ex. [1, 2, 3, 8] -> "1-3,8")."""
+
+    runs = []
+
+    for port in ports:
+        # Extend the previous run if this port continues it.
+        if runs and runs[-1][1] == port - 1:
+            runs[-1][1] = port
+        else:
+            runs.append([port, port])
+
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in runs)
+
+
+def order_ports(ports: list, order: str = PORT_ORDERS[0], seed: int = None) -> list:
+    """Orders the ports of a scan.
+
+    sequential: Ascending, as given.
+    top: The ports of TOP_PORTS first (most frequently open first), so likely open
+         ports are found in the first seconds, then the rest in a random order.
+    random: A random permutation, spreading the probes over the whole range
+            instead of hammering one contiguous block.
+
+    Args:
+        ports: The ports to order.
+        order: One of PORT_ORDERS.
+        seed: Seed of the random permutation (random if None).
+
+    Returns:
+        list: The ordered ports.
+    """
+
+    # Validate the requested order.
+    if order not in PORT_ORDERS:
+        raise ValueError(f"unknown port order '{order}'")
+
+    if order == "sequential":
+        return list(ports)
+
+    first = []
+
+    if order == "top":
+        # Pick out the top ports that are part of the scan, in frequency order.
+        wanted = set(ports)
+        first = [port for port in TOP_PORTS if port in wanted]
+        ports = wanted.difference(first)
+
+    rest = sorted(ports)
+    random.Random(seed).shuffle(rest)
+
+    return first + rest
@@ -0,0 +1,272 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/timing.py
+"""
+
+from collections import deque
+from threading import Lock
+
+TIMEOUT_INITIAL = 1.0  # Timeout used before a host has been measured (in seconds).
+TIMEOUT_MIN = 0.02  # Lowest timeout a host can be given (in seconds).
+TIMEOUT_MAX = 3.0  # Highest timeout a host can be given (in seconds).
+RTT_ALPHA = 1 / 8  # How much a new sample moves the smoothed RTT (RFC 6298).
+RTT_BETA = 1 / 4  # How much a new sample moves the RTT variation (RFC 6298).
+WARMUP_PROBES = 3  # Probes sent to an unmeasured host before an engine opens its whole window to it.
+
+
+class RttEstimator:
+    """Estimates a hosts round trip time and connect timeout in the style of
+       TCP's retransmission timer (RFC 6298).
+
+    Attributes:
+        srtt: The smoothed round trip time (None until the first sample).
+        rttvar: The round trip time variation.
+        timeout: The current connect timeout for the host.
+        minimum: The lowest timeout the host can be given.
+        maximum: The highest timeout the host can be given.
+        samples: The amount of round trip times measured.
+        timeouts: The amount of probes that timed out.
+        retries: The amount of probes that were sent again after timing out.
+    """
+
+    def __init__(
+        self,
+        initial: float = TIMEOUT_INITIAL,
+        minimum: float = TIMEOUT_MIN,
+        maximum: float = TIMEOUT_MAX
+    ):
+        self.srtt = None
+        self.rttvar = 0.0
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.timeout = min(max(initial, minimum), maximum)
+
+        self.samples = 0
+        self.timeouts = 0
+        self.retries = 0
+
+        self.lock = Lock()
+
+    def observe(self, rtt: float):
+        """Updates the estimate with a measured round trip time.
+
+        Args:
+            rtt: The measured round trip time (in seconds).
+        """
+
+        with self.lock:
+            if self.srtt is None:
+                # The first sample sets the estimate directly.
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                # Later samples are smoothed into the estimate
+                # (the variation is updated first, using the old srtt).
+                self.rttvar += RTT_BETA * (abs(self.srtt - rtt) - self.rttvar)
+                self.srtt += RTT_ALPHA * (rtt - self.srtt)
+
+            self.samples += 1
+
+            # Give the host its smoothed RTT plus 4 deviations, within the bounds.
+            self.timeout = min(max(self.srtt + 4 * self.rttvar, self.minimum),
+                               self.maximum)
+
+    def observe_timeout(self, retrying: bool = False):
+        """Counts a probe that timed out.
+
+        Args:
+            retrying: Whether the probe is going to be sent again.
+        """
+
+        with self.lock:
+            self.timeouts += 1
+
+            if retrying:
+                self.retries += 1
+
+    def backoff(self, attempt: int) -> float:
+        """Returns the timeout to use for a probe, doubling it for each retry so that
+           a response slower than the current estimate can still be caught.
+
+        Args:
+            attempt: How many times the probe has already been sent.
+
+        Returns:
+            float: The timeout to use (in seconds).
+        """
+
+        return min(self.timeout * (2 ** attempt), self.maximum)
+
+    @property
+    def stats(self) -> dict:
+        """Returns the timing of the host.
+
+        Returns:
+            dict: The current timeout, smoothed RTT, variation and probe counters.
+        """
+
+        return {
+            "timeout": self.timeout,
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "samples": self.samples,
+            "timeouts": self.timeouts,
+            "retries": self.retries
+        }
+
+
+class TimingTable:
+    """Keeps a RttEstimator for each scanned host.
+
+    Attributes:
+        initial: The timeout new hosts start with.
+        minimum: The lowest timeout a host can be given.
+        maximum: The highest timeout a host can be given.
+        hosts: The estimator of each host.
+    """
+
+    def __init__(
+        self,
+        initial: float = TIMEOUT_INITIAL,
+        minimum: float = TIMEOUT_MIN,
+        maximum: float = TIMEOUT_MAX
+    ):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+
+        self.hosts = {}
+        self.lock = Lock()
+
+    def get(self, host: str) -> RttEstimator:
+        """Returns the estimator of the passed host, creating it if needed.
+
+        Args:
+            host: The host to get the estimator of.
+
+        Returns:
+            RttEstimator: The hosts estimator.
+        """
+
+        # Avoid the lock for hosts that already have an estimator.
+        if estimator := self.hosts.get(host):
+            return estimator
+
+        with self.lock:
+            return self.hosts.setdefault(
+                host, RttEstimator(self.initial, self.minimum, self.maximum))
+
+    def report(self) -> dict:
+        """Returns the timing of every host.
+
+        Returns:
+            dict: The stats of each hosts estimator.
+        """
+
+        return {host: estimator.stats for host, estimator in self.hosts.items()}
+
+
+class WarmUpGate:
+    """Holds back the probes of hosts whose RTT hasn't been measured yet, so that a
+       windowed engine doesn't send its whole window to a host with TIMEOUT_INITIAL
+       (far too long on a LAN).
+
+    The first WARMUP_PROBES probes of a host are let through straight away, and the
+    others are held until one of them is answered, or all of them finished (as the
+    host may well be filtered). Hosts already measured (e.g., seeded from their ping
+    RTT) are never held back. The engine reports every finished probe from any
+    thread, and takes the released probes back from its sending loop.
+
+    Attributes:
+        timing: TimingTable of the measured hosts.
+        probes: Probes let through to an unmeasured host before holding the others.
+        warmups: The (probes let through, probes finished) of each unmeasured host.
+        held: The ports held back of each unmeasured host.
+        released: The (host, port) probes to send, their host having been measured.
+        measured: The hosts whose probes are no longer held back.
+    """
+
+    def __init__(self, timing: TimingTable, probes: int = WARMUP_PROBES):
+        self.timing = timing
+        self.probes = probes
+
+        self.warmups = {}
+        self.held = {}
+        self.released = deque()
+        self.measured = set()
+        self.count = 0
+
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        """Returns the amount of probes held back or waiting to be sent."""
+
+        return self.count
+
+    def admit(self, host: str, port: int) -> bool:
+        """Decides whether a probe can be sent now, holding it back otherwise.
+
+        Args:
+            host: The host about to be probed.
+            port: The port about to be probed.
+
+        Returns:
+            bool: Whether to send the probe now (it is sent from release otherwise).
+        """
+
+        if host in self.measured:
+            return True
+
+        with self.lock:
+            if self.timing.get(host).samples:
+                self.release_locked(host)
+                return True
+
+            warmup = self.warmups.setdefault(host, [0, 0])
+
+            if warmup[0] < self.probes:
+                warmup[0] += 1
+                return True
+
+            self.held.setdefault(host, []).append(port)
+            self.count += 1
+            return False
+
+    def finished(self, host: str):
+        """
+        Counts a finished probe of a host, releasing its held probes once it has
+        been measured or every one of its warm-up probes has finished.
+        """
+
+        if host in self.measured:
+            return
+
+        with self.lock:
+            warmup = self.warmups.setdefault(host, [0, 0])
+            warmup[1] += 1
+
+            if self.timing.get(host).samples or warmup[1] >= self.probes:
+                self.release_locked(host)
+
+    def release(self) -> tuple:
+        """Returns the next released (host, port) probe to send (None if there is none)."""
+
+        with self.lock:
+            if not self.released:
+                return None
+
+            self.count -= 1
+            return self.released.popleft()
+
+    def release_locked(self, host: str):
+        """
+        Stops holding back the probes of a host (the lock must already be held).
+        """
+
+        self.measured.add(host)
+        self.warmups.pop(host, None)
+
+        self.released.extend((host, port) for port in self.held.pop(host, ()))
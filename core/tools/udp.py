@@ -0,0 +1,399 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/udp.py
+"""
+
+import time  # monotonic
+import heapq  # heappush, heappop
+import socket  # socket, SOCK_DGRAM, MSG_ERRQUEUE
+import struct  # unpack_from
+import asyncio  # sleep, wait_for, Event, get_running_loop
+
+from core.tools.results import PORT_OPEN, PORT_CLOSED, PORT_FILTERED
+from core.tools.timing import WarmUpGate
+from core.tools.limits import is_resource_error
+
+UDP_SOCKETS = 4  # Sockets each address family sends its probes from.
+UDP_WINDOW = 1000  # Default most probes waiting for a reply at once.
+UDP_RETRIES = 2  # How many times an unanswered probe is sent again.
+UDP_TICK = 0.05  # Longest time the engine sleeps between checking its timers (in seconds).
+UDP_READ = 4096  # Most bytes read from a reply.
+UDP_BATCH = 1024  # Most replies read from a socket at once (so one socket can't hog the loop).
+UDP_BUFFER = 1 << 20  # Receive buffer of each socket (in bytes).
+
+# Linux socket options missing from some Python builds.
+IP_RECVERR = getattr(socket, "IP_RECVERR", 11)
+IPV6_RECVERR = getattr(socket, "IPV6_RECVERR", 25)
+MSG_ERRQUEUE = getattr(socket, "MSG_ERRQUEUE", 0x2000)
+
+SO_EE_ORIGIN_ICMP = 2  # The error came from an ICMP message.
+SO_EE_ORIGIN_ICMP6 = 3  # The error came from an ICMPv6 message.
+SOCK_EXTENDED_ERR = struct.Struct("=IBBBB")  # errno, origin, type, code, pad.
+
+# A payload that gets a reply from the service usually found on each port, along
+# with the services name (an empty datagram is sent to every other port).
+UDP_PAYLOADS = {
+    # DNS: Query the root name servers.
+    53: ("dns", bytes.fromhex("a5a5 0100 0001 0000 0000 0000 00 0002 0001")),
+    # TFTP: Read request of a file.
+    69: ("tftp", b"\x00\x01index.html\x00octet\x00"),
+    # NTP: Version 3 client request.
+    123: ("ntp", b"\x1b" + bytes(47)),
+    # NetBIOS: Node status request.
+    137: ("netbios-ns", bytes.fromhex("a5a5 0000 0001 0000 0000 0000 20")
+          + b"CKAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA" + bytes.fromhex("00 0021 0001")),
+    # SNMP: Version 1 get-request of sysDescr.0 with the public community.
+    161: ("snmp", bytes.fromhex("3029 020100 0406 7075626c6963 a01c 0204a5a5a5a5 020100 020100"
+                                "300e 300c 0608 2b06010201010100 0500")),
+    # SSDP (UPnP): Discovery request.
+    1900: ("ssdp", b"M-SEARCH * HTTP/1.1\r\nHOST: 239.255.255.250:1900\r\n"
+                   b"MAN: \"ssdp:discover\"\r\nMX: 1\r\nST: ssdp:all\r\n\r\n"),
+    # mDNS: Query the advertised services.
+    5353: ("mdns", bytes.fromhex("0000 0000 0001 0000 0000 0000")
+           + b"\x09_services\x07_dns-sd\x04_udp\x05local\x00" + bytes.fromhex("000c 0001")),
+}
+
+
+class UdpProbe:
+    """An outstanding UDP probe.
+
+    Attributes:
+        hosts: The hosts waiting for the probe (several if their names share an address).
+        address: The address the probe is sent to.
+        port: The probed port.
+        family: The address family of the address.
+        attempt: How many times the probe has been sent again.
+        sent: When the probe was last sent (time.monotonic).
+        first: When the probe was first sent (time.monotonic).
+    """
+
+    __slots__ = ("hosts", "address", "port", "family", "attempt", "sent", "first")
+
+    def __init__(self, host: str, family: int, address: str, port: int):
+        self.hosts = [host]
+        self.family = family
+        self.address = address
+        self.port = port
+        self.attempt = 0
+        self.sent = self.first = 0.0
+
+
+class UdpScanEngine:
+    """Scans UDP ports from a few non-blocking sockets shared by every probe.
+
+    Probes carry a payload for the service usually found on their port (see
+    UDP_PAYLOADS). Outstanding probes are kept in a dictionary keyed by their
+    (address, port), with their retransmission deadlines in a heap, so tens of
+    thousands of ports only cost a dictionary entry each. The sockets use
+    IP_RECVERR, so ICMP errors are read back from their error queues along with
+    the address and port of the probe that caused them:
+
+        A reply from the port: PORT_OPEN.
+        ICMP port unreachable: PORT_CLOSED.
+        Any other ICMP unreachable, or no reply after every retransmission:
+        PORT_FILTERED (open|filtered, as silence doesn't prove the port closed).
+
+    Attributes:
+        resolver: The Resolver (or the scans PinnedResolver) used to look up each hosts address.
+        timing: TimingTable giving the retransmission timeout of each host.
+        scheduler: ProbeScheduler pacing the probes (None for no pacing, the
+                   outcomes are left to on_result to report).
+        on_result: Called with (host, port, status, latency, service) for each port.
+        on_timeout: Called with (estimator, retrying) for each unanswered probe.
+        retries: How many times an unanswered probe is sent again.
+        window: Most probes waiting for a reply at once.
+        warmup: WarmUpGate holding back the probes of hosts that haven't been measured yet.
+        outstanding: The probes waiting for a reply, by (address, port).
+        timers: Heap of the (deadline, address, port, attempt) of each sent probe.
+    """
+
+    def __init__(
+        self,
+        resolver,
+        timing,
+        scheduler=None,
+        on_result: callable = None,
+        on_timeout: callable = None,
+        retries: int = UDP_RETRIES,
+        window: int = UDP_WINDOW
+    ):
+        self.resolver = resolver
+        self.timing = timing
+        self.scheduler = scheduler
+        self.on_result = on_result
+        self.on_timeout = on_timeout
+        self.retries = retries
+        self.window = max(1, window)
+        self.warmup = WarmUpGate(timing)
+
+        self.outstanding = {}
+        self.timers = []
+        self.sockets = {}
+        self.sent = 0
+
+        self.wakeup = None
+
+    def open_sockets(self, family: int) -> list:
+        """Returns the sockets of an address family, opening them the first time."""
+
+        if sockets := self.sockets.get(family):
+            return sockets
+
+        sockets = []
+
+        for _ in range(UDP_SOCKETS):
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_BUFFER)
+
+            # Queue ICMP errors (with the probe that caused them) on the socket.
+            if family == socket.AF_INET6:
+                sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+            else:
+                sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+
+            asyncio.get_running_loop().add_reader(sock.fileno(), self.receive, sock)
+            sockets.append(sock)
+
+        self.sockets[family] = sockets
+        return sockets
+
+    def close_sockets(self):
+        """
+        Stops reading from and closes every socket.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        for sockets in self.sockets.values():
+            for sock in sockets:
+                loop.remove_reader(sock.fileno())
+                sock.close()
+
+        self.sockets.clear()
+
+    def start(self, host: str, port: int):
+        """Starts probing a hosts port.
+
+        Args:
+            host: The host to probe.
+            port: The port to probe.
+        """
+
+        try:
+            # Look up the hosts address (cached after the first port).
+            family, address = self.resolver.resolve(host)
+        except socket.gaierror:
+            # The host can't be resolved, so assume that the port is closed.
+            self.report(host, port, PORT_CLOSED, 0.0)
+            return
+
+        # Hosts whose names share an address wait on the same probe.
+        if probe := self.outstanding.get((address, port)):
+            probe.hosts.append(host)
+            return
+
+        probe = self.outstanding[(address, port)] = UdpProbe(host, family, address, port)
+        self.send(probe)
+
+    def send(self, probe: UdpProbe):
+        """
+        Sends (or sends again) a probe, scheduling its retransmission deadline.
+        """
+
+        _, payload = UDP_PAYLOADS.get(probe.port, ("", b""))
+        sockets = self.open_sockets(probe.family)
+        sock = sockets[probe.port % len(sockets)]
+
+        for _ in range(2):
+            try:
+                sock.sendto(payload, (probe.address, probe.port))
+                break
+            except BlockingIOError:
+                # The send buffer is full, so let the retransmission send it.
+                break
+            except ConnectionRefusedError:
+                # An ICMP error of an earlier probe was reported here instead of
+                # by the error queue (which still holds it), so send again.
+                continue
+            except OSError as error:
+                # Out of buffers, so let the retransmission send it.
+                if is_resource_error(error):
+                    break
+
+                # Any other error (e.g., unreachable) won't change when retried.
+                self.finish(probe, PORT_CLOSED)
+                return
+
+        probe.sent = time.monotonic()
+        probe.first = probe.first or probe.sent
+        self.sent += 1
+
+        timeout = self.timing.get(probe.hosts[0]).backoff(probe.attempt)
+        heapq.heappush(self.timers, (probe.sent + timeout, probe.address, probe.port, probe.attempt))
+
+    def finish(self, probe: UdpProbe, status: int, reply: bytes = None):
+        """
+        Completes a probe, reporting the status of the port to every waiting host.
+        """
+
+        if self.outstanding.pop((probe.address, probe.port), None) is None:
+            return
+
+        now = time.monotonic()
+
+        # Only replies to probes that weren't retransmitted are timed (Karn's algorithm).
+        if status != PORT_FILTERED and not probe.attempt:
+            self.timing.get(probe.hosts[0]).observe(now - probe.sent)
+
+        # Name the service of ports that replied to their payload.
+        service = None
+        if reply is not None:
+            name, _ = UDP_PAYLOADS.get(probe.port, ("unknown", b""))
+            service = name, f"{len(reply)} byte reply"
+
+        for host in probe.hosts:
+            self.report(host, probe.port, status, now - probe.first, service)
+
+        # Let the engine send the next probe straight away.
+        if self.wakeup:
+            self.wakeup.set()
+
+    def report(self, host: str, port: int, status: int, latency: float, service: tuple = None):
+        self.warmup.finished(host)
+
+        if self.on_result:
+            self.on_result(host, port, status, latency, service)
+
+    def receive(self, sock: socket.socket):
+        """
+        Reads every waiting reply and ICMP error of a socket (called by the event loop).
+        """
+
+        for _ in range(UDP_BATCH):
+            try:
+                reply, address = sock.recvfrom(UDP_READ)
+            except BlockingIOError:
+                break
+            except OSError:
+                # An ICMP error is pending, it is read from the error queue below.
+                continue
+
+            if probe := self.outstanding.get(address[:2]):
+                self.finish(probe, PORT_OPEN, reply)
+
+        self.receive_errors(sock)
+
+    def receive_errors(self, sock: socket.socket):
+        """
+        Reads the ICMP errors queued on a socket, classifying the probes that caused them.
+        """
+
+        for _ in range(UDP_BATCH):
+            try:
+                _, ancdata, _, address = sock.recvmsg(UDP_READ, 512, MSG_ERRQUEUE)
+            except OSError:
+                # BlockingIOError once the queue is empty.
+                break
+
+            if not address or not (probe := self.outstanding.get(address[:2])):
+                continue
+
+            for level, kind, data in ancdata:
+                if kind not in (IP_RECVERR, IPV6_RECVERR) or len(data) < SOCK_EXTENDED_ERR.size:
+                    continue
+
+                _, origin, icmp_type, icmp_code, _ = SOCK_EXTENDED_ERR.unpack_from(data)
+
+                if origin == SO_EE_ORIGIN_ICMP:
+                    # Destination unreachable (3), port unreachable (3).
+                    closed = (icmp_type, icmp_code) == (3, 3)
+                elif origin == SO_EE_ORIGIN_ICMP6:
+                    # Destination unreachable (1), port unreachable (4).
+                    closed = (icmp_type, icmp_code) == (1, 4)
+                else:
+                    continue
+
+                self.finish(probe, PORT_CLOSED if closed else PORT_FILTERED)
+                break
+
+    def expire(self):
+        """
+        Retransmits the probes whose deadline passed, giving up on the ones out of retries.
+        """
+
+        now = time.monotonic()
+
+        while self.timers and self.timers[0][0] <= now:
+            _, address, port, attempt = heapq.heappop(self.timers)
+            probe = self.outstanding.get((address, port))
+
+            # Skip the deadlines of answered (or already retransmitted) probes.
+            if not probe or probe.attempt != attempt:
+                continue
+
+            retrying = probe.attempt < self.retries
+
+            if self.on_timeout:
+                self.on_timeout(self.timing.get(probe.hosts[0]), retrying)
+
+            if retrying:
+                probe.attempt += 1
+                self.send(probe)
+            else:
+                self.finish(probe, PORT_FILTERED)
+
+    async def run(self, probes):
+        """Probes every (host, port) of the passed iterable, keeping up to window
+           probes outstanding, until every port has been classified.
+
+        Args:
+            probes: The (host, port) probes to scan.
+        """
+
+        probes = iter(probes)
+        exhausted = False
+        self.wakeup = asyncio.Event()
+
+        try:
+            while True:
+                self.expire()
+
+                # Fill the window with new probes, paced by the scheduler (the released
+                # probes of measured hosts go first, and the held back ones count towards it).
+                while len(self.outstanding) < self.window:
+                    if probe := self.warmup.release():
+                        host, port = probe
+                    elif exhausted or len(self.outstanding) + len(self.warmup) >= self.window:
+                        break
+                    else:
+                        try:
+                            host, port = next(probes)
+                        except StopIteration:
+                            exhausted = True
+                            continue
+
+                        if not self.warmup.admit(host, port):
+                            continue
+
+                    if self.scheduler and (delay := self.scheduler.reserve(host)):
+                        await asyncio.sleep(delay)
+                        self.expire()
+
+                    self.start(host, port)
+
+                if exhausted and not self.outstanding and not self.warmup:
+                    break
+
+                # Sleep until the next deadline, a finished probe frees the window, or a tick.
+                wait = self.timers[0][0] - time.monotonic() if self.timers else UDP_TICK
+                self.wakeup.clear()
+
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), min(max(wait, 0), UDP_TICK))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.close_sockets()
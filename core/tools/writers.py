@@ -0,0 +1,424 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: core/tools/writers.py
+"""
+
+import io  # StringIO
+import csv  # writer, reader
+import json  # dumps, loads
+import time  # monotonic
+import struct  # Struct
+
+from abc import ABC, abstractmethod
+from threading import Lock
+
+from core.tools.results import STATUS_NAMES, PORT_OPEN
+from core.tools.util import write_scan_output
+
+WRITER_FORMATS = ("csv", "ndjson", "binary")  # Available streaming formats.
+FLUSH_BATCH = 512  # How many results to buffer before writing them to the file.
+FLUSH_INTERVAL = 1.0  # Longest time results stay buffered (in seconds).
+
+CSV_HEADERS = ["host", "port", "status", "state", "time", "latency", "service", "banner"]
+
+BINARY_MAGIC = b"SASCAN2\n"  # Identifies the binary stream format (and its version).
+BINARY_MAGICS = (BINARY_MAGIC, b"SASCAN1\n")  # Readable versions (1 has no service records).
+BINARY_HOST = struct.Struct("<cH")  # b"H", length of the host name (followed by it).
+BINARY_PORT = struct.Struct("<cIHBdH")  # b"P", host id, port, status, time, latency.
+BINARY_SERVICE = struct.Struct("<cIHBH")  # b"S", host id, port, service and banner
+# lengths (followed by them), describing the port record before it.
+
+
+class StreamWriter(ABC):
+    """Writes scan results to a file in buffered batches while the scan runs,
+       so that an interrupted scan keeps everything scanned up until then.
+
+    Attributes:
+        output_file: Where to write the results.
+        batch: How many results to buffer before flushing them.
+        interval: Longest time results stay buffered (in seconds).
+        buffer: The results waiting to be written.
+        written: The amount of results written so far.
+    """
+
+    format = ""
+
+    def __init__(
+        self,
+        output_file: str,
+        batch: int = FLUSH_BATCH,
+        interval: float = FLUSH_INTERVAL,
+        append: bool = False
+    ):
+        self.output_file = output_file
+        self.batch = batch
+        self.interval = interval
+
+        self.buffer = []
+        self.written = 0
+        self.flushed = time.monotonic()
+
+        # Results are written from every scanning thread.
+        self.lock = Lock()
+
+        # Only write the header to new (or empty) files.
+        self.file = open(output_file, "ab" if append else "wb")
+
+        if self.file.tell() == 0:
+            self.file.write(self.header())
+
+    def header(self) -> bytes:
+        """Returns the bytes written at the start of a new file."""
+
+        return b""
+
+    @abstractmethod
+    def encode(self, rows: list) -> bytes:
+        """Encodes a batch of results into the formats bytes.
+
+        Args:
+            rows: The (host, port, status, time, latency, service, banner) results to encode.
+
+        Returns:
+            bytes: The encoded results.
+        """
+
+    def write(
+        self,
+        host: str,
+        port: int,
+        status: int,
+        when: float,
+        latency: float,
+        service: str = "",
+        banner: str = ""
+    ):
+        """Buffers a scanned port, flushing the buffer once it is full or old enough.
+
+        Args:
+            host: The host of the scanned port.
+            port: The scanned port.
+            status: The ports status (PORT_OPEN, PORT_CLOSED or PORT_FILTERED).
+            when: When the port was scanned (time.time).
+            latency: How long the port took to answer (in seconds).
+            service: The service identified on an open port (blank if not fingerprinted).
+            banner: The banner read from an open port (blank if none).
+        """
+
+        with self.lock:
+            self.buffer.append((host, port, status, when, latency, service, banner))
+
+            if len(self.buffer) >= self.batch or time.monotonic() - self.flushed >= self.interval:
+                self.flush_locked()
+
+    def flush(self):
+        """
+        Writes every buffered result to the file.
+        """
+
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        """
+        Writes every buffered result to the file (the lock must already be held).
+        """
+
+        if self.buffer and not self.file.closed:
+            self.file.write(self.encode(self.buffer))
+            self.file.flush()
+
+            self.written += len(self.buffer)
+            self.buffer.clear()
+
+        self.flushed = time.monotonic()
+
+    def close(self):
+        """
+        Flushes the remaining results and closes the file.
+        """
+
+        with self.lock:
+            self.flush_locked()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class CsvStreamWriter(StreamWriter):
+    """Streams results as CSV rows (in the order they were scanned)."""
+
+    format = "csv"
+
+    def header(self) -> bytes:
+        return (",".join(CSV_HEADERS) + "\r\n").encode()
+
+    def encode(self, rows: list) -> bytes:
+        text = io.StringIO()
+        writer = csv.writer(text)
+
+        for host, port, status, when, latency, service, banner in rows:
+            writer.writerow([host, port, status == PORT_OPEN, STATUS_NAMES[status],
+                             f"{when:.3f}", f"{latency * 1000:.2f}", service, banner])
+
+        return text.getvalue().encode()
+
+
+class NdjsonStreamWriter(StreamWriter):
+    """Streams results as newline delimited JSON objects."""
+
+    format = "ndjson"
+
+    def encode(self, rows: list) -> bytes:
+        lines = []
+
+        for host, port, status, when, latency, service, banner in rows:
+            row = {
+                "host": host,
+                "port": port,
+                "state": STATUS_NAMES[status],
+                "time": round(when, 3),
+                "latency": round(latency * 1000, 2)
+            }
+
+            # Only fingerprinted ports carry their service.
+            if service:
+                row.update(service=service, banner=banner)
+
+            lines.append(json.dumps(row) + "\n")
+
+        return "".join(lines).encode()
+
+
+class BinaryStreamWriter(StreamWriter):
+    """Streams results as fixed size binary records (18 bytes per port).
+
+    Each host name is written once as a host record, with the port records
+    referring to it by its id (the order it was written in). Fingerprinted
+    ports are followed by a service record holding their service and banner.
+
+    Attributes:
+        host_ids: The id given to each written host name.
+    """
+
+    format = "binary"
+
+    def __init__(self, *args, **kwargs):
+        self.host_ids = {}
+
+        super().__init__(*args, **kwargs)
+
+        # Appending to an existing file continues its host ids.
+        if self.file.tell() > len(BINARY_MAGIC):
+            for host in read_binary_hosts(self.output_file):
+                self.host_ids.setdefault(host, len(self.host_ids))
+
+    def header(self) -> bytes:
+        return BINARY_MAGIC
+
+    def encode(self, rows: list) -> bytes:
+        data = bytearray()
+
+        for host, port, status, when, latency, service, banner in rows:
+            # Write the host name the first time it is seen.
+            if (host_id := self.host_ids.get(host)) is None:
+                host_id = self.host_ids[host] = len(self.host_ids)
+                name = host.encode()
+                data += BINARY_HOST.pack(b"H", len(name)) + name
+
+            data += BINARY_PORT.pack(b"P", host_id, port, status, when,
+                                     min(int(latency * 10000), 0xFFFF))
+
+            if service:
+                service, banner = service.encode()[:0xFF], banner.encode()[:0xFFFF]
+                data += BINARY_SERVICE.pack(b"S", host_id, port, len(service), len(banner))
+                data += service + banner
+
+        return bytes(data)
+
+
+# The writer class of each streaming format.
+WRITERS = {
+    "csv": CsvStreamWriter,
+    "ndjson": NdjsonStreamWriter,
+    "binary": BinaryStreamWriter
+}
+
+
+def guess_format(output_file: str) -> str:
+    """Guesses the streaming format of a file from its extension (defaults to csv).
+
+    Args:
+        output_file: The file to guess the format of.
+
+    Returns:
+        str: The streaming format ("csv", "ndjson" or "binary").
+    """
+
+    extension = output_file.rsplit(".", 1)[-1].lower()
+
+    if extension in ("ndjson", "jsonl", "json"):
+        return "ndjson"
+
+    if extension in ("bin", "scan"):
+        return "binary"
+
+    return "csv"
+
+
+def open_writer(output_file: str, format: str = "", **options) -> StreamWriter:
+    """Opens the streaming writer of the passed format (guessed if blank).
+
+    Args:
+        output_file: Where to write the results.
+        format: The streaming format ("csv", "ndjson" or "binary").
+        **options: Passed on to the writer (batch, interval, append).
+
+    Returns:
+        StreamWriter: The opened writer.
+    """
+
+    format = format or guess_format(output_file)
+
+    # Validate the requested format.
+    if format not in WRITERS:
+        raise ValueError(f"unknown stream format '{format}'")
+
+    return WRITERS[format](output_file, **options)
+
+
+def read_binary_hosts(input_file: str) -> list:
+    """Returns the host names of a binary stream in the order of their ids."""
+
+    return [host for kind, host in _read_binary(input_file) if kind == "host"]
+
+
+def _read_binary(input_file: str):
+    """Generates the ("host", name), ("port", values) and ("service", values)
+       records of a binary stream."""
+
+    with open(input_file, "rb") as file_obj:
+        data = file_obj.read()
+
+    if not data.startswith(BINARY_MAGICS):
+        raise ValueError(f"'{input_file}' isn't a binary scan stream")
+
+    view = memoryview(data)
+    offset = len(BINARY_MAGIC)
+
+    while offset < len(view):
+        if view[offset:offset + 1] == b"H":
+            if offset + BINARY_HOST.size > len(view):
+                break
+
+            _, length = BINARY_HOST.unpack_from(view, offset)
+            offset += BINARY_HOST.size
+
+            yield "host", bytes(view[offset:offset + length]).decode()
+            offset += length
+        elif view[offset:offset + 1] == b"S":
+            if offset + BINARY_SERVICE.size > len(view):
+                break
+
+            _, host_id, port, service_length, banner_length = BINARY_SERVICE.unpack_from(view, offset)
+            offset += BINARY_SERVICE.size
+
+            # Stop at a record that was cut off by a crash.
+            if offset + service_length + banner_length > len(view):
+                break
+
+            service = bytes(view[offset:offset + service_length]).decode(errors="replace")
+            offset += service_length
+            banner = bytes(view[offset:offset + banner_length]).decode(errors="replace")
+            offset += banner_length
+
+            yield "service", (host_id, port, service, banner)
+        else:
+            # Stop at a record that was cut off by a crash.
+            if offset + BINARY_PORT.size > len(view):
+                break
+
+            yield "port", BINARY_PORT.unpack_from(view, offset)[1:]
+            offset += BINARY_PORT.size
+
+
+def read_stream(input_file: str, format: str = ""):
+    """Reads back the results of a streamed scan (including a partial one).
+
+    Args:
+        input_file: The streamed results file.
+        format: The streaming format (guessed from the extension if blank).
+
+    Yields:
+        tuple: The (host, port, status, time, latency) of each result.
+    """
+
+    format = format or guess_format(input_file)
+
+    if format == "binary":
+        hosts = []
+
+        for kind, record in _read_binary(input_file):
+            if kind == "host":
+                hosts.append(record)
+            elif kind == "port":
+                host_id, port, status, when, latency = record
+                yield hosts[host_id], port, status, when, latency / 10000
+
+    elif format == "ndjson":
+        with open(input_file) as file_obj:
+            for line in file_obj:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # Skip a line that was cut off by a crash.
+                    continue
+
+                yield (row["host"], row["port"], STATUS_NAMES.index(row["state"]),
+                       row["time"], row["latency"] / 1000)
+
+    else:
+        with open(input_file, newline="") as file_obj:
+            for row in csv.DictReader(file_obj):
+                try:
+                    yield (row["host"], int(row["port"]), STATUS_NAMES.index(row["state"]),
+                           float(row["time"]), float(row["latency"]) / 1000)
+                except (TypeError, ValueError):
+                    # Skip a row that was cut off by a crash.
+                    continue
+
+
+def write_sorted_csv(input_file: str, output_file: str, format: str = ""):
+    """Final pass turning a streamed results file into the sorted host, port and
+       status CSV written by the Scanner.
+
+    Args:
+        input_file: The streamed results file.
+        output_file: Where to write the sorted CSV.
+        format: The streaming format (guessed from the extension if blank).
+    """
+
+    order = {}
+    rows = {}
+
+    for host, port, status, _, _ in read_stream(input_file, format):
+        order.setdefault(host, len(order))
+
+        # Later results of the same port replace earlier ones.
+        rows[(host, port)] = status == PORT_OPEN
+
+    write_scan_output(
+        objects=[
+            {"host": host, "port": port, "status": status}
+            for (host, port), status in sorted(
+                rows.items(), key=lambda row: (order[row[0][0]], row[0][1]))
+        ],
+        headers=["host", "port", "status"],
+        output_file=output_file
+    )
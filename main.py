@@ -20,4 +20,7 @@ if __name__ == "__main__":
             interface.handle_input()
         except KeyboardInterrupt:
             std_warning("CTRL-C detected! Exiting", start="\n", end="...")
+
+            # Stop the sessions worker threads before exiting.
+            interface.shutdown()
             os._exit(0)
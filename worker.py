@@ -0,0 +1,25 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    @author:  Max
+    @package: worker.py
+"""
+
+import sys  # argv, exit
+
+from core import *
+
+
+if __name__ == "__main__":
+    # The coordinator address is printed when a distributed sweep starts.
+    if len(sys.argv) < 2:
+        print("Usage: python worker.py HOST:PORT [NAME]")
+        sys.exit(1)
+
+    try:
+        ScanWorker(sys.argv[1], *sys.argv[2:3]).run()
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:
+        std_error("Couldn't reach the coordinator", error=error)
+        sys.exit(1)